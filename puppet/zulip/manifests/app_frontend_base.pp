@@ -133,6 +133,7 @@ class zulip::app_frontend_base {
   $queues_multiprocess_default = $zulip::common::total_memory_mb > 3800
   $queues_multiprocess = zulipconf('application_server', 'queue_workers_multiprocess', $queues_multiprocess_default)
   $queues = [
+    'deferred_message_work',
     'deferred_work',
     'digest_emails',
     'email_mirror',
@@ -13,6 +13,7 @@ sys.path.append(ZULIP_PATH)
 from scripts.lib.zulip_tools import atomic_nagios_write, get_config, get_config_file
 
 normal_queues = [
+    "deferred_message_work",
     "deferred_work",
     "digest_emails",
     "email_mirror",
@@ -4,7 +4,8 @@ from typing import TypedDict
 from zerver.lib import retention
 from zerver.lib.message import event_recipient_ids_for_action_on_messages
 from zerver.lib.retention import move_messages_to_archive
-from zerver.models import Message, Realm, Stream, UserProfile
+from zerver.lib.topic import flush_topic_participants
+from zerver.models import Message, Realm, Recipient, Stream, UserProfile
 from zerver.tornado.django_api import send_event_on_commit
 
 
@@ -89,6 +90,7 @@ def do_delete_messages(
     move_messages_to_archive(message_ids, realm=realm, chunk_size=archiving_chunk_size)
     if message_type == "stream":
         check_update_first_message_id(realm, stream, message_ids, users_to_notify)
+        flush_topic_participants([(sample_message.recipient_id, sample_message.topic_name())])
 
     event["message_type"] = message_type
     send_event_on_commit(realm, event, users_to_notify)
@@ -102,4 +104,10 @@ def do_delete_messages_by_sender(user: UserProfile) -> None:
         .order_by("id")
     )
     if message_ids:
+        topics = (
+            Message.objects.filter(id__in=message_ids, recipient__type=Recipient.STREAM)
+            .values_list("recipient_id", "subject")
+            .distinct()
+        )
+        flush_topic_participants(list(topics))
         move_messages_to_archive(message_ids, chunk_size=retention.STREAM_MESSAGE_BATCH_SIZE)
@@ -59,6 +59,7 @@ from zerver.lib.topic import (
     RESOLVED_TOPIC_PREFIX,
     TOPIC_LINKS,
     TOPIC_NAME,
+    flush_topic_participants,
     messages_for_topic,
     participants_for_topic,
     save_message_for_edit_use_case,
@@ -800,6 +801,17 @@ def do_update_message(
     # freshly-fetched-from-the-database changed messages.
     changed_messages = save_changes_for_propagation_mode()
 
+    if topic_name is not None or new_stream is not None:
+        assert stream_being_edited is not None
+        assert stream_being_edited.recipient_id is not None
+        assert orig_topic_name is not None
+        flush_topic_participants(
+            [
+                (stream_being_edited.recipient_id, orig_topic_name),
+                (target_stream.recipient_id, target_topic_name),
+            ]
+        )
+
     realm_id: int | None = None
     if stream_being_edited is not None:
         realm_id = stream_being_edited.realm_id
@@ -1,6 +1,6 @@
 import logging
 from collections import defaultdict
-from collections.abc import Callable, Collection, Sequence
+from collections.abc import Callable, Collection, Mapping, Sequence
 from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from datetime import timedelta
@@ -11,7 +11,7 @@ import orjson
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.db.models import F, Q, QuerySet
+from django.db.models import Q, QuerySet
 from django.utils.html import escape
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
@@ -23,7 +23,7 @@ from zerver.actions.user_topics import (
     do_set_user_topic_visibility_policy,
 )
 from zerver.lib.addressee import Addressee
-from zerver.lib.alert_words import get_alert_word_automaton
+from zerver.lib.alert_words import alert_words_in_realm_id, get_alert_word_automaton
 from zerver.lib.cache import cache_with_key, user_profile_delivery_email_cache_key
 from zerver.lib.create_user import create_user
 from zerver.lib.exceptions import (
@@ -52,16 +52,12 @@ from zerver.lib.message import (
 )
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.muted_users import get_muting_users
-from zerver.lib.notification_data import (
-    UserMessageNotificationsData,
-    get_user_group_mentions_data,
-    user_allows_notifications_in_StreamTopic,
-)
+from zerver.lib.notification_data import UserMessageNotificationsData, get_user_group_mentions_data
 from zerver.lib.query_helpers import query_for_ids
 from zerver.lib.queue import queue_event_on_commit
 from zerver.lib.recipient_users import recipient_for_user_profiles
 from zerver.lib.stream_subscription import (
-    get_subscriptions_for_send_message,
+    get_stream_delivery_profile,
     num_subscribers_for_stream_id,
 )
 from zerver.lib.stream_topic import StreamTopicTarget
@@ -69,7 +65,7 @@ from zerver.lib.streams import access_stream_for_send_message, ensure_stream, su
 from zerver.lib.string_validation import check_stream_name
 from zerver.lib.thumbnail import get_user_upload_previews, rewrite_thumbnailed_images
 from zerver.lib.timestamp import timestamp_to_datetime
-from zerver.lib.topic import participants_for_topic
+from zerver.lib.topic import note_topic_participants, participants_for_topic
 from zerver.lib.url_preview.types import UrlEmbedData
 from zerver.lib.user_groups import is_any_user_in_group, is_user_in_group
 from zerver.lib.user_message import UserMessageLite, bulk_insert_ums
@@ -100,7 +96,7 @@ from zerver.models.recipients import get_direct_message_group_user_ids
 from zerver.models.scheduled_jobs import NotificationTriggers
 from zerver.models.streams import get_stream, get_stream_by_id_in_realm
 from zerver.models.users import get_system_bot, get_user_by_delivery_email, is_cross_realm_bot_email
-from zerver.tornado.django_api import send_event_on_commit
+from zerver.tornado.django_api import send_events_rollback_unsafe
 
 
 def compute_irc_user_fullname(email: str) -> str:
@@ -199,6 +195,12 @@ class ActiveUserDict(TypedDict):
     bot_type: int | None
 
 
+class MessageEventUserData(TypedDict):
+    id: int
+    flags: list[str]
+    mentioned_user_group_id: int | None
+
+
 @dataclass
 class SentMessageResult:
     message_id: int
@@ -253,89 +255,70 @@ def get_recipient_info(
             # misses this sender. This is useful when the sender is sending their first message
             # in the topic.
             topic_participant_user_ids.add(sender_id)
-        subscription_rows = (
-            get_subscriptions_for_send_message(
-                realm_id=realm_id,
-                stream_id=stream_topic.stream_id,
-                topic_name=stream_topic.topic_name,
-                possible_stream_wildcard_mention=possible_stream_wildcard_mention,
-                topic_participant_user_ids=topic_participant_user_ids,
-                possibly_mentioned_user_ids=possibly_mentioned_user_ids,
-            )
-            .annotate(
-                user_profile_email_notifications=F(
-                    "user_profile__enable_stream_email_notifications"
-                ),
-                user_profile_push_notifications=F("user_profile__enable_stream_push_notifications"),
-                user_profile_wildcard_mentions_notify=F("user_profile__wildcard_mentions_notify"),
-                followed_topic_email_notifications=F(
-                    "user_profile__enable_followed_topic_email_notifications"
-                ),
-                followed_topic_push_notifications=F(
-                    "user_profile__enable_followed_topic_push_notifications"
-                ),
-                followed_topic_wildcard_mentions_notify=F(
-                    "user_profile__enable_followed_topic_wildcard_mentions_notify"
-                ),
-            )
-            .values(
-                "user_profile_id",
-                "push_notifications",
-                "email_notifications",
-                "wildcard_mentions_notify",
-                "followed_topic_push_notifications",
-                "followed_topic_email_notifications",
-                "followed_topic_wildcard_mentions_notify",
-                "user_profile_email_notifications",
-                "user_profile_push_notifications",
-                "user_profile_wildcard_mentions_notify",
-                "is_muted",
-            )
-            .order_by("user_profile_id")
-        )
-
-        message_to_user_id_set = set()
-        for row in subscription_rows:
-            message_to_user_id_set.add(row["user_profile_id"])
-            # We store the 'sender_muted_stream' information here to avoid db query at
-            # a later stage when we perform automatically unmute topic in muted stream operation.
-            if row["user_profile_id"] == sender_id:
-                sender_muted_stream = row["is_muted"]
 
         user_id_to_visibility_policy = stream_topic.user_id_to_visibility_policy_dict()
+        topic_muted_user_ids: set[int] = set()
+        topic_unmuted_user_ids: set[int] = set()
+        followed_user_ids: set[int] = set()
+        for user_id, visibility_policy in user_id_to_visibility_policy.items():
+            if visibility_policy == UserTopic.VisibilityPolicy.MUTED:
+                topic_muted_user_ids.add(user_id)
+            elif visibility_policy == UserTopic.VisibilityPolicy.UNMUTED:
+                topic_unmuted_user_ids.add(user_id)
+            elif visibility_policy == UserTopic.VisibilityPolicy.FOLLOWED:
+                followed_user_ids.add(user_id)
+
+        profile = get_stream_delivery_profile(recipient.id)
+        message_to_user_id_set = set(profile.user_ids)
+
+        if not possible_stream_wildcard_mention and profile.long_term_idle_user_ids:
+            # Open realms often have 10,000s of long_term_idle
+            # subscribers in default streams, and it's expensive even
+            # to process them all in Python.  So we skip those who we
+            # can prove will not receive a UserMessage row or
+            # notification for the message: no alert words, mentions,
+            # or email/push notifications apply.
+            #
+            # This runs before the Markdown processor, so it keeps
+            # everyone who has ANY alert words, or matches the
+            # "possible mention" parameters; downstream logic, after
+            # rendering, makes the precise determination.
+            message_to_user_id_set -= (
+                profile.long_term_idle_user_ids
+                - profile.push_notifications_user_ids
+                - profile.email_notifications_user_ids
+                - possibly_mentioned_user_ids
+                - topic_participant_user_ids
+                - alert_words_in_realm_id(realm_id).keys()
+                - followed_user_ids
+            )
 
-        def notification_recipients(setting: str) -> set[int]:
-            return {
-                row["user_profile_id"]
-                for row in subscription_rows
-                if user_allows_notifications_in_StreamTopic(
-                    row["is_muted"],
-                    user_id_to_visibility_policy.get(
-                        row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
-                    ),
-                    row[setting],
-                    row["user_profile_" + setting],
-                )
-            }
+        # We store the 'sender_muted_stream' information here to avoid db query at
+        # a later stage when we perform automatically unmute topic in muted stream operation.
+        if sender_id in message_to_user_id_set:
+            sender_muted_stream = sender_id in profile.muted_user_ids
 
-        stream_push_user_ids = notification_recipients("push_notifications")
-        stream_email_user_ids = notification_recipients("email_notifications")
+        def notification_recipients(setting_user_ids: set[int]) -> set[int]:
+            # The same rules as user_allows_notifications_in_StreamTopic:
+            # muting the stream silences it unless the topic is unmuted,
+            # and muting the topic always does.
+            return (
+                (setting_user_ids - profile.muted_user_ids - topic_muted_user_ids)
+                | (setting_user_ids & profile.muted_user_ids & topic_unmuted_user_ids)
+            ) & message_to_user_id_set
 
-        def followed_topic_notification_recipients(setting: str) -> set[int]:
-            return {
-                row["user_profile_id"]
-                for row in subscription_rows
-                if user_id_to_visibility_policy.get(
-                    row["user_profile_id"], UserTopic.VisibilityPolicy.INHERIT
-                )
-                == UserTopic.VisibilityPolicy.FOLLOWED
-                and row["followed_topic_" + setting]
-            }
+        stream_push_user_ids = notification_recipients(profile.push_notifications_user_ids)
+        stream_email_user_ids = notification_recipients(profile.email_notifications_user_ids)
+
+        def followed_topic_notification_recipients(setting_user_ids: set[int]) -> set[int]:
+            return followed_user_ids & setting_user_ids & message_to_user_id_set
 
         followed_topic_email_user_ids = followed_topic_notification_recipients(
-            "email_notifications"
+            profile.followed_topic_email_notifications_user_ids
+        )
+        followed_topic_push_user_ids = followed_topic_notification_recipients(
+            profile.followed_topic_push_notifications_user_ids
         )
-        followed_topic_push_user_ids = followed_topic_notification_recipients("push_notifications")
 
         if possible_stream_wildcard_mention or possible_topic_wildcard_mention:
             # We calculate `wildcard_mentions_notify_user_ids` and `followed_topic_wildcard_mentions_notify_user_ids`
@@ -343,9 +326,13 @@ def get_recipient_info(
             # This is important so as to avoid unnecessarily sending huge user ID lists with
             # thousands of elements to the event queue (which can happen because these settings
             # are `True` by default for new users.)
-            wildcard_mentions_notify_user_ids = notification_recipients("wildcard_mentions_notify")
+            wildcard_mentions_notify_user_ids = notification_recipients(
+                profile.wildcard_mentions_notify_user_ids
+            )
             followed_topic_wildcard_mentions_notify_user_ids = (
-                followed_topic_notification_recipients("wildcard_mentions_notify")
+                followed_topic_notification_recipients(
+                    profile.followed_topic_wildcard_mentions_notify_user_ids
+                )
             )
 
         if possible_stream_wildcard_mention:
@@ -730,6 +717,22 @@ def create_user_messages(
     if message.recipient.type in [Recipient.DIRECT_MESSAGE_GROUP, Recipient.PERSONAL]:
         base_flags |= UserMessage.flags.is_private
 
+    # Most recipients of a message to a large channel get exactly the
+    # same flags; so rather than testing every recipient against each
+    # of the sets below, we only compute flags individually for the
+    # (usually few) recipients in one of those sets, and give everyone
+    # else default_flags.
+    default_flags = base_flags
+    special_user_ids = (
+        mark_as_read_user_ids | mentioned_user_ids | ids_with_alert_words
+    ) & um_eligible_user_ids
+    if limit_unread_user_ids is not None:
+        default_flags |= UserMessage.flags.read
+        special_user_ids |= limit_unread_user_ids & um_eligible_user_ids
+    if rendering_result.mentions_topic_wildcard:
+        special_user_ids |= topic_participant_user_ids & um_eligible_user_ids
+    default_user_ids = um_eligible_user_ids - special_user_ids
+
     # For long_term_idle (aka soft-deactivated) users, we are allowed
     # to optimize by lazily not creating UserMessage rows that would
     # have the default 0 flag set (since the soft-reactivation logic
@@ -749,8 +752,24 @@ def create_user_messages(
     #
     # See https://zulip.readthedocs.io/en/latest/subsystems/sending-messages.html#soft-deactivation
     # for details on this system.
-    user_messages = []
-    for user_profile_id in um_eligible_user_ids:
+    lazy_user_ids: AbstractSet[int] = set()
+    if is_stream_message:
+        lazy_user_ids = (
+            long_term_idle_user_ids
+            - stream_push_user_ids
+            - stream_email_user_ids
+            - followed_topic_push_user_ids
+            - followed_topic_email_user_ids
+        )
+
+    if int(default_flags) == 0:
+        default_user_ids -= lazy_user_ids
+    user_messages = [
+        UserMessageLite(user_profile_id, message.id, default_flags)
+        for user_profile_id in default_user_ids
+    ]
+
+    for user_profile_id in special_user_ids:
         flags = base_flags
         if user_profile_id in mark_as_read_user_ids or (
             limit_unread_user_ids is not None and user_profile_id not in limit_unread_user_ids
@@ -766,15 +785,7 @@ def create_user_messages(
         ):
             flags |= UserMessage.flags.topic_wildcard_mentioned
 
-        if (
-            user_profile_id in long_term_idle_user_ids
-            and user_profile_id not in stream_push_user_ids
-            and user_profile_id not in stream_email_user_ids
-            and user_profile_id not in followed_topic_push_user_ids
-            and user_profile_id not in followed_topic_email_user_ids
-            and is_stream_message
-            and int(flags) == 0
-        ):
+        if user_profile_id in lazy_user_ids and int(flags) == 0:
             continue
 
         um = UserMessageLite(
@@ -835,6 +846,43 @@ def get_active_presence_idle_user_ids(
     return filter_presence_idle_user_ids(user_ids)
 
 
+def follow_topic_for_mentioned_users(
+    stream: Stream, topic_name: str, mentioned_user_ids: set[int]
+) -> None:
+    expect_follow_user_profiles = set(
+        UserProfile.objects.filter(
+            realm_id=stream.realm_id,
+            id__in=mentioned_user_ids,
+            automatically_follow_topics_where_mentioned=True,
+        )
+    )
+    if len(expect_follow_user_profiles) == 0:
+        return
+
+    user_topics_query_set = UserTopic.objects.filter(
+        user_profile__in=expect_follow_user_profiles,
+        stream_id=stream.id,
+        topic_name__iexact=topic_name,
+        visibility_policy__in=[
+            # Explicitly muted takes precedence over this setting.
+            UserTopic.VisibilityPolicy.MUTED,
+            # Already followed
+            UserTopic.VisibilityPolicy.FOLLOWED,
+        ],
+    )
+    skip_follow_users = {user_topic.user_profile for user_topic in user_topics_query_set}
+
+    to_follow_users = list(expect_follow_user_profiles - skip_follow_users)
+
+    if to_follow_users:
+        bulk_do_set_user_topic_visibility_policy(
+            user_profiles=to_follow_users,
+            stream=stream,
+            topic_name=topic_name,
+            visibility_policy=UserTopic.VisibilityPolicy.FOLLOWED,
+        )
+
+
 @transaction.atomic(savepoint=False)
 def do_send_messages(
     send_message_requests_maybe_none: Sequence[SendMessageRequest | None],
@@ -916,33 +964,64 @@ def do_send_messages(
             topic_participant_user_ids=send_request.topic_participant_user_ids,
         )
 
+        # Most recipients share the same flags, so we only convert
+        # each distinct flags value to a list once; each recipient
+        # still gets its own copy, since the list is modified below.
+        flags_lists: dict[int, list[str]] = {}
+        message_flags = user_message_flags[send_request.message.id]
         for um in user_messages:
-            user_message_flags[send_request.message.id][um.user_profile_id] = um.flags_list()
+            if um.flags not in flags_lists:
+                flags_lists[um.flags] = um.flags_list()
+            message_flags[um.user_profile_id] = list(flags_lists[um.flags])
 
         ums.extend(user_messages)
 
-        send_request.service_queue_events = get_service_bot_events(
-            sender=send_request.message.sender,
-            service_bot_tuples=send_request.service_bot_tuples,
-            mentioned_user_ids=mentioned_user_ids,
-            active_user_ids=send_request.active_user_ids,
-            recipient_type=send_request.message.recipient.type,
-        )
+        if not settings.DEFER_MESSAGE_SEND_WORK:
+            send_request.service_queue_events = get_service_bot_events(
+                sender=send_request.message.sender,
+                service_bot_tuples=send_request.service_bot_tuples,
+                mentioned_user_ids=mentioned_user_ids,
+                active_user_ids=send_request.active_user_ids,
+                recipient_type=send_request.message.recipient.type,
+            )
 
     bulk_insert_ums(ums)
 
+    note_topic_participants(
+        (
+            send_request.message.recipient_id,
+            send_request.message.topic_name(),
+            send_request.message.sender_id,
+        )
+        for send_request in send_message_requests
+        if send_request.message.is_stream_message()
+    )
+
     for send_request in send_message_requests:
         do_widget_post_save_actions(send_request)
 
-    # This next loop is responsible for notifying other parts of the
+    # These next two loops are responsible for notifying other parts of the
     # Zulip system about the messages we just committed to the database:
     # * Sender automatically follows or unmutes the topic depending on 'automatically_follow_topics_policy'
     #   and 'automatically_unmute_topics_in_muted_streams_policy' user settings.
-    # * Notifying clients via send_event_on_commit
+    # * Notifying clients via send_events_rollback_unsafe, once committed
     # * Triggering outgoing webhooks via the service event queue.
     # * Updating the `first_message_id` field for streams without any message history.
     # * Implementing the Welcome Bot reply hack
     # * Adding links to the embed_links queue for open graph processing.
+    #
+    # The message events for the whole batch are sent to Tornado
+    # together, once committed.  So that each message's events keep
+    # their order, work which queues its own events on commit happens
+    # either in the first loop, if its events should come before the
+    # message's (e.g. the sender's topic visibility change), or in the
+    # second, if they should come after (e.g. the Welcome Bot's reply).
+    message_events: list[tuple[Realm, Mapping[str, Any], list[MessageEventUserData]]] = []
+    #
+    # With settings.DEFER_MESSAGE_SEND_WORK, the work which doesn't
+    # affect how each message is delivered is left to the
+    # deferred_message_work queue worker.
+    deferred_work: dict[int, dict[str, Any]] = defaultdict(dict)
     for send_request in send_message_requests:
         realm_id: int | None = None
         if send_request.message.is_stream_message():
@@ -992,40 +1071,18 @@ def do_send_messages(
             human_user_personal_mentions = send_request.rendering_result.mentions_user_ids & (
                 send_request.active_user_ids - send_request.all_bot_user_ids
             )
-            expect_follow_user_profiles: set[UserProfile] = set()
-
             if len(human_user_personal_mentions) > 0:
-                expect_follow_user_profiles = set(
-                    UserProfile.objects.filter(
-                        realm_id=realm_id,
-                        id__in=human_user_personal_mentions,
-                        automatically_follow_topics_where_mentioned=True,
-                    )
-                )
-            if len(expect_follow_user_profiles) > 0:
-                user_topics_query_set = UserTopic.objects.filter(
-                    user_profile__in=expect_follow_user_profiles,
-                    stream_id=send_request.stream.id,
-                    topic_name__iexact=send_request.message.topic_name(),
-                    visibility_policy__in=[
-                        # Explicitly muted takes precedence over this setting.
-                        UserTopic.VisibilityPolicy.MUTED,
-                        # Already followed
-                        UserTopic.VisibilityPolicy.FOLLOWED,
-                    ],
-                )
-                skip_follow_users = {
-                    user_topic.user_profile for user_topic in user_topics_query_set
-                }
-
-                to_follow_users = list(expect_follow_user_profiles - skip_follow_users)
-
-                if to_follow_users:
-                    bulk_do_set_user_topic_visibility_policy(
-                        user_profiles=to_follow_users,
-                        stream=send_request.stream,
+                if settings.DEFER_MESSAGE_SEND_WORK:
+                    deferred_work[send_request.message.id]["follow_topic"] = dict(
+                        stream_id=send_request.stream.id,
                         topic_name=send_request.message.topic_name(),
-                        visibility_policy=UserTopic.VisibilityPolicy.FOLLOWED,
+                        user_ids=sorted(human_user_personal_mentions),
+                    )
+                else:
+                    follow_topic_for_mentioned_users(
+                        send_request.stream,
+                        send_request.message.topic_name(),
+                        human_user_personal_mentions,
                     )
 
         # Deliver events to the real-time push system, as well as
@@ -1057,12 +1114,7 @@ def do_send_messages(
         else:
             user_list = list(user_ids)
 
-        class UserData(TypedDict):
-            id: int
-            flags: list[str]
-            mentioned_user_group_id: int | None
-
-        users: list[UserData] = []
+        users: list[MessageEventUserData] = []
         for user_id in user_list:
             flags = user_flags.get(user_id, [])
             # TODO/compatibility: The `wildcard_mentioned` flag was deprecated in favor of
@@ -1072,7 +1124,9 @@ def do_send_messages(
             # been updated to access `stream_wildcard_mentioned`.
             if "stream_wildcard_mentioned" in flags or "topic_wildcard_mentioned" in flags:
                 flags.append("wildcard_mentioned")
-            user_data: UserData = dict(id=user_id, flags=flags, mentioned_user_group_id=None)
+            user_data: MessageEventUserData = dict(
+                id=user_id, flags=flags, mentioned_user_group_id=None
+            )
 
             if user_id in send_request.mentioned_user_groups_map:
                 user_data["mentioned_user_group_id"] = send_request.mentioned_user_groups_map[
@@ -1193,8 +1247,13 @@ def do_send_messages(
             event["local_id"] = send_request.local_id
         if send_request.sender_queue_id is not None:
             event["sender_queue_id"] = send_request.sender_queue_id
-        send_event_on_commit(send_request.realm, event, users)
+        message_events.append((send_request.realm, event, users))
 
+    transaction.on_commit(lambda: send_events_rollback_unsafe(message_events))
+
+    for send_request, (_realm, message_event, _users) in zip(
+        send_message_requests, message_events, strict=True
+    ):
         if send_request.links_for_embed:
             event_data = {
                 "message_id": send_request.message.id,
@@ -1202,7 +1261,10 @@ def do_send_messages(
                 "message_realm_id": send_request.realm.id,
                 "urls": list(send_request.links_for_embed),
             }
-            queue_event_on_commit("embed_links", event_data)
+            if settings.DEFER_MESSAGE_SEND_WORK:
+                deferred_work[send_request.message.id]["embed_links"] = event_data
+            else:
+                queue_event_on_commit("embed_links", event_data)
 
         if send_request.message.recipient.type == Recipient.PERSONAL:
             welcome_bot_id = get_system_bot(settings.WELCOME_BOT, send_request.realm.id).id
@@ -1214,17 +1276,43 @@ def do_send_messages(
 
                 send_welcome_bot_response(send_request)
 
-        assert send_request.service_queue_events is not None
-        for queue_name, events in send_request.service_queue_events.items():
-            for event in events:
-                queue_event_on_commit(
-                    queue_name,
-                    {
-                        "message": wide_message_dict,
-                        "trigger": event["trigger"],
-                        "user_profile_id": event["user_profile_id"],
-                    },
+        if settings.DEFER_MESSAGE_SEND_WORK:
+            if send_request.service_bot_tuples:
+                # The worker only needs to know which of the service
+                # bots were mentioned, or are recipients.
+                service_bot_ids = {user_id for user_id, bot_type in send_request.service_bot_tuples}
+                deferred_work[send_request.message.id]["service_bots"] = dict(
+                    service_bot_tuples=[
+                        [user_id, bot_type] for user_id, bot_type in send_request.service_bot_tuples
+                    ],
+                    mentioned_user_ids=sorted(
+                        send_request.rendering_result.mentions_user_ids & service_bot_ids
+                    ),
+                    active_user_ids=sorted(send_request.active_user_ids & service_bot_ids),
                 )
+        else:
+            assert send_request.service_queue_events is not None
+            for queue_name, service_events in send_request.service_queue_events.items():
+                for service_event in service_events:
+                    queue_event_on_commit(
+                        queue_name,
+                        {
+                            "message": message_event["message_dict"],
+                            "trigger": service_event["trigger"],
+                            "user_profile_id": service_event["user_profile_id"],
+                        },
+                    )
+
+    if deferred_work:
+        queue_event_on_commit(
+            "deferred_message_work",
+            {
+                "messages": [
+                    dict(message_id=message_id, **work)
+                    for message_id, work in deferred_work.items()
+                ]
+            },
+        )
 
     sent_message_results = [
         SentMessageResult(
@@ -15,10 +15,10 @@ from zerver.actions.default_streams import (
 )
 from zerver.actions.message_send import internal_send_stream_message
 from zerver.lib.cache import (
-    cache_delete_many,
     cache_set,
+    delete_stream_delivery_profile_caches,
     display_recipient_cache_key,
-    to_dict_cache_key_id,
+    flush_message_dicts,
 )
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.mention import silent_mention_syntax_for_user
@@ -203,7 +203,7 @@ def do_unarchive_stream(stream: Stream, new_name: str, *, acting_user: UserProfi
         realm_id=realm.id,
         recipient_id=stream.recipient_id,
     ).only("id")
-    cache_delete_many(to_dict_cache_key_id(message.id) for message in messages)
+    flush_message_dicts(message.id for message in messages)
 
     # Unset the is_web_public and is_realm_public cache on attachments,
     # since the stream is now private.
@@ -245,8 +245,7 @@ def bulk_delete_cache_keys(message_ids_to_clear: list[int]) -> None:
     while len(message_ids_to_clear) > 0:
         batch = message_ids_to_clear[0:5000]
 
-        keys_to_delete = [to_dict_cache_key_id(message_id) for message_id in batch]
-        cache_delete_many(keys_to_delete)
+        flush_message_dicts(batch)
 
         message_ids_to_clear = message_ids_to_clear[5000:]
 
@@ -413,6 +412,9 @@ def bulk_add_subs_to_db_with_logging(
     Subscription.objects.bulk_create(info.sub for info in subs_to_add)
     sub_ids = [info.sub.id for info in subs_to_activate]
     Subscription.objects.filter(id__in=sub_ids).update(active=True)
+    delete_stream_delivery_profile_caches(
+        {info.sub.recipient_id for info in subs_to_add + subs_to_activate}
+    )
 
     # Log subscription activities in RealmAuditLog
     event_time = timezone_now()
@@ -983,6 +985,9 @@ def bulk_remove_subscriptions(
         Subscription.objects.filter(
             id__in=sub_ids_to_deactivate,
         ).update(active=False)
+        delete_stream_delivery_profile_caches(
+            {sub_info.sub.recipient_id for sub_info in subs_to_deactivate}
+        )
         occupied_streams_after = list(get_occupied_streams(realm))
 
         # Log subscription activities in RealmAuditLog
@@ -1376,7 +1381,7 @@ def do_rename_stream(stream: Stream, new_name: str, user_profile: UserProfile) -
     # Delete cache entries for everything else, which is cheaper and
     # clearer than trying to set them. display_recipient is the out of
     # date field in all cases.
-    cache_delete_many(to_dict_cache_key_id(message.id) for message in messages)
+    flush_message_dicts(message.id for message in messages)
 
     # We want to key these updates by id, not name, since id is
     # the immutable primary key, and obviously name is not.
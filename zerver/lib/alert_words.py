@@ -12,11 +12,15 @@ from zerver.models import AlertWord, Realm, UserProfile
 from zerver.models.alert_words import flush_realm_alert_words
 
 
-@cache_with_key(lambda realm: realm_alert_words_cache_key(realm.id), timeout=3600 * 24)
 def alert_words_in_realm(realm: Realm) -> dict[int, list[str]]:
-    user_ids_and_words = AlertWord.objects.filter(realm=realm, user_profile__is_active=True).values(
-        "user_profile_id", "word"
-    )
+    return alert_words_in_realm_id(realm.id)
+
+
+@cache_with_key(realm_alert_words_cache_key, timeout=3600 * 24)
+def alert_words_in_realm_id(realm_id: int) -> dict[int, list[str]]:
+    user_ids_and_words = AlertWord.objects.filter(
+        realm_id=realm_id, user_profile__is_active=True
+    ).values("user_profile_id", "word")
     user_ids_with_words: dict[int, list[str]] = {}
     for id_and_word in user_ids_and_words:
         user_ids_with_words.setdefault(id_and_word["user_profile_id"], [])
@@ -14,13 +14,23 @@ from typing import TYPE_CHECKING, Any, Generic, TypeVar
 from django.conf import settings
 from django.core.cache import caches
 from django.core.cache.backends.base import BaseCache
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from typing_extensions import ParamSpec
 
 if TYPE_CHECKING:
     # These modules have to be imported for type annotations but
     # they cannot be imported at runtime due to cyclic dependency.
-    from zerver.models import Attachment, Message, MutedUser, Realm, Stream, SubMessage, UserProfile
+    from zerver.models import (
+        Attachment,
+        Message,
+        MutedUser,
+        Realm,
+        Stream,
+        SubMessage,
+        Subscription,
+        UserProfile,
+    )
 
 MEMCACHED_MAX_KEY_LENGTH = 250
 
@@ -524,15 +534,69 @@ def delete_user_profile_caches(user_profiles: Iterable["UserProfile"], realm_id:
     cache_delete_many(keys)
 
 
-def delete_display_recipient_cache(user_profile: "UserProfile") -> None:
+def delete_display_recipient_cache(
+    user_profile: "UserProfile", *, delivery_profiles: bool = False
+) -> None:
     from zerver.models import Subscription  # We need to import here to avoid cyclic dependency.
 
-    recipient_ids = Subscription.objects.filter(user_profile=user_profile).values_list(
-        "recipient_id", flat=True
+    recipient_ids = list(
+        Subscription.objects.filter(user_profile=user_profile).values_list(
+            "recipient_id", flat=True
+        )
     )
     keys = [display_recipient_cache_key(rid) for rid in recipient_ids]
     keys.append(single_user_display_recipient_cache_key(user_profile.id))
     cache_delete_many(keys)
+    if delivery_profiles:
+        delete_stream_delivery_profile_caches(recipient_ids)
+
+
+def stream_delivery_profile_cache_key(recipient_id: int) -> str:
+    return f"stream_delivery_profile:{recipient_id}"
+
+
+# The UserProfile fields which are part of a StreamDeliveryProfile.
+stream_delivery_profile_user_fields: list[str] = [
+    "enable_followed_topic_email_notifications",
+    "enable_followed_topic_push_notifications",
+    "enable_followed_topic_wildcard_mentions_notify",
+    "enable_stream_email_notifications",
+    "enable_stream_push_notifications",
+    "is_active",
+    "long_term_idle",
+    "wildcard_mentions_notify",
+]
+
+
+def delete_stream_delivery_profile_caches(recipient_ids: Iterable[int]) -> None:
+    keys = [stream_delivery_profile_cache_key(recipient_id) for recipient_id in recipient_ids]
+    cache_delete_many(keys)
+    # A message sent concurrently with this change may have cached a
+    # profile from before it; so flush again once it is visible.
+    transaction.on_commit(lambda: cache_delete_many(keys))
+
+
+# Called by models/streams.py to flush the stream delivery profile
+# whenever we save a subscription; code which bulk-updates
+# subscriptions calls delete_stream_delivery_profile_caches directly.
+def flush_subscription(
+    *,
+    instance: "Subscription",
+    update_fields: Sequence[str] | None = None,
+    **kwargs: object,
+) -> None:
+    if changed(
+        update_fields,
+        [
+            "active",
+            "email_notifications",
+            "is_muted",
+            "is_user_active",
+            "push_notifications",
+            "wildcard_mentions_notify",
+        ],
+    ):
+        delete_stream_delivery_profile_caches([instance.recipient_id])
 
 
 def changed(update_fields: Sequence[str] | None, fields: list[str]) -> bool:
@@ -568,7 +632,18 @@ def flush_user_profile(
         cache_delete(active_non_guest_user_ids_cache_key(user_profile.realm_id))
 
     if changed(update_fields, ["email", "full_name", "id", "is_mirror_dummy"]):
-        delete_display_recipient_cache(user_profile)
+        delete_display_recipient_cache(
+            user_profile,
+            delivery_profiles=changed(update_fields, stream_delivery_profile_user_fields),
+        )
+    elif changed(update_fields, stream_delivery_profile_user_fields):
+        from zerver.models import Subscription
+
+        delete_stream_delivery_profile_caches(
+            Subscription.objects.filter(user_profile=user_profile).values_list(
+                "recipient_id", flat=True
+            )
+        )
 
     # Invalidate our bots_in_realm info dict if any bot has
     # changed the fields in the dict or become (in)active
@@ -613,6 +688,13 @@ def flush_realm(
         cache_delete(realm_text_description_cache_key(realm))
 
 
+def topic_participants_cache_key(recipient_id: int, topic_name: str) -> str:
+    # Topic names are matched case-insensitively, and may contain
+    # characters which aren't allowed in cache keys.
+    topic_hash = hashlib.sha1(topic_name.lower().encode()).hexdigest()
+    return f"topic_participants:{recipient_id}:{topic_hash}"
+
+
 def realm_alert_words_cache_key(realm_id: int) -> str:
     return f"realm_alert_words:{realm_id}"
 
@@ -674,9 +756,65 @@ def open_graph_description_cache_key(content: bytes, request_url: str) -> str:
     return f"open_graph_description_path:{hashlib.sha1(request_url.encode()).hexdigest()}"
 
 
+def message_dict_generation_key(message_id: int) -> str:
+    return f"message_dict_generation:{message_id}"
+
+
+def get_message_dict_generations(message_ids: list[int]) -> dict[int, str]:
+    """Returns the current generation of each message's message_dict
+    cache entry, which MessageDictLocalCache tags its entries with.
+
+    A message without one is given a new generation here; since we
+    do that before fetching the message_dict entries, the entry we
+    then fetch is at least as new as that generation."""
+    cache_keys = {message_id: message_dict_generation_key(message_id) for message_id in message_ids}
+    cached_generations = safe_cache_get_many(list(cache_keys.values()))
+    generations = {
+        message_id: cached_generations[cache_key][0]
+        for message_id, cache_key in cache_keys.items()
+        if cache_key in cached_generations
+    }
+    new_generations = {
+        message_id: secrets.token_hex(8)
+        for message_id in message_ids
+        if message_id not in generations
+    }
+    if new_generations:
+        safe_cache_set_many(
+            {
+                cache_keys[message_id]: (generation,)
+                for message_id, generation in new_generations.items()
+            },
+            timeout=3600 * 24,
+        )
+        generations.update(new_generations)
+    return generations
+
+
+def bump_message_dict_generations(message_ids: Iterable[int]) -> None:
+    """Invalidates the copies of these messages' message_dict cache
+    entries which every process holds in its MessageDictLocalCache.
+    This must be called after (not before) updating or deleting the
+    message_dict entries, so that no process can tag the old entry
+    with the new generation."""
+    new_generations = {
+        message_dict_generation_key(message_id): (secrets.token_hex(8),)
+        for message_id in message_ids
+    }
+    if new_generations:
+        cache_set_many(new_generations, timeout=3600 * 24)
+
+
+def flush_message_dicts(message_ids: Iterable[int]) -> None:
+    message_ids = list(message_ids)
+    cache_delete_many(to_dict_cache_key_id(message_id) for message_id in message_ids)
+    bump_message_dict_generations(message_ids)
+
+
 def flush_message(*, instance: "Message", **kwargs: object) -> None:
     message = instance
     cache_delete(to_dict_cache_key_id(message.id))
+    bump_message_dict_generations([message.id])
 
 
 def flush_submessage(*, instance: "SubMessage", **kwargs: object) -> None:
@@ -685,6 +823,7 @@ def flush_submessage(*, instance: "SubMessage", **kwargs: object) -> None:
     # parent messages
     message_id = submessage.message_id
     cache_delete(to_dict_cache_key_id(message_id))
+    bump_message_dict_generations([message_id])
 
 
 class IgnoreUnhashableLruCacheWrapper(Generic[ParamT, ReturnT]):
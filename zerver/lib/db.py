@@ -1,4 +1,5 @@
 import time
+from collections import OrderedDict
 from collections.abc import Callable, Iterable, Mapping, Sequence
 from typing import Any, TypeAlias, TypeVar
 
@@ -51,4 +52,8 @@ class TimeTrackingConnection(connection):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         self.queries: list[dict[str, str]] = []
+        # Names of the server-side prepared statements on this
+        # connection, in order of last use, each mapped to whether
+        # preparing it succeeded; see use_prepared_statement.
+        self.prepared_statements: OrderedDict[str, bool] = OrderedDict()
         super().__init__(*args, **kwargs)
@@ -1529,7 +1529,9 @@ def apply_event(
     elif event["type"] == "update_message_flags":
         # We don't return messages in `/register`, so most flags we
         # can ignore, but we do need to update the unread_msgs data if
-        # unread state is changed.
+        # unread state is changed.  Reading messages older than the
+        # MAX_UNREAD_MESSAGES most recent unreads doesn't update
+        # old_unreads_count; see RawUnreadMessagesResult.
         if "raw_unread_msgs" in state and event["flag"] == "read" and event["op"] == "add":
             for remove_id in event["messages"]:
                 remove_message_id_from_unread_mgs(state["raw_unread_msgs"], remove_id)
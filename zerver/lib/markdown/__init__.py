@@ -1,13 +1,14 @@
 # Zulip's main Markdown implementation.  See docs/subsystems/markdown.md for
 # detailed documentation on our Markdown syntax.
+import hashlib
 import html
 import logging
 import mimetypes
 import re
 import time
 from collections import deque
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 from email.message import EmailMessage
 from functools import lru_cache
@@ -27,6 +28,7 @@ import markdown.postprocessors
 import markdown.preprocessors
 import markdown.treeprocessors
 import markdown.util
+import orjson
 import re2
 import regex
 import requests
@@ -39,7 +41,7 @@ from tlds import tld_set
 from typing_extensions import Self, override
 
 from zerver.lib import mention
-from zerver.lib.cache import cache_with_key
+from zerver.lib.cache import cache_get, cache_set, cache_with_key
 from zerver.lib.camo import get_camo_url
 from zerver.lib.emoji import EMOTICON_RE, codepoint_to_name, name_to_codepoint, translate_emoticons
 from zerver.lib.emoji_utils import emoji_to_hex_codepoint, unqualify_emoji
@@ -1879,6 +1881,160 @@ class LinkifierPattern(CompiledInlineProcessor):
         )
 
 
+def skip_character_class(source: str, index: int) -> int:
+    # Returns the index just past the character class which starts
+    # just before `index`.
+    if source.startswith("^", index):
+        index += 1
+    if source.startswith("]", index):
+        index += 1
+    while index < len(source) and source[index] != "]":
+        if source[index] == "\\":
+            index += 2
+        elif source.startswith("[:", index) and ":]" in source[index + 2 :]:
+            index = source.index(":]", index + 2) + 2
+        else:
+            index += 1
+    return index + 1
+
+
+def required_linkifier_literal(source: str) -> str:
+    """Returns text which appears in every match of the linkifier
+    pattern `source`, or "" if we can't find any.
+
+    We only look at the top level of the pattern, outside any groups;
+    this only needs to be correct, not thorough.
+    """
+    if re.search(r"\(\?[a-zA-Z]*i", source) or "\\Q" in source:
+        # Case-insensitive or quoted text is not worth handling.
+        return ""
+
+    literals = [""]
+    depth = 0
+    index = 0
+    while index < len(source):
+        char = source[index]
+        index += 1
+        if depth > 0:
+            if char == "\\":
+                index += 1
+            elif char == "[":
+                index = skip_character_class(source, index)
+            elif char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            continue
+
+        if char == "|":
+            return ""
+        elif char in "?*":
+            # The previous character is optional.
+            literals[-1] = literals[-1][:-1]
+            literals.append("")
+        elif char == "{" and (repetition := re.match(r"(\d+)(,\d*)?\}", source[index:])):
+            if int(repetition[1]) == 0:
+                literals[-1] = literals[-1][:-1]
+            index += repetition.end()
+            literals.append("")
+        elif char == "\\" and index < len(source) and not source[index].isalnum():
+            literals[-1] += source[index]
+            index += 1
+        else:
+            if char == "\\":
+                # Skip a character class escape like \d, or \pL, \p{Greek}, or \x{263a}.
+                escape = source[index : index + 1]
+                index += 1
+                if escape in ("p", "P", "x") and source.startswith("{", index):
+                    index = source.find("}", index) + 1 or len(source)
+                elif escape in ("p", "P"):
+                    index += 1
+                elif escape == "x":
+                    index += 2
+                elif escape.isdigit():
+                    # An octal character code, of up to three digits.
+                    while index < len(source) and source[index].isdigit():
+                        index += 1
+            elif char == "[":
+                index = skip_character_class(source, index)
+            elif char == "(":
+                depth += 1
+            elif char not in "+{.^$)":
+                literals[-1] += char
+                continue
+            literals.append("")
+    return max(literals, key=len)
+
+
+@dataclass
+class LinkifierMatch:
+    element: Element | str | None
+    start: int
+    end: int
+
+
+class Linkifiers(markdown.inlinepatterns.InlineProcessor):
+    """Applies all of a realm's linkifiers, with the same results as
+    registering a LinkifierPattern for each one, in order.
+
+    Rather than running every linkifier's regex over each piece of
+    text, we find the required literal text (see
+    required_linkifier_literal) of every linkifier in the text in a
+    single Aho-Corasick scan, and only try the linkifiers which might
+    match.
+    """
+
+    def __init__(self, linkifiers: list[LinkifierDict], zmd: "ZulipMarkdown") -> None:
+        self.md = zmd
+        self.zmd = zmd
+        self.patterns = [
+            LinkifierPattern(linkifier["pattern"], linkifier["url_template"], zmd)
+            for linkifier in linkifiers
+        ]
+        # Indexes of the linkifiers we always have to try.
+        self.unfiltered: list[int] = []
+        self.automaton = ahocorasick.Automaton()
+        for index, linkifier in enumerate(linkifiers):
+            literal = required_linkifier_literal(linkifier["pattern"])
+            if not literal:
+                self.unfiltered.append(index)
+            elif self.automaton.exists(literal):
+                self.automaton.get(literal).append(index)
+            else:
+                self.automaton.add_word(literal, [index])
+        self.automaton.make_automaton()
+
+    @override
+    def getCompiledRegExp(self) -> Self:  # type: ignore[override] # the treeprocessor only calls finditer
+        return self
+
+    def finditer(self, data: str, pos: int = 0) -> Iterator[LinkifierMatch]:
+        candidates = set(self.unfiltered)
+        # If there were no literals, the automaton can't be used.
+        if self.automaton.kind == ahocorasick.AHOCORASICK:
+            for end_index, indexes in self.automaton.iter(data):
+                candidates.update(indexes)
+
+        # The inline treeprocessor applies the first match of a pattern
+        # which handleMatch accepts, starting over after each one, until
+        # there are none; then it moves on to the next pattern.  So the
+        # next match to apply is the first accepted match of the first
+        # linkifier which has one.
+        for index in sorted(candidates):
+            pattern = self.patterns[index]
+            for match in pattern.compiled_re.finditer(data, pos):
+                element, start, end = pattern.handleMatch(match, data)
+                if start is not None and end is not None:
+                    yield LinkifierMatch(element, start, end)
+                    return
+
+    @override
+    def handleMatch(  # type: ignore[override] # https://github.com/python/mypy/issues/10197
+        self, m: LinkifierMatch, data: str
+    ) -> tuple[Element | str | None, int | None, int | None]:
+        return m.element, m.start, m.end
+
+
 class UserMentionPattern(CompiledInlineProcessor):
     @override
     def handleMatch(  # type: ignore[override] # https://github.com/python/mypy/issues/10197
@@ -2089,6 +2245,15 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
             return True
         return False
 
+    def find_alert_words(
+        self, realm_alert_words_automaton: ahocorasick.Automaton, content: str
+    ) -> None:
+        for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(content):
+            if self.check_valid_start_position(
+                content, end_index - len(original_value)
+            ) and self.check_valid_end_position(content, end_index + 1):
+                self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(user_ids)
+
     @override
     def run(self, lines: list[str]) -> list[str]:
         db_data: DbData | None = self.zmd.zulip_db_data
@@ -2099,18 +2264,17 @@ class AlertWordNotificationProcessor(markdown.preprocessors.Preprocessor):
             # Our caller passes in the list of possible_words.  We
             # don't do any special rendering; we just append the alert words
             # we find to the set self.zmd.zulip_rendering_result.user_ids_with_alert_words.
+            #
+            # The content we check is saved with a cached rendering,
+            # so that a later use of it can find alert words again
+            # without running the other preprocessors.
+            content = "\n".join(lines).lower()
+            self.zmd.zulip_alert_word_content = content
 
             realm_alert_words_automaton = db_data.realm_alert_words_automaton
 
             if realm_alert_words_automaton is not None:
-                content = "\n".join(lines).lower()
-                for end_index, (original_value, user_ids) in realm_alert_words_automaton.iter(
-                    content
-                ):
-                    if self.check_valid_start_position(
-                        content, end_index - len(original_value)
-                    ) and self.check_valid_end_position(content, end_index + 1):
-                        self.zmd.zulip_rendering_result.user_ids_with_alert_words.update(user_ids)
+                self.find_alert_words(realm_alert_words_automaton, content)
         return lines
 
 
@@ -2180,6 +2344,7 @@ class ZulipMarkdown(markdown.Markdown):
     zulip_realm: Realm | None
     zulip_db_data: DbData | None
     zulip_rendering_result: MessageRenderingResult
+    zulip_alert_word_content: str
     image_preview_enabled: bool
     url_embed_preview_enabled: bool
     url_embed_data: dict[str, UrlEmbedData | None] | None
@@ -2344,13 +2509,8 @@ class ZulipMarkdown(markdown.Markdown):
     def register_linkifiers(
         self, registry: markdown.util.Registry[markdown.inlinepatterns.Pattern]
     ) -> markdown.util.Registry[markdown.inlinepatterns.Pattern]:
-        for linkifier in self.linkifiers:
-            pattern = linkifier["pattern"]
-            registry.register(
-                LinkifierPattern(pattern, linkifier["url_template"], self),
-                f"linkifiers/{pattern}",
-                45,
-            )
+        if self.linkifiers:
+            registry.register(Linkifiers(self.linkifiers, self), "linkifiers", 45)
         return registry
 
     def build_treeprocessors(self) -> markdown.util.Registry[markdown.treeprocessors.Treeprocessor]:
@@ -2400,6 +2560,8 @@ class ZulipMarkdown(markdown.Markdown):
 
 md_engines: dict[tuple[int, bool], ZulipMarkdown] = {}
 linkifier_data: dict[int, list[LinkifierDict]] = {}
+# A digest of each entry in linkifier_data, for markdown_render_cache_key.
+linkifier_data_digests: dict[int, str] = {}
 
 
 def make_md_engine(linkifiers_key: int, email_gateway: bool) -> None:
@@ -2559,6 +2721,9 @@ def maybe_update_markdown_engines(linkifiers_key: int, email_gateway: bool) -> N
         # Linkifier data has changed, update `linkifier_data` and any
         # of the existing Markdown engines using this set of linkifiers.
         linkifier_data[linkifiers_key] = linkifiers
+        linkifier_data_digests[linkifiers_key] = hashlib.sha256(
+            orjson.dumps(linkifiers)
+        ).hexdigest()
         for email_gateway_flag in [True, False]:
             if (linkifiers_key, email_gateway_flag) in md_engines:
                 # Update only existing engines(if any), don't create new one.
@@ -2582,6 +2747,58 @@ def privacy_clean_markdown(content: str) -> str:
     return repr(_privacy_re.sub("x", content))
 
 
+def markdown_render_cache_key(
+    content: str,
+    md_engine: ZulipMarkdown,
+    db_data: DbData,
+    message_realm: Realm,
+    for_message: bool,
+) -> str | None:
+    """Returns the key under which we cache the rendering of this
+    content, which is derived from everything the rendering depends
+    on, or None if the content shouldn't be cached.
+
+    We don't cache content which mentions users, groups or channels,
+    or which references uploaded files, since rendering those depends
+    on data we don't include in the key.  Alert words don't affect
+    the rendered content, and are found again for each use of the
+    cached rendering.
+    """
+    if (
+        mention.MENTIONS_RE.search(content) is not None
+        or mention.USER_GROUP_MENTIONS_RE.search(content) is not None
+        or possible_linked_stream_names(content)
+        or "user_uploads" in content
+    ):
+        return None
+
+    emoji_names = {syntax[1:-1] for syntax in re.findall(EMOJI_REGEX, content)}
+    realm_emoji = {
+        name: db_data.active_realm_emoji[name]
+        for name in sorted(emoji_names)
+        if name in db_data.active_realm_emoji
+    }
+    key_data = orjson.dumps(
+        [
+            version,
+            md_engine.linkifiers_key,
+            linkifier_data_digests[md_engine.linkifiers_key],
+            md_engine.email_gateway,
+            md_engine.image_preview_enabled,
+            md_engine.url_embed_preview_enabled,
+            settings.CAMO_URI,
+            db_data.realm_url,
+            db_data.sent_by_bot,
+            db_data.translate_emoticons,
+            message_realm.default_code_block_language,
+            for_message,
+            realm_emoji,
+            content,
+        ]
+    )
+    return f"markdown_render:{message_realm.id}:{hashlib.sha256(key_data).hexdigest()}"
+
+
 def do_convert(
     content: str,
     realm_alert_words_automaton: ahocorasick.Automaton | None = None,
@@ -2643,6 +2860,7 @@ def do_convert(
 
     _md_engine.zulip_message = message
     _md_engine.zulip_rendering_result = rendering_result
+    _md_engine.zulip_alert_word_content = ""
     _md_engine.zulip_realm = message_realm
     _md_engine.zulip_db_data = None  # for now
     _md_engine.image_preview_enabled = image_preview_enabled(message, message_realm, no_previews)
@@ -2653,6 +2871,7 @@ def do_convert(
 
     # Pre-fetch data from the DB that is used in the Markdown thread
     user_upload_previews = None
+    render_cache_key = None
     if message_realm is not None:
         # Here we fetch the data structures needed to render
         # mentions/stream mentions from the database, but only
@@ -2676,7 +2895,7 @@ def do_convert(
             active_realm_emoji = {}
 
         user_upload_previews = get_user_upload_previews(message_realm.id, content)
-        _md_engine.zulip_db_data = DbData(
+        db_data = DbData(
             realm_alert_words_automaton=realm_alert_words_automaton,
             mention_data=mention_data,
             active_realm_emoji=active_realm_emoji,
@@ -2686,8 +2905,33 @@ def do_convert(
             translate_emoticons=translate_emoticons,
             user_upload_previews=user_upload_previews,
         )
+        _md_engine.zulip_db_data = db_data
+        if settings.MARKDOWN_RENDER_CACHE and url_embed_data is None:
+            render_cache_key = markdown_render_cache_key(
+                content,
+                _md_engine,
+                db_data,
+                message_realm,
+                for_message=message is not None,
+            )
 
     try:
+        if render_cache_key is not None:
+            cached = cache_get(render_cache_key)
+            if cached is not None:
+                rendering_result, has_link, has_image, alert_word_content = cached[0]
+                if realm_alert_words_automaton is not None:
+                    alert_word_processor = _md_engine.preprocessors["custom_text_notifications"]
+                    assert isinstance(alert_word_processor, AlertWordNotificationProcessor)
+                    _md_engine.zulip_rendering_result = rendering_result
+                    alert_word_processor.find_alert_words(
+                        realm_alert_words_automaton, alert_word_content
+                    )
+                if message is not None:
+                    message.has_link = has_link
+                    message.has_image = has_image
+                return rendering_result
+
         # Spend at most 5 seconds rendering; this protects the backend
         # from being overloaded by bugs (e.g. Markdown logic that is
         # extremely inefficient in corner cases) as well as user
@@ -2712,6 +2956,22 @@ def do_convert(
             raise MarkdownRenderingError(
                 f"Rendered content exceeds {MAX_MESSAGE_LENGTH * 100} characters (message {logging_message_id})"
             )
+
+        if render_cache_key is not None:
+            # The alert words, which depend on the realm's current
+            # alert words rather than the key, are found again for
+            # each use of the cached rendering, in the content the
+            # alert word preprocessor checked.
+            cache_set(
+                render_cache_key,
+                (
+                    replace(rendering_result, user_ids_with_alert_words=set()),
+                    message is not None and message.has_link,
+                    message is not None and message.has_image,
+                    _md_engine.zulip_alert_word_content,
+                ),
+                timeout=3600 * 24,
+            )
         return rendering_result
     except Exception:
         cleaned = privacy_clean_markdown(content)
@@ -0,0 +1,109 @@
+import logging
+import multiprocessing
+from collections import deque
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from multiprocessing.pool import AsyncResult
+
+import bmemcached
+from django.core.cache import cache
+from django.db import connection
+
+from zerver.lib.markdown import maybe_update_markdown_engines, render_message_markdown
+from zerver.models import Message
+
+# How many seconds we wait on a worker for a batch before giving up
+# and rendering the batch in the calling process instead.
+RENDER_POOL_BATCH_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+def prewarm_markdown_engines(realm_ids: list[int]) -> None:
+    # Building a ZulipMarkdown engine, with its linkifiers, is far
+    # more expensive than rendering a typical message, so each worker
+    # does that once for the realms it is about to render.
+    for realm_id in realm_ids:
+        maybe_update_markdown_engines(realm_id, email_gateway=False)
+
+
+def render_message_batch(batch: list[tuple[int, str]]) -> list[str]:
+    messages = Message.objects.select_related("sender", "realm", "sending_client").in_bulk(
+        [message_id for message_id, content in batch]
+    )
+    return [
+        render_message_markdown(messages[message_id], content).rendered_content
+        for message_id, content in batch
+    ]
+
+
+def collect_batch(
+    batch: list[tuple[int, str]], result: AsyncResult[list[str]], timeout: float
+) -> Iterator[tuple[int, str]]:
+    try:
+        rendered = result.get(timeout)
+    except Exception:
+        # Rendering the batch again here either succeeds, or raises
+        # (and logs) the MarkdownRenderingError for the bad message,
+        # with the usual 5-second limit on each message.
+        logger.warning(
+            "Rendering messages %s-%s in a worker failed; rendering them in-process",
+            batch[0][0],
+            batch[-1][0],
+            exc_info=True,
+        )
+        rendered = render_message_batch(batch)
+    for (message_id, _content), rendered_content in zip(batch, rendered, strict=True):
+        yield message_id, rendered_content
+
+
+def render_messages_in_parallel(
+    messages: Iterable[tuple[int, str]],
+    *,
+    processes: int,
+    realm_ids: Iterable[int] = (),
+    batch_size: int = 100,
+    timeout: float = RENDER_POOL_BATCH_TIMEOUT,
+) -> Iterator[tuple[int, str]]:
+    """Renders the content of each (message ID, content) pair as the
+    given message, yielding (message ID, rendered content) pairs in
+    the same order.
+
+    This is for bulk re-rendering tools; message sends and edits
+    render a single message in the request, where a pool would only
+    add overhead.  The work is split across `processes` worker
+    processes, each with the Markdown engines for `realm_ids` already
+    built; only `processes` * 2 batches are outstanding at a time, so
+    `messages` can be a lazy iterator over a large table.
+    """
+    message_iter = iter(messages)
+    batches = iter(lambda: list(islice(message_iter, batch_size)), [])
+
+    if processes == 1:
+        for batch in batches:
+            yield from zip(
+                (message_id for message_id, content in batch),
+                render_message_batch(batch),
+                strict=True,
+            )
+        return
+
+    # The workers are forked, and must not share our database or
+    # memcached connections; we reconnect on our next use of each.
+    # We use multiprocessing.Pool rather than ProcessPoolExecutor
+    # since it forks every worker up front, before the caller's next
+    # query reopens the database connection.
+    connection.close()
+    _cache = cache._cache  # type: ignore[attr-defined] # not in stubs
+    assert isinstance(_cache, bmemcached.Client)
+    _cache.disconnect_all()
+    with multiprocessing.get_context("fork").Pool(
+        processes, initializer=prewarm_markdown_engines, initargs=(list(realm_ids),)
+    ) as pool:
+        pending: deque[tuple[list[tuple[int, str]], AsyncResult[list[str]]]] = deque()
+        for batch in batches:
+            pending.append((batch, pool.apply_async(render_message_batch, (batch,))))
+            if len(pending) >= processes * 2:
+                yield from collect_batch(*pending.popleft(), timeout)
+        while pending:
+            yield from collect_batch(*pending.popleft(), timeout)
@@ -6,19 +6,18 @@ from typing import Any, TypedDict
 
 from django.conf import settings
 from django.db import connection
-from django.db.models import Exists, Max, OuterRef, QuerySet, Sum
+from django.db.models import Count, Exists, Max, OuterRef, QuerySet, Sum
 from django.utils.timezone import now as timezone_now
 from django.utils.translation import gettext as _
 from psycopg2.sql import SQL
 
 from analytics.lib.counts import COUNT_STATS
 from analytics.models import RealmCount
-from zerver.lib.cache import generic_bulk_cached_fetch, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient_by_id
 from zerver.lib.exceptions import JsonableError, MissingAuthenticationError
 from zerver.lib.markdown import MessageRenderingResult
 from zerver.lib.mention import MentionData
-from zerver.lib.message_cache import MessageDict, extract_message_dict, stringify_message_dict
+from zerver.lib.message_cache import MessageDict, bulk_fetch_message_dicts
 from zerver.lib.partial import partial
 from zerver.lib.request import RequestVariableConversionError
 from zerver.lib.stream_subscription import (
@@ -81,6 +80,12 @@ class RawUnreadMessagesResult(TypedDict):
     muted_stream_ids: set[int]
     unmuted_stream_msgs: set[int]
     old_unreads_missing: bool
+    # The number of unread messages, which count towards the total,
+    # that are older than the MAX_UNREAD_MESSAGES most recent.  We
+    # don't have their IDs, so this isn't updated by apply_event; if
+    # any of them are read or deleted while a queue is registered,
+    # the total it returns is slightly too high.
+    old_unreads_count: int
 
 
 class UnreadStreamInfo(TypedDict):
@@ -210,17 +215,7 @@ def messages_for_ids(
     user_profile: UserProfile | None,
     realm: Realm,
 ) -> list[dict[str, Any]]:
-    id_fetcher = lambda row: row["id"]
-
-    message_dicts = generic_bulk_cached_fetch(
-        to_dict_cache_key_id,
-        MessageDict.ids_to_dict,
-        message_ids,
-        id_fetcher=id_fetcher,
-        cache_transformer=lambda obj: obj,
-        extractor=extract_message_dict,
-        setter=stringify_message_dict,
-    )
+    message_dicts = bulk_fetch_message_dicts(message_ids)
 
     message_list: list[dict[str, Any]] = []
 
@@ -687,11 +682,42 @@ def get_raw_unread_data(
     user_msgs = list(user_msgs[:MAX_UNREAD_MESSAGES])
 
     rows = list(reversed(user_msgs))
-    return extract_unread_data_from_um_rows(rows, user_profile)
+
+    old_unread_conversations: list[dict[str, Any]] = []
+    if message_ids is None and len(rows) == MAX_UNREAD_MESSAGES:
+        # The user may have older unread messages.  We don't fetch
+        # them, but count them, by conversation, so that the total is
+        # exact; this is a scan of the unread index, and the result has
+        # a row per conversation, rather than per message.
+        old_unread_conversations = list(
+            UserMessage.objects.filter(
+                user_profile=user_profile,
+                message_id__gte=first_visible_message_id,
+                message_id__lt=rows[0]["message_id"],
+            )
+            .exclude(
+                message__recipient_id__in=excluded_recipient_ids,
+            )
+            .extra(  # noqa: S610
+                where=[UserMessage.where_unread()],
+            )
+            .values(
+                MESSAGE__TOPIC,
+                "message__recipient_id",
+                "message__recipient__type",
+                "message__recipient__type_id",
+            )
+            .annotate(count=Count("*"))
+            .order_by()
+        )
+
+    return extract_unread_data_from_um_rows(rows, user_profile, old_unread_conversations)
 
 
 def extract_unread_data_from_um_rows(
-    rows: list[dict[str, Any]], user_profile: UserProfile | None
+    rows: list[dict[str, Any]],
+    user_profile: UserProfile | None,
+    old_unread_conversations: Sequence[dict[str, Any]] = (),
 ) -> RawUnreadMessagesResult:
     pm_dict: dict[int, RawUnreadDirectMessageDict] = {}
     stream_dict: dict[int, RawUnreadStreamDict] = {}
@@ -699,7 +725,6 @@ def extract_unread_data_from_um_rows(
     unmuted_stream_msgs: set[int] = set()
     direct_message_group_dict: dict[int, RawUnreadDirectMessageGroupDict] = {}
     mentions: set[int] = set()
-    total_unreads = 0
 
     raw_unread_messages: RawUnreadMessagesResult = dict(
         pm_dict=pm_dict,
@@ -709,6 +734,7 @@ def extract_unread_data_from_um_rows(
         huddle_dict=direct_message_group_dict,
         mentions=mentions,
         old_unreads_missing=False,
+        old_unreads_count=0,
     )
 
     if user_profile is None:
@@ -752,7 +778,6 @@ def extract_unread_data_from_um_rows(
         return user_ids_string
 
     for row in rows:
-        total_unreads += 1
         message_id = row["message_id"]
         msg_type = row["message__recipient__type"]
         recipient_id = row["message__recipient_id"]
@@ -806,7 +831,16 @@ def extract_unread_data_from_um_rows(
     # Record whether the user had more than MAX_UNREAD_MESSAGES total
     # unreads -- that's a state where Zulip's behavior will start to
     # be erroneous, and clients should display a warning.
-    raw_unread_messages["old_unreads_missing"] = total_unreads == MAX_UNREAD_MESSAGES
+    raw_unread_messages["old_unreads_missing"] = len(old_unread_conversations) > 0
+
+    old_unreads_count = 0
+    for row in old_unread_conversations:
+        if row["message__recipient__type"] == Recipient.STREAM and is_row_muted(
+            row["message__recipient__type_id"], row["message__recipient_id"], row[MESSAGE__TOPIC]
+        ):
+            continue
+        old_unreads_count += row["count"]
+    raw_unread_messages["old_unreads_count"] = old_unreads_count
 
     return raw_unread_messages
 
@@ -895,7 +929,12 @@ def aggregate_unread_data(raw_data: RawUnreadMessagesResult) -> UnreadMessagesRe
     direct_message_group_dict = raw_data["huddle_dict"]
     mentions = list(raw_data["mentions"])
 
-    count = len(pm_dict) + len(unmuted_stream_msgs) + len(direct_message_group_dict)
+    count = (
+        len(pm_dict)
+        + len(unmuted_stream_msgs)
+        + len(direct_message_group_dict)
+        + raw_data["old_unreads_count"]
+    )
 
     pm_objects = aggregate_pms(input_dict=pm_dict)
     stream_objects = aggregate_streams(input_dict=stream_dict)
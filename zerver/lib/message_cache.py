@@ -1,17 +1,27 @@
 import copy
-import zlib
+from collections import OrderedDict
 from collections.abc import Iterable
 from datetime import datetime
 from email.headerregistry import Address
 from typing import Any, TypedDict
 
 import orjson
+from django.conf import settings
 
 from zerver.lib.avatar import get_avatar_field, get_avatar_for_inaccessible_user
-from zerver.lib.cache import cache_set_many, cache_with_key, to_dict_cache_key, to_dict_cache_key_id
+from zerver.lib.cache import (
+    bump_message_dict_generations,
+    cache_set_many,
+    cache_with_key,
+    generic_bulk_cached_fetch,
+    get_message_dict_generations,
+    to_dict_cache_key,
+    to_dict_cache_key_id,
+)
 from zerver.lib.display_recipient import bulk_fetch_display_recipients
 from zerver.lib.markdown import render_message_markdown, topic_links
 from zerver.lib.markdown import version as markdown_version
+from zerver.lib.message_cache_codec import compress_message_dict, decompress_message_dict
 from zerver.lib.query_helpers import query_for_ids
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.topic import DB_TOPIC_NAME, TOPIC_LINKS, TOPIC_NAME
@@ -66,11 +76,11 @@ def sew_messages_and_submessages(
 
 
 def extract_message_dict(message_bytes: bytes) -> dict[str, Any]:
-    return orjson.loads(zlib.decompress(message_bytes))
+    return orjson.loads(decompress_message_dict(message_bytes))
 
 
 def stringify_message_dict(message_dict: dict[str, Any]) -> bytes:
-    return zlib.compress(orjson.dumps(message_dict))
+    return compress_message_dict(orjson.dumps(message_dict))
 
 
 @cache_with_key(to_dict_cache_key, timeout=3600 * 24)
@@ -92,9 +102,99 @@ def update_message_cache(
         items_for_remote_cache[key] = (msg,)
 
     cache_set_many(items_for_remote_cache)
+    bump_message_dict_generations(message_ids)
     return message_ids
 
 
+class MessageDictLocalCache:
+    """An in-process LRU cache in front of the message_dict entries
+    in memcached, for the messages this process serves most often.
+    It holds the dicts as uncompressed JSON, so that a hit costs
+    neither a memcached fetch nor a decompression, and evicts the
+    least recently used ones once their total length exceeds
+    settings.MESSAGE_DICT_LOCAL_CACHE_BYTES.
+
+    Each entry is tagged with the message's generation in memcached
+    (see get_message_dict_generations), which is replaced whenever the
+    message_dict entry is updated or deleted, and is only used while
+    that generation is current.
+    """
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict[int, tuple[str, bytes]] = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, message_id: int, generation: str) -> dict[str, Any] | None:
+        entry = self.entries.get(message_id)
+        if entry is None:
+            return None
+        if entry[0] != generation:
+            self.discard(message_id)
+            return None
+        self.entries.move_to_end(message_id)
+        return orjson.loads(entry[1])
+
+    def set(self, message_id: int, generation: str, message_dict: dict[str, Any]) -> None:
+        self.discard(message_id)
+        encoded = orjson.dumps(message_dict)
+        if len(encoded) > settings.MESSAGE_DICT_LOCAL_CACHE_BYTES:
+            return
+        self.entries[message_id] = (generation, encoded)
+        self.total_bytes += len(encoded)
+        while self.total_bytes > settings.MESSAGE_DICT_LOCAL_CACHE_BYTES:
+            _, evicted = self.entries.popitem(last=False)[1]
+            self.total_bytes -= len(evicted)
+
+    def discard(self, message_id: int) -> None:
+        entry = self.entries.pop(message_id, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[1])
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+message_dict_local_cache = MessageDictLocalCache()
+
+
+def bulk_fetch_message_dicts(message_ids: list[int]) -> dict[int, dict[str, Any]]:
+    """Fetches the unhydrated dicts for these messages, from
+    message_dict_local_cache, memcached, or the database, in that
+    order of preference.  The caller may modify the dicts."""
+
+    def fetch_from_remote_cache(message_ids: list[int]) -> dict[int, dict[str, Any]]:
+        return generic_bulk_cached_fetch(
+            to_dict_cache_key_id,
+            MessageDict.ids_to_dict,
+            message_ids,
+            id_fetcher=lambda row: row["id"],
+            cache_transformer=lambda obj: obj,
+            extractor=extract_message_dict,
+            setter=stringify_message_dict,
+        )
+
+    if settings.MESSAGE_DICT_LOCAL_CACHE_BYTES == 0 or len(message_ids) == 0:
+        return fetch_from_remote_cache(message_ids)
+
+    # We must fetch the generations before the message_dict entries;
+    # see get_message_dict_generations.
+    generations = get_message_dict_generations(message_ids)
+    message_dicts: dict[int, dict[str, Any]] = {}
+    needed_ids = []
+    for message_id in message_ids:
+        message_dict = message_dict_local_cache.get(message_id, generations[message_id])
+        if message_dict is None:
+            needed_ids.append(message_id)
+        else:
+            message_dicts[message_id] = message_dict
+
+    for message_id, message_dict in fetch_from_remote_cache(needed_ids).items():
+        message_dict_local_cache.set(message_id, generations[message_id], message_dict)
+        message_dicts[message_id] = message_dict
+    return message_dicts
+
+
 def save_message_rendered_content(message: Message, content: str) -> str:
     rendering_result = render_message_markdown(message, content, realm=message.get_realm())
     rendered_content = None
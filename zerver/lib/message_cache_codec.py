@@ -0,0 +1,161 @@
+import zlib
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from typing_extensions import override
+
+# Strings common in the JSON for message_dict cache entries, as
+# built by MessageDict.build_message_dict, which prime the compressor
+# for ZlibDictionaryCodec; deflate encodes strings near the end of
+# the dictionary most cheaply, so the most common come last.
+#
+# This must never be changed, since entries compressed with it may
+# be in memcached; add a new version of the codec instead.
+MESSAGE_DICT_DICTIONARY_V1 = b"".join(
+    [
+        b'<div class="codehilite" data-code-language="Python"><pre><span></span><code>',
+        b"</code></pre></div>\\n",
+        b'<div class="message_inline_image"><a href="/user_uploads/',
+        b'<a class="stream-topic" data-stream-id="',
+        b'<a class="stream" data-stream-id="',
+        b'<span class="user-group-mention" data-user-group-id="',
+        b'<span class="user-mention silent" data-user-id="',
+        b'<span aria-label="',
+        b'" class="emoji emoji-',
+        b'" role="img" title="',
+        b"<blockquote>\\n<p>",
+        b"</p>\\n</blockquote>\\n",
+        b"<ul>\\n<li>",
+        b"</li>\\n</ul>",
+        b"<strong>",
+        b"</strong>",
+        b"<em>",
+        b"</em>",
+        b"<code>",
+        b"</code>",
+        b'<a href="https://',
+        b'">https://',
+        b"</a>",
+        b"<br>\\n",
+        b"```\\n",
+        b"@**",
+        b"#**",
+        b'"submessages":[{"msg_type":"widget","content":"{\\"widget_type\\":\\"',
+        b'","sender_id":',
+        b',"message_id":',
+        b'"edit_history":[{"prev_content":"',
+        b'","prev_rendered_content":"<p>',
+        b'</p>","prev_rendered_content_version":1,',
+        b'"prev_topic":"',
+        b'","topic":"',
+        b'"prev_stream":',
+        b',"stream":',
+        b',"user_id":',
+        b'"last_edit_timestamp":17',
+        b'"reactions":[{"emoji_name":"',
+        b'","emoji_code":"1f44d","reaction_type":"unicode_emoji","user":{"email":"',
+        b'@zulip.com","id":',
+        b',"full_name":"',
+        b'"},"user_id":',
+        b'"client":"ZulipMobile"',
+        b'"client":"ZulipElectron"',
+        b'"client":"ZulipPython"',
+        b'"client":"Internal"',
+        b'<span class="user-mention" data-user-id="',
+        b"</p>\\n<p>",
+        b'{"id":',
+        b',"sender_id":',
+        b',"content":"',
+        b'","recipient_type_id":',
+        b',"recipient_type":1,"recipient_id":',
+        b',"recipient_type":3,"recipient_id":',
+        b',"recipient_type":2,"recipient_id":',
+        b',"timestamp":17',
+        b',"client":"website","subject":"',
+        b'","sender_realm_id":',
+        b',"topic_links":[],"rendered_content":"<p>',
+        b'</p>","is_me_message":false,"reactions":[],"submessages":[]}',
+    ]
+)
+
+
+class MessageDictCodec(ABC):
+    """Compresses the JSON for message_dict cache entries.
+
+    Except for the original zlib encoding, each codec's output is
+    prefixed with its tag, so that we can read entries written with
+    any codec, whichever one we're writing with."""
+
+    name: str
+    tag: bytes
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibCodec(MessageDictCodec):
+    """The original encoding, which has no tag; a zlib stream always
+    starts with b"x", which no other codec may use as its tag."""
+
+    name = "zlib"
+    tag = b""
+
+    @override
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data)
+
+    @override
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZlibDictionaryCodec(MessageDictCodec):
+    """Raw deflate, primed with a dictionary; most of a typical
+    message's JSON is then back-references into the dictionary, and
+    the zlib header and checksum are left out, which for short
+    messages roughly halves the size of the entry."""
+
+    def __init__(self, name: str, tag: bytes, dictionary: bytes, level: int = 6) -> None:
+        self.name = name
+        self.tag = tag
+        # Priming a compressor with the dictionary takes longer than
+        # compressing a typical message, so we do it once, and copy
+        # the primed compressor for each message.
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+
+    @override
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    @override
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = self.decompressor.copy()
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+CODECS: list[MessageDictCodec] = [
+    ZlibCodec(),
+    ZlibDictionaryCodec("zlib_dictionary_v1", b"\x01", MESSAGE_DICT_DICTIONARY_V1),
+]
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS}
+CODECS_BY_TAG = {codec.tag: codec for codec in CODECS if codec.tag != b""}
+assert b"x" not in CODECS_BY_TAG
+assert len(CODECS_BY_TAG) == len(CODECS) - 1
+
+
+def compress_message_dict(data: bytes) -> bytes:
+    codec = CODECS_BY_NAME[settings.MESSAGE_DICT_CACHE_CODEC]
+    return codec.tag + codec.compress(data)
+
+
+def decompress_message_dict(data: bytes) -> bytes:
+    if data[:1] == b"x":
+        return CODECS_BY_NAME["zlib"].decompress(data)
+    return CODECS_BY_TAG[data[:1]].decompress(data[1:])
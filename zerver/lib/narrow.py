@@ -23,6 +23,7 @@ from sqlalchemy.sql import (
     literal,
     literal_column,
     not_,
+    null,
     or_,
     select,
     table,
@@ -1077,16 +1078,9 @@ def add_narrow_conditions(
     return (query, is_search)
 
 
-def find_first_unread_anchor(
-    sa_conn: Connection,
-    user_profile: UserProfile | None,
-    narrow: list[NarrowParameter] | None,
-) -> int:
-    # For anonymous web users, all messages are treated as read, and so
-    # always return LARGER_THAN_MAX_MESSAGE_ID.
-    if user_profile is None:
-        return LARGER_THAN_MAX_MESSAGE_ID
-
+def first_unread_query(user_profile: UserProfile, narrow: list[NarrowParameter] | None) -> Select:
+    """Returns a query for the ID of the user's first unread message in
+    the narrow, if any, ignoring muted topics and channels."""
     # We always need UserMessage in our query, because it has the unread
     # flag for the user.
     need_user_message = True
@@ -1122,9 +1116,24 @@ def find_first_unread_anchor(
     if muting_conditions:
         condition = and_(condition, *muting_conditions)
 
-    first_unread_query = query.where(condition)
+    first_unread_query = query.with_only_columns(inner_msg_id_col).where(condition)
     first_unread_query = first_unread_query.order_by(inner_msg_id_col.asc()).limit(1)
-    first_unread_result = list(sa_conn.execute(first_unread_query).fetchall())
+    if not is_search:
+        first_unread_query = first_unread_query.execution_options(prepare=True)
+    return first_unread_query
+
+
+def find_first_unread_anchor(
+    sa_conn: Connection,
+    user_profile: UserProfile | None,
+    narrow: list[NarrowParameter] | None,
+) -> int:
+    # For anonymous web users, all messages are treated as read, and so
+    # always return LARGER_THAN_MAX_MESSAGE_ID.
+    if user_profile is None:
+        return LARGER_THAN_MAX_MESSAGE_ID
+
+    first_unread_result = list(sa_conn.execute(first_unread_query(user_profile, narrow)).fetchall())
     if len(first_unread_result) > 0:
         anchor = first_unread_result[0][0]
     else:
@@ -1171,11 +1180,21 @@ def parse_anchor_value(anchor_val: str | None, use_first_unread_anchor: bool) ->
         raise JsonableError(_("Invalid anchor"))
 
 
+def at_least(
+    anchor: int | ColumnElement[Integer], first_visible_message_id: int
+) -> int | ColumnElement[Integer]:
+    if isinstance(anchor, int):
+        return max(anchor, first_visible_message_id)
+    if first_visible_message_id == 0:
+        return anchor
+    return func.greatest(anchor, first_visible_message_id, type_=Integer)
+
+
 def limit_query_to_range(
     query: Select,
     num_before: int,
     num_after: int,
-    anchor: int,
+    anchor: int | ColumnElement[Integer],
     include_anchor: bool,
     anchored_to_left: bool,
     anchored_to_right: bool,
@@ -1185,6 +1204,9 @@ def limit_query_to_range(
     """
     This code is actually generic enough that we could move it to a
     library, but our only caller for now is message search.
+
+    The anchor may be a SQL expression, such as a scalar subquery, when
+    it isn't known until the query runs.
     """
     need_before_query = (not anchored_to_left) and (num_before > 0)
     need_after_query = (not anchored_to_right) and (num_after > 0)
@@ -1205,16 +1227,16 @@ def limit_query_to_range(
     # actually may fetch an extra row at one of the extremes.
     if need_both_sides:
         before_anchor = anchor - 1
-        after_anchor = max(anchor, first_visible_message_id)
+        after_anchor = at_least(anchor, first_visible_message_id)
         before_limit = num_before
         after_limit = num_after + 1
     elif need_before_query:
-        before_anchor = anchor - (not include_anchor)
+        before_anchor = anchor - int(not include_anchor)
         before_limit = num_before
         if not anchored_to_right:
             before_limit += include_anchor
     elif need_after_query:
-        after_anchor = max(anchor + (not include_anchor), first_visible_message_id)
+        after_anchor = at_least(anchor + int(not include_anchor), first_visible_message_id)
         after_limit = num_after + include_anchor
 
     if need_before_query:
@@ -1399,27 +1421,43 @@ def fetch_messages(
         if client_requested_message_ids is not None:
             query = query.filter(inner_msg_id_col.in_(client_requested_message_ids))
         else:
-            if anchor is None:
-                # `anchor=None` corresponds to the anchor="first_unread" parameter.
-                anchor = find_first_unread_anchor(
-                    sa_conn,
-                    user_profile,
-                    narrow,
-                )
+            if anchor is None and user_profile is None:
+                # For anonymous web users, all messages are treated as
+                # read; see find_first_unread_anchor.
+                anchor = LARGER_THAN_MAX_MESSAGE_ID
 
-            anchored_to_left = anchor == 0
+            query_anchor: int | ColumnElement[Integer]
+            if anchor is None:
+                # `anchor=None` corresponds to the anchor="first_unread"
+                # parameter.  Rather than a separate round trip to find
+                # the anchor, we find it in a CTE of the query for the
+                # messages around it.  Since we can't yet tell whether
+                # there is an unread message, the query doesn't assume
+                # it's anchored at either end; post_process_limited_query
+                # gets the same result either way.
+                assert user_profile is not None
+                first_unread = select(
+                    func.coalesce(
+                        first_unread_query(user_profile, narrow).scalar_subquery(),
+                        literal_column(str(LARGER_THAN_MAX_MESSAGE_ID), Integer),
+                    ).label("anchor")
+                ).cte("first_unread")
+                query_anchor = select(first_unread.c.anchor).scalar_subquery()
+            else:
+                anchored_to_left = anchor == 0
 
-            # Set value that will be used to short circuit the after_query
-            # altogether and avoid needless conditions in the before_query.
-            anchored_to_right = anchor >= LARGER_THAN_MAX_MESSAGE_ID
-            if anchored_to_right:
-                num_after = 0
+                # Set value that will be used to short circuit the after_query
+                # altogether and avoid needless conditions in the before_query.
+                anchored_to_right = anchor >= LARGER_THAN_MAX_MESSAGE_ID
+                if anchored_to_right:
+                    num_after = 0
+                query_anchor = anchor
 
             query = limit_query_to_range(
                 query=query,
                 num_before=num_before,
                 num_after=num_after,
-                anchor=anchor,
+                anchor=query_anchor,
                 include_anchor=include_anchor,
                 anchored_to_left=anchored_to_left,
                 anchored_to_right=anchored_to_right,
@@ -1428,11 +1466,24 @@ def fetch_messages(
             )
 
             main_query = query.subquery()
+            if anchor is None:
+                # The anchor comes back as an extra row, with the
+                # negated anchor as its message ID, so that it sorts
+                # before all the messages.
+                anchor_row = select(
+                    (-first_unread.c.anchor).label("message_id"),
+                    *(null() for _ in list(main_query.c)[1:]),
+                )
+                main_query = union_all(select(*main_query.c), anchor_row).subquery()
             query = (
                 select(*main_query.c)
                 .select_from(main_query)
                 .order_by(column("message_id", Integer).asc())
             )
+            if not is_search:
+                # Search queries are dominated by the full-text search
+                # itself, rather than planning; see use_prepared_statement.
+                query = query.execution_options(prepare=True)
 
         # This is a hack to tag the query we use for testing
         query = query.prefix_with("/* get_messages */")
@@ -1455,7 +1506,13 @@ def fetch_messages(
             is_search=is_search,
         )
 
-    assert anchor is not None
+    if anchor is None:
+        anchor = -rows[0][0]
+        rows = rows[1:]
+        anchored_to_right = anchor >= LARGER_THAN_MAX_MESSAGE_ID
+        if anchored_to_right:
+            num_after = 0
+
     query_info = post_process_limited_query(
         rows=rows,
         num_before=num_before,
@@ -1,5 +1,6 @@
-from collections.abc import Collection
-from typing import Any, Protocol
+from collections.abc import Callable, Collection
+from functools import lru_cache
+from typing import Any, Protocol, TypeAlias
 
 from django.utils.translation import gettext as _
 
@@ -30,55 +31,105 @@ class NarrowPredicate(Protocol):
     def __call__(self, *, message: dict[str, Any], flags: list[str]) -> bool: ...
 
 
+NarrowTermCheck: TypeAlias = Callable[[dict[str, Any], Collection[str]], bool]
+
+
 def build_narrow_predicate(
     narrow: Collection[NarrowTerm],
 ) -> NarrowPredicate:
     """Changes to this function should come with corresponding changes to
     NarrowLibraryTest."""
     check_narrow_for_events(narrow)
+    return compile_narrow_predicate(tuple((term.operator, term.operand) for term in narrow))
+
+
+@lru_cache(maxsize=1000)
+def compile_narrow_predicate(narrow: tuple[tuple[str, str], ...]) -> NarrowPredicate:
+    """Compiles a narrow, which must already have been validated, into a
+    predicate on message dictionaries and their flags.
+
+    Each term is compiled once into a specialized check, with its
+    operand already lowercased, so that evaluating the predicate does
+    not need to interpret the narrow.  Since this is cached, all event
+    queues with identical narrows share the same predicate.
+    """
+    checks = [compile_narrow_term(operator, operand) for operator, operand in narrow]
 
     def narrow_predicate(*, message: dict[str, Any], flags: list[str]) -> bool:
-        def satisfies_operator(*, operator: str, operand: str) -> bool:
-            if operator in channel_operators:
-                if message["type"] != "stream":
-                    return False
-                if operand.lower() != message["display_recipient"].lower():
-                    return False
-            elif operator == "topic":
-                if message["type"] != "stream":
-                    return False
-                topic_name = get_topic_from_message_info(message)
-                if operand.lower() != topic_name.lower():
-                    return False
-            elif operator == "sender":
-                if operand.lower() != message["sender_email"].lower():
-                    return False
-            elif operator == "is" and operand in ["dm", "private"]:
-                # "is:private" is a legacy alias for "is:dm"
-                if message["type"] != "private":
-                    return False
-            elif operator == "is" and operand in ["starred"]:
-                if operand not in flags:
-                    return False
-            elif operator == "is" and operand == "unread":
-                if "read" in flags:
-                    return False
-            elif operator == "is" and operand in ["alerted", "mentioned"]:
-                if "mentioned" not in flags:
-                    return False
-            elif operator == "is" and operand == "resolved":
-                if message["type"] != "stream":
-                    return False
-                topic_name = get_topic_from_message_info(message)
-                if not topic_name.startswith(RESOLVED_TOPIC_PREFIX):
-                    return False
-            return True
-
-        for narrow_term in narrow:
-            # TODO: Eventually handle negated narrow terms.
-            if not satisfies_operator(operator=narrow_term.operator, operand=narrow_term.operand):
-                return False
+        # TODO: Eventually handle negated narrow terms.
+        return all(check(message, flags) for check in checks)
+
+    return narrow_predicate
+
+
+def compile_narrow_term(operator: str, operand: str) -> NarrowTermCheck:
+    if operator in channel_operators:
+        channel_name = operand.lower()
+
+        def check_channel(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return (
+                message["type"] == "stream" and message["display_recipient"].lower() == channel_name
+            )
+
+        return check_channel
+
+    if operator == "topic":
+        topic_name = operand.lower()
+
+        def check_topic(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return (
+                message["type"] == "stream"
+                and get_topic_from_message_info(message).lower() == topic_name
+            )
+
+        return check_topic
+
+    if operator == "sender":
+        sender_email = operand.lower()
+
+        def check_sender(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return message["sender_email"].lower() == sender_email
 
+        return check_sender
+
+    if operator == "is" and operand in ["dm", "private"]:
+        # "is:private" is a legacy alias for "is:dm"
+        def check_dm(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return message["type"] == "private"
+
+        return check_dm
+
+    if operator == "is" and operand in ["starred"]:
+
+        def check_starred(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return "starred" in flags
+
+        return check_starred
+
+    if operator == "is" and operand == "unread":
+
+        def check_unread(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return "read" not in flags
+
+        return check_unread
+
+    if operator == "is" and operand in ["alerted", "mentioned"]:
+
+        def check_mentioned(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return "mentioned" in flags
+
+        return check_mentioned
+
+    if operator == "is" and operand == "resolved":
+
+        def check_resolved(message: dict[str, Any], flags: Collection[str]) -> bool:
+            return message["type"] == "stream" and get_topic_from_message_info(message).startswith(
+                RESOLVED_TOPIC_PREFIX
+            )
+
+        return check_resolved
+
+    def no_check(message: dict[str, Any], flags: Collection[str]) -> bool:
         return True
 
-    return narrow_predicate
+    return no_check
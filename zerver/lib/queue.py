@@ -391,17 +391,51 @@ class TornadoQueueClient(QueueClient[Channel]):
         batch_size: int = 1,
         timeout: int | None = None,
     ) -> None:
+        # With batch_size > 1, we collect the events which pika
+        # delivers to us before the IOLoop next gets a chance to run
+        # callbacks, up to batch_size of them, and pass them to the
+        # callback together; there is no waiting for a batch to fill,
+        # so timeout is not supported.
+        pending_events: list[dict[str, Any]] = []
+        pending_delivery_tag: int | None = None
+
+        def process_pending_events(ch: Channel) -> None:
+            nonlocal pending_delivery_tag
+            if not pending_events:
+                return
+            events = pending_events.copy()
+            delivery_tag = pending_delivery_tag
+            assert delivery_tag is not None
+            pending_events.clear()
+            pending_delivery_tag = None
+            if not ch.is_open:
+                # The events were delivered on a channel which has
+                # since been closed, so RabbitMQ will redeliver them.
+                return
+            callback(events)
+            ch.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
         def wrapped_consumer(
             ch: Channel,
             method: Basic.Deliver,
             properties: pika.BasicProperties,
             body: bytes,
         ) -> None:
+            nonlocal pending_delivery_tag
             assert method.delivery_tag is not None
-            callback([orjson.loads(body)])
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            if batch_size == 1:
+                callback([orjson.loads(body)])
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+
+            pending_events.append(orjson.loads(body))
+            pending_delivery_tag = method.delivery_tag
+            if len(pending_events) >= batch_size:
+                process_pending_events(ch)
+            elif len(pending_events) == 1:
+                ioloop.IOLoop.current().add_callback(process_pending_events, ch)
 
-        assert batch_size == 1
+        assert batch_size <= self.prefetch
         assert timeout is None
         self.consumers[queue_name].add(wrapped_consumer)
 
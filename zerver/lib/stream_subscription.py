@@ -1,14 +1,14 @@
 import itertools
 from collections import defaultdict
 from collections.abc import Collection
-from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
 from operator import itemgetter
 from typing import Any
 
-from django.db.models import Q, QuerySet
+from django.db.models import QuerySet
 
-from zerver.models import AlertWord, Realm, Recipient, Stream, Subscription, UserProfile, UserTopic
+from zerver.lib.cache import cache_with_key, stream_delivery_profile_cache_key
+from zerver.models import Realm, Recipient, Stream, Subscription, UserProfile
 
 
 @dataclass
@@ -288,70 +288,101 @@ def subscriber_ids_with_stream_history_access(stream: Stream) -> set[int]:
     )
 
 
-def get_subscriptions_for_send_message(
-    *,
-    realm_id: int,
-    stream_id: int,
-    topic_name: str,
-    possible_stream_wildcard_mention: bool,
-    topic_participant_user_ids: AbstractSet[int],
-    possibly_mentioned_user_ids: AbstractSet[int],
-) -> QuerySet[Subscription]:
-    """This function optimizes an important use case for large
-    streams. Open realms often have many long_term_idle users, which
-    can result in 10,000s of long_term_idle recipients in default
-    streams. do_send_messages has an optimization to avoid doing work
-    for long_term_idle unless message flags or notifications should be
-    generated.
-
-    However, it's expensive even to fetch and process them all in
-    Python at all. This function returns all recipients of a stream
-    message that could possibly require action in the send-message
-    codepath.
-
-    Basically, it returns all subscribers, excluding all long-term
-    idle users who it can prove will not receive a UserMessage row or
-    notification for the message (i.e. no alert words, mentions, or
-    email/push notifications are configured) and thus are not needed
-    for processing the message send.
-
-    Critically, this function is called before the Markdown
-    processor. As a result, it returns all subscribers who have ANY
-    configured alert words, even if their alert words aren't present
-    in the message. Similarly, it returns all subscribers who match
-    the "possible mention" parameters.
-
-    Downstream logic, which runs after the Markdown processor has
-    parsed the message, will do the precise determination.
+@dataclass
+class StreamDeliveryProfile:
+    """The subscriber-side data get_recipient_info needs to deliver a
+    message to a stream, independent of the message's topic.
+
+    The notification sets are the users for whom the setting is
+    enabled on the stream, either explicitly or by way of their
+    user-level default; muting is left to the caller, since it
+    depends on each user's policy for the message's topic.
     """
 
-    query = get_active_subscriptions_for_stream_id(
-        stream_id,
-        include_deactivated_users=False,
+    user_ids: set[int]
+    muted_user_ids: set[int]
+    long_term_idle_user_ids: set[int]
+    push_notifications_user_ids: set[int]
+    email_notifications_user_ids: set[int]
+    wildcard_mentions_notify_user_ids: set[int]
+    followed_topic_push_notifications_user_ids: set[int]
+    followed_topic_email_notifications_user_ids: set[int]
+    followed_topic_wildcard_mentions_notify_user_ids: set[int]
+
+
+@cache_with_key(stream_delivery_profile_cache_key, timeout=3600 * 24 * 7)
+def get_stream_delivery_profile(recipient_id: int) -> StreamDeliveryProfile:
+    """Computes the StreamDeliveryProfile for a stream's recipient with
+    a single query over its active subscriptions.
+
+    This includes every long_term_idle subscriber, so that the result
+    can be cached across messages; get_recipient_info filters out
+    those who don't need to be sent the message in Python.  The
+    cache is flushed when a subscription changes, or when one of the
+    stream_delivery_profile_user_fields changes for a subscriber.
+    """
+    profile = StreamDeliveryProfile(
+        user_ids=set(),
+        muted_user_ids=set(),
+        long_term_idle_user_ids=set(),
+        push_notifications_user_ids=set(),
+        email_notifications_user_ids=set(),
+        wildcard_mentions_notify_user_ids=set(),
+        followed_topic_push_notifications_user_ids=set(),
+        followed_topic_email_notifications_user_ids=set(),
+        followed_topic_wildcard_mentions_notify_user_ids=set(),
     )
-
-    if possible_stream_wildcard_mention:
-        return query
-
-    query = query.filter(
-        Q(user_profile__long_term_idle=False)
-        | Q(push_notifications=True)
-        | (Q(push_notifications=None) & Q(user_profile__enable_stream_push_notifications=True))
-        | Q(email_notifications=True)
-        | (Q(email_notifications=None) & Q(user_profile__enable_stream_email_notifications=True))
-        | Q(user_profile_id__in=possibly_mentioned_user_ids)
-        | Q(user_profile_id__in=topic_participant_user_ids)
-        | Q(
-            user_profile_id__in=AlertWord.objects.filter(realm_id=realm_id).values_list(
-                "user_profile_id"
-            )
-        )
-        | Q(
-            user_profile_id__in=UserTopic.objects.filter(
-                stream_id=stream_id,
-                topic_name__iexact=topic_name,
-                visibility_policy=UserTopic.VisibilityPolicy.FOLLOWED,
-            ).values_list("user_profile_id")
-        )
+    rows = Subscription.objects.filter(
+        recipient_id=recipient_id,
+        active=True,
+        is_user_active=True,
+    ).values_list(
+        "user_profile_id",
+        "is_muted",
+        "push_notifications",
+        "email_notifications",
+        "wildcard_mentions_notify",
+        "user_profile__long_term_idle",
+        "user_profile__enable_stream_push_notifications",
+        "user_profile__enable_stream_email_notifications",
+        "user_profile__wildcard_mentions_notify",
+        "user_profile__enable_followed_topic_push_notifications",
+        "user_profile__enable_followed_topic_email_notifications",
+        "user_profile__enable_followed_topic_wildcard_mentions_notify",
     )
-    return query
+    for (
+        user_id,
+        is_muted,
+        push_notifications,
+        email_notifications,
+        wildcard_mentions_notify,
+        long_term_idle,
+        user_push_notifications,
+        user_email_notifications,
+        user_wildcard_mentions_notify,
+        followed_topic_push_notifications,
+        followed_topic_email_notifications,
+        followed_topic_wildcard_mentions_notify,
+    ) in rows:
+        profile.user_ids.add(user_id)
+        if is_muted:
+            profile.muted_user_ids.add(user_id)
+        if long_term_idle:
+            profile.long_term_idle_user_ids.add(user_id)
+        if push_notifications if push_notifications is not None else user_push_notifications:
+            profile.push_notifications_user_ids.add(user_id)
+        if email_notifications if email_notifications is not None else user_email_notifications:
+            profile.email_notifications_user_ids.add(user_id)
+        if (
+            wildcard_mentions_notify
+            if wildcard_mentions_notify is not None
+            else user_wildcard_mentions_notify
+        ):
+            profile.wildcard_mentions_notify_user_ids.add(user_id)
+        if followed_topic_push_notifications:
+            profile.followed_topic_push_notifications_user_ids.add(user_id)
+        if followed_topic_email_notifications:
+            profile.followed_topic_email_notifications_user_ids.add(user_id)
+        if followed_topic_wildcard_mentions_notify:
+            profile.followed_topic_wildcard_mentions_notify_user_ids.add(user_id)
+    return profile
@@ -1,12 +1,19 @@
-from collections.abc import Callable
+from collections import defaultdict
+from collections.abc import Callable, Iterable
 from datetime import datetime
 from typing import Any
 
 import orjson
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import F, Func, JSONField, Q, QuerySet, Subquery, TextField, Value
 from django.db.models.functions import Cast
 
+from zerver.lib.cache import (
+    cache_delete_many,
+    cache_get_many,
+    cache_with_key,
+    topic_participants_cache_key,
+)
 from zerver.lib.types import EditHistoryEvent
 from zerver.lib.utils import assert_is_not_none
 from zerver.models import Message, Reaction, Stream, UserMessage, UserProfile
@@ -299,6 +306,18 @@ def get_topic_resolution_and_bare_name(stored_name: str) -> tuple[bool, str]:
     return (False, stored_name)
 
 
+# Cached, since every message which might contain a topic wildcard
+# mention needs the participants in its topic.  Sending and reacting
+# call note_topic_participants, and moving or deleting messages calls
+# flush_topic_participants.  Messages archived by a retention policy
+# (or restored from the archive) can leave a cached set stale until
+# it expires.
+@cache_with_key(
+    lambda realm_id, recipient_id, topic_name: topic_participants_cache_key(
+        recipient_id, topic_name
+    ),
+    timeout=3600 * 24,
+)
 def participants_for_topic(realm_id: int, recipient_id: int, topic_name: str) -> set[int]:
     """
     Users who either sent or reacted to the messages in the topic.
@@ -321,3 +340,47 @@ def participants_for_topic(realm_id: int, recipient_id: int, topic_name: str) ->
         ).values_list("id", flat=True)
     )
     return participants
+
+
+def note_topic_participants(participants: Iterable[tuple[int, str, int]]) -> None:
+    """Takes (recipient_id, topic_name, user_id) triples for users who
+    just sent or reacted to a message in a topic, and flushes the
+    cached participants_for_topic for any topic they are new to.
+
+    We flush, rather than adding them to the cached set, since two
+    concurrent updates of the set could lose one of the new
+    participants.
+    """
+    user_ids_by_key: dict[str, set[int]] = defaultdict(set)
+    for recipient_id, topic_name, user_id in participants:
+        user_ids_by_key[topic_participants_cache_key(recipient_id, topic_name)].add(user_id)
+    if not user_ids_by_key:
+        return
+
+    cached = cache_get_many(list(user_ids_by_key))
+    stale_keys = [
+        key
+        for key, (participant_ids,) in cached.items()
+        if not user_ids_by_key[key] <= participant_ids
+    ]
+    if stale_keys:
+        delete_topic_participants_cache_keys(stale_keys)
+
+
+def flush_topic_participants(topics: Iterable[tuple[int, str]]) -> None:
+    """Flushes the cached participants_for_topic for each
+    (recipient_id, topic_name) pair, after messages have been moved
+    into or out of it, or deleted."""
+    delete_topic_participants_cache_keys(
+        [
+            topic_participants_cache_key(recipient_id, topic_name)
+            for recipient_id, topic_name in topics
+        ]
+    )
+
+
+def delete_topic_participants_cache_keys(keys: list[str]) -> None:
+    cache_delete_many(keys)
+    # A concurrent participants_for_topic may not have seen this
+    # transaction's changes; so flush again once they are visible.
+    transaction.on_commit(lambda: cache_delete_many(keys))
@@ -49,6 +49,13 @@ def create_historical_user_messages(
     bulk_insert_all_ums([user_id], message_ids, flags, conflict)
 
 
+# Above this many rows, bulk_insert_ums passes the rows to PostgreSQL
+# as three arrays, in a single statement; execute_values instead
+# formats them into VALUES lists, in statements of 100 rows each,
+# which dominates the cost of sending a message to a large channel.
+BULK_INSERT_UMS_UNNEST_THRESHOLD = 100
+
+
 def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
     """
     Doing bulk inserts this way is much faster than using Django,
@@ -59,6 +66,17 @@ def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
     if not ums:
         return
 
+    if len(ums) > BULK_INSERT_UMS_UNNEST_THRESHOLD:
+        bulk_insert_um_arrays(
+            [um.user_profile_id for um in ums],
+            [um.message_id for um in ums],
+            [um.flags for um in ums],
+        )
+    else:
+        bulk_insert_um_values(ums)
+
+
+def bulk_insert_um_values(ums: list[UserMessageLite]) -> None:
     vals = [(um.user_profile_id, um.message_id, um.flags) for um in ums]
     query = SQL(
         """
@@ -73,6 +91,22 @@ def bulk_insert_ums(ums: list[UserMessageLite]) -> None:
         execute_values(cursor.cursor, query, vals)
 
 
+def bulk_insert_um_arrays(user_ids: list[int], message_ids: list[int], flags: list[int]) -> None:
+    """Inserts the UserMessage rows (user_ids[i], message_ids[i],
+    flags[i]).  COPY would be faster still, but cannot skip rows which
+    already exist, as ON CONFLICT DO NOTHING does."""
+    query = SQL(
+        """
+        INSERT INTO zerver_usermessage (user_profile_id, message_id, flags)
+        SELECT * FROM UNNEST(%s::integer[], %s::integer[], %s::bigint[])
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, [user_ids, message_ids, flags])
+
+
 def bulk_insert_all_ums(
     user_ids: list[int], message_ids: list[int], flags: int, conflict: Composable | None = None
 ) -> None:
@@ -118,7 +118,9 @@ class Command(ZulipBaseCommand):
                     queue_name = notify_tornado_queue_name(port)
                     stack.callback(queue_client.close)
                     queue_client.start_json_consumer(
-                        queue_name, get_wrapped_process_notification(queue_name)
+                        queue_name,
+                        get_wrapped_process_notification(queue_name),
+                        batch_size=settings.TORNADO_NOTIFICATION_BATCH_SIZE,
                     )
 
                 # Application is an instance of Django's standard wsgi handler.
@@ -10,7 +10,7 @@ from django.utils.translation import gettext_lazy
 from django_stubs_ext import StrPromise
 from typing_extensions import override
 
-from zerver.lib.cache import flush_stream
+from zerver.lib.cache import flush_stream, flush_subscription
 from zerver.lib.timestamp import datetime_to_timestamp
 from zerver.lib.types import DefaultStreamDict, GroupPermissionSetting
 from zerver.models.groups import SystemGroups, UserGroup
@@ -370,6 +370,10 @@ class Subscription(models.Model):
     ]
 
 
+post_save.connect(flush_subscription, sender=Subscription)
+post_delete.connect(flush_subscription, sender=Subscription)
+
+
 class DefaultStream(models.Model):
     realm = models.ForeignKey(Realm, on_delete=CASCADE)
     stream = models.ForeignKey(Stream, on_delete=CASCADE)
@@ -1,5 +1,7 @@
+import os
+import tempfile
 import time
-from collections.abc import Callable, Collection
+from collections.abc import Callable, Collection, Mapping
 from typing import Any
 from unittest import mock
 
@@ -18,15 +20,26 @@ from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import HostRequestMock, dummy_handler, mock_queue_publish
 from zerver.models import Recipient, Subscription, UserProfile, UserTopic
 from zerver.models.streams import get_stream
+from zerver.tornado import event_queue
+from zerver.tornado.descriptors import set_descriptor_by_handler_id
 from zerver.tornado.event_queue import (
     ClientDescriptor,
     access_client_descriptor,
     allocate_client_descriptor,
+    checkpoint_event_queues,
+    clear_client_event_queues_for_testing,
+    dump_event_queues,
+    gc_event_queues,
+    get_client_info_for_message_event,
+    get_wrapped_process_notification,
+    load_event_queues,
     maybe_enqueue_notifications,
+    migrate_event_queues,
     missedmessage_hook,
     persistent_queue_filename,
     process_notification,
 )
+from zerver.tornado.sharding import get_user_id_tornado_port
 from zerver.tornado.views import cleanup_event_queue, get_events
 
 
@@ -125,6 +138,171 @@ class StreamWatchersTest(ZulipTestCase):
         )
 
 
+class NarrowIndexTest(ZulipTestCase):
+    def test_stream_narrow_index(self) -> None:
+        clear_client_event_queues_for_testing()
+        hamlet = self.example_user("hamlet")
+
+        def allocate_client(narrow: list[list[str]]) -> ClientDescriptor:
+            return allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="website",
+                    event_types=["message"],
+                    last_connection_time=time.time(),
+                    queue_timeout=0,
+                    realm_id=hamlet.realm_id,
+                    user_profile_id=hamlet.id,
+                    narrow=narrow,
+                )
+            )
+
+        stream_client = allocate_client([["channel", "Denmark"]])
+        topic_client = allocate_client([["stream", "denmark"], ["topic", "Party"]])
+        other_topic_client = allocate_client([["channel", "Denmark"], ["topic", "other"]])
+        other_stream_client = allocate_client([["channel", "Verona"]])
+        sender_client = allocate_client([["sender", "iago@zulip.com"]])
+
+        event_template = dict(
+            type="message",
+            realm_id=hamlet.realm_id,
+            stream_name="Denmark",
+            message_dict=dict(subject="party"),
+        )
+        self.assertEqual(
+            set(get_client_info_for_message_event(event_template, [])),
+            {
+                stream_client.event_queue.id,
+                topic_client.event_queue.id,
+                sender_client.event_queue.id,
+            },
+        )
+
+        # Garbage-collected clients are removed from the index.
+        topic_client.cleanup()
+        other_topic_client.cleanup()
+        self.assertEqual(
+            event_queue.realm_clients_by_narrow[hamlet.realm_id],
+            {("denmark", None): [stream_client], ("verona", None): [other_stream_client]},
+        )
+        self.assertEqual(
+            set(get_client_info_for_message_event(event_template, [])),
+            {stream_client.event_queue.id, sender_client.event_queue.id},
+        )
+
+        stream_client.cleanup()
+        other_stream_client.cleanup()
+        self.assertNotIn(hamlet.realm_id, event_queue.realm_clients_by_narrow)
+
+
+class GarbageCollectionTest(ZulipTestCase):
+    def test_gc_event_queues(self) -> None:
+        clear_client_event_queues_for_testing()
+        hamlet = self.example_user("hamlet")
+
+        def allocate_client(last_connection_time: float) -> ClientDescriptor:
+            return allocate_client_descriptor(
+                dict(
+                    all_public_streams=False,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="website",
+                    event_types=["message"],
+                    last_connection_time=last_connection_time,
+                    queue_timeout=600,
+                    realm_id=hamlet.realm_id,
+                    user_profile_id=hamlet.id,
+                    narrow=[],
+                )
+            )
+
+        now = time.time()
+        expired_client = allocate_client(now - 700)
+        fresh_client = allocate_client(now)
+        # This queue's deadline has passed, but it was used since it
+        # was scheduled, so it should be rescheduled rather than removed.
+        used_client = allocate_client(now - 700)
+        used_client.last_connection_time = now - 100
+        # Connected queues never expire.
+        connected_client = allocate_client(now - 700)
+        connected_client.current_handler_id = 1
+
+        gc_event_queues(port=9800)
+        self.assertNotIn(expired_client.event_queue.id, event_queue.clients)
+        self.assertEqual(
+            set(event_queue.clients),
+            {
+                fresh_client.event_queue.id,
+                used_client.event_queue.id,
+                connected_client.event_queue.id,
+            },
+        )
+        self.assertEqual(
+            sorted(queue_id for deadline, queue_id in event_queue.gc_heap),
+            sorted([fresh_client.event_queue.id, used_client.event_queue.id]),
+        )
+        self.assertEqual(dict(event_queue.gc_heap)[now + 500], used_client.event_queue.id)
+
+        # Once the connected queue's handler goes away, it is scheduled again.
+        connected_client.current_handler_id = None
+        connected_client.disconnect_handler()
+        self.assert_length(event_queue.gc_heap, 3)
+        clear_client_event_queues_for_testing()
+
+
+class ShardingTest(ZulipTestCase):
+    def test_get_user_id_tornado_port(self) -> None:
+        ports = [9800, 9801, 9802]
+        assignments = {user_id: get_user_id_tornado_port(ports, user_id) for user_id in range(3000)}
+        for port in ports:
+            self.assertGreater(list(assignments.values()).count(port), 900)
+
+        # Adding a port only moves users to the new port.
+        for user_id, port in assignments.items():
+            self.assertIn(get_user_id_tornado_port([*ports, 9803], user_id), [port, 9803])
+
+    def test_migrate_event_queues(self) -> None:
+        clear_client_event_queues_for_testing()
+        hamlet = self.example_user("hamlet")
+        client = allocate_client_descriptor(
+            dict(
+                all_public_streams=False,
+                apply_markdown=True,
+                client_gravatar=True,
+                client_type_name="website",
+                event_types=None,
+                last_connection_time=time.time(),
+                queue_timeout=600,
+                realm_id=hamlet.realm_id,
+                user_profile_id=hamlet.id,
+                narrow=[],
+            )
+        )
+        client.event_queue.push({"type": "heartbeat"})
+        queue_id = client.event_queue.id
+        port = get_user_id_tornado_port([9800, 9801], hamlet.id)
+
+        # Queues of users which stay on this port are untouched.
+        migrate_event_queues(port, {hamlet.realm_id: [9800, 9801]})
+        self.assertIs(event_queue.clients[queue_id], client)
+
+        # Other queues are handed off to their new port, which (in the
+        # test suite, this same process) adopts them, with a restart
+        # event at the end.
+        other_port = 9801 if port == 9800 else 9800
+        migrate_event_queues(other_port, {hamlet.realm_id: [9800, 9801]})
+        migrated_client = event_queue.clients[queue_id]
+        self.assertIsNot(migrated_client, client)
+        self.assertEqual(
+            [event["type"] for event in migrated_client.event_queue.contents()],
+            ["heartbeat", "restart"],
+        )
+        self.assertEqual(event_queue.user_clients[hamlet.id], [migrated_client])
+        clear_client_event_queues_for_testing()
+
+
 class MissedMessageHookTest(ZulipTestCase):
     """Tests what arguments missedmessage_hook passes into maybe_enqueue_notifications.
     Combined with the previous test, this ensures that the missedmessage_hook is correct"""
@@ -1204,6 +1382,100 @@ class FileReloadLogicTest(ZulipTestCase):
                 "/home/zulip/tornado/event_queues.9800.last.json",
             )
 
+    def test_event_queue_log(self) -> None:
+        hamlet = self.example_user("hamlet")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=600,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+        )
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            self.settings(
+                JSON_PERSISTENT_QUEUE_FILENAME_PATTERN=os.path.join(tmpdir, "event_queues%s.json")
+            ),
+        ):
+            clear_client_event_queues_for_testing()
+            filename = persistent_queue_filename(9800)
+            load_event_queues(9800)
+            client = allocate_client_descriptor(dict(queue_data))
+            other_client = allocate_client_descriptor(dict(queue_data))
+            client.add_event(dict(type="test", data="first"))
+
+            # The first checkpoint writes out every queue.
+            checkpoint_event_queues(9800)
+            with open(filename, "rb") as f:
+                self.assert_length(f.readlines(), 2)
+
+            # Later ones only append the changes to them; an event
+            # pushed to several queues is written once.
+            other_client.cleanup()
+            new_client = allocate_client_descriptor(dict(queue_data))
+            new_client_dict = new_client.to_dict()
+            event = dict(type="test", data="second")
+            client.add_event(event)
+            new_client.add_event(event)
+            first_event_id = client.event_queue.queue[0].id
+            client.event_queue.prune(first_event_id)
+            flags_event = dict(
+                type="update_message_flags", operation="add", flag="read", messages=[1], all=False
+            )
+            client.add_event(flags_event)
+            client.event_queue.resolved_events()
+            with self.assertLogs(level="INFO") as logs:
+                dump_event_queues(9800)
+            self.assertEqual(
+                logs.output[0].split(" in ")[0],
+                "INFO:root:Tornado 9800 wrote 7 changes to event queues",
+            )
+            with open(filename, "rb") as f:
+                records = [orjson.loads(line) for line in f]
+            client_id = client.event_queue.id
+            self.assertEqual(
+                records[2:],
+                [
+                    {"queue_id": other_client.event_queue.id, "deleted": True},
+                    {"queue_id": new_client.event_queue.id, "client": new_client_dict},
+                    {"payload": 0, "event": event},
+                    {"queue_id": client_id, "push": 0},
+                    {"queue_id": new_client.event_queue.id, "push": 0},
+                    {"queue_id": client_id, "prune": first_event_id},
+                    {"payload": 1, "event": flags_event},
+                    {"queue_id": client_id, "push": 1},
+                    {"queue_id": client_id, "resolve": True},
+                    {"shutdown": True},
+                ],
+            )
+
+            # Loading replays the changes.
+            expected = {
+                client_id: client.to_dict(),
+                new_client.event_queue.id: new_client.to_dict(),
+            }
+            clear_client_event_queues_for_testing()
+            with self.assertLogs(level="INFO"):
+                load_event_queues(9800)
+            self.assertEqual(
+                {qid: client.to_dict() for qid, client in event_queue.clients.items()}, expected
+            )
+
+            # The shutdown record is removed once loaded, so that the
+            # queues are not loaded again after an unclean shutdown.
+            clear_client_event_queues_for_testing()
+            with self.assertLogs(level="WARNING") as logs:
+                load_event_queues(9800)
+            self.assertEqual(
+                logs.output,
+                ["WARNING:root:Tornado 9800 discarding event queues after unclean shutdown"],
+            )
+            self.assertEqual(event_queue.clients, {})
+
 
 class PruneInternalDataTest(ZulipTestCase):
     def test_prune_internal_data(self) -> None:
@@ -1291,6 +1563,73 @@ class EventQueueTest(ZulipTestCase):
         self.assertEqual(queue.contents(), [out_dict])
         self.verify_to_dict_end_to_end(client)
 
+    def test_shared_event_payload(self) -> None:
+        client = self.get_client_descriptor()
+        other_client = self.get_client_descriptor()
+        other_client.event_queue.push(dict(type="unknown"))
+
+        event = dict(type="arbitrary", x="foo")
+        client.event_queue.push(event)
+        other_client.event_queue.push(event)
+
+        # Both queues hold a reference to the same payload, which is
+        # not modified, with only the event IDs stored separately.
+        self.assertIs(client.event_queue.queue[0].payload, event)
+        self.assertIs(other_client.event_queue.queue[1].payload, event)
+        self.assertEqual(event, dict(type="arbitrary", x="foo"))
+        self.assertEqual(client.event_queue.contents(), [dict(id=0, type="arbitrary", x="foo")])
+        self.assertEqual(
+            other_client.event_queue.contents(),
+            [dict(id=0, type="unknown"), dict(id=1, type="arbitrary", x="foo")],
+        )
+        self.verify_to_dict_end_to_end(client)
+        self.verify_to_dict_end_to_end(other_client)
+
+    def test_json_fragments(self) -> None:
+        client = self.get_client_descriptor()
+        other_client = self.get_client_descriptor()
+        other_client.event_queue.push(dict(type="unknown"))
+
+        message_dict = dict(id=42, content="hello")
+        event = dict(type="arbitrary", x="foo")
+        client.event_queue.push(event)
+        other_client.event_queue.push(event)
+        client.event_queue.push(
+            dict(type="message", message=message_dict, flags=[], internal_data={"a": True})
+        )
+        client.event_queue.push(
+            dict(type="update_message_flags", operation="add", flag="read", all=False, messages=[4])
+        )
+
+        # The shared payload is only serialized once.
+        self.assertEqual(
+            orjson.loads(orjson.dumps(other_client.event_queue.queue[1].to_json_fragment())),
+            dict(id=1, type="arbitrary", x="foo"),
+        )
+        with mock.patch("orjson.dumps", wraps=orjson.dumps) as m:
+            fragments = [event.to_json_fragment() for event in client.event_queue.resolved_events()]
+        self.assertEqual(m.call_count, 3)
+
+        self.assertEqual(
+            orjson.loads(orjson.dumps(fragments)),
+            client.event_queue.contents(),
+        )
+        self.assertEqual(
+            orjson.loads(orjson.dumps(fragments)),
+            [
+                dict(id=0, type="arbitrary", x="foo"),
+                dict(id=1, type="message", message=message_dict, flags=[]),
+                dict(
+                    id=2,
+                    type="update_message_flags",
+                    operation="add",
+                    flag="read",
+                    all=False,
+                    messages=[4],
+                ),
+            ],
+        )
+
     def test_event_collapsing(self) -> None:
         client = self.get_client_descriptor()
         queue = client.event_queue
@@ -1485,7 +1824,10 @@ class EventQueueTest(ZulipTestCase):
         self.verify_to_dict_end_to_end(client)
 
         queue.push({"type": "unknown", "timestamp": "1"})
-        self.assertEqual(list(queue.queue), [{"id": 1, "type": "unknown", "timestamp": "1"}])
+        self.assertEqual(
+            [event.to_dict() for event in queue.queue],
+            [{"id": 1, "type": "unknown", "timestamp": "1"}],
+        )
         self.assertEqual(queue.virtual_events, {"flags/add/read": event})
         # And we can still reconstruct newest_pruned_id etc. correctly
         self.verify_to_dict_end_to_end(client)
@@ -1506,6 +1848,152 @@ class EventQueueTest(ZulipTestCase):
         queue.prune(1)
         self.verify_to_dict_end_to_end(client)
 
+    def test_collapse_read_and_unread_events(self) -> None:
+        def flags_event(operation: str, messages: list[int]) -> dict[str, Any]:
+            event: dict[str, Any] = dict(
+                type="update_message_flags",
+                op=operation,
+                operation=operation,
+                flag="read",
+                messages=messages,
+                all=False,
+            )
+            if operation == "remove":
+                event["message_details"] = {
+                    str(message_id): {"type": "stream", "stream_id": 1, "topic": "lunch"}
+                    for message_id in messages
+                }
+            return event
+
+        client = self.get_client_descriptor()
+        queue = client.event_queue
+        queue.push(flags_event("add", [1, 2, 3]))
+        queue.push(flags_event("remove", [2, 3]))
+        queue.push({"type": "unknown"})
+        queue.push(flags_event("add", [3, 4]))
+        queue.push(flags_event("add", [4, 5]))
+        self.verify_to_dict_end_to_end(client)
+
+        # Each message ends up only in the event for the last
+        # operation on it, so the client ends up in the right state.
+        self.assertEqual(
+            queue.contents(),
+            [
+                {"id": 1, **flags_event("remove", [2])},
+                {"id": 2, "type": "unknown"},
+                {"id": 4, **flags_event("add", [1, 3, 4, 5])},
+            ],
+        )
+
+        # Once the last message is marked as read again, the unread
+        # event disappears.
+        queue.push(flags_event("remove", [6]))
+        queue.push(flags_event("add", [6]))
+        self.assertEqual(list(queue.virtual_events), ["flags/add/read"])
+
+    def test_coalesce_presence_and_typing_events(self) -> None:
+        def presence_event(user_id: int, status: str) -> dict[str, Any]:
+            return dict(
+                type="presence",
+                user_id=user_id,
+                server_timestamp=1,
+                presence={"website": {"status": status}},
+            )
+
+        def typing_event(op: str, topic: str) -> dict[str, Any]:
+            return dict(
+                type="typing",
+                message_type="stream",
+                op=op,
+                sender={"user_id": 10, "email": "user10@zulip.testserver"},
+                stream_id=1,
+                topic=topic,
+            )
+
+        client = self.get_client_descriptor()
+        queue = client.event_queue
+        queue.push(presence_event(10, "active"))
+        queue.push(typing_event("start", "lunch"))
+        queue.push(typing_event("start", "dinner"))
+        queue.push({"type": "unknown"})
+        queue.push(presence_event(11, "active"))
+        queue.push(presence_event(10, "idle"))
+        queue.push(typing_event("stop", "lunch"))
+        self.verify_to_dict_end_to_end(client)
+
+        # Only the latest event for each user and conversation is
+        # kept, in the position of that latest event.
+        self.assertEqual(
+            queue.contents(),
+            [
+                {"id": 2, **typing_event("start", "dinner")},
+                {"id": 3, "type": "unknown"},
+                {"id": 4, **presence_event(11, "active")},
+                {"id": 5, **presence_event(10, "idle")},
+                {"id": 6, **typing_event("stop", "lunch")},
+            ],
+        )
+
+
+class BatchedNotificationsTest(ZulipTestCase):
+    def test_handler_finished_once_per_batch(self) -> None:
+        hamlet = self.example_user("hamlet")
+        queue_data = dict(
+            all_public_streams=False,
+            apply_markdown=True,
+            client_gravatar=True,
+            client_type_name="website",
+            event_types=None,
+            last_connection_time=time.time(),
+            queue_timeout=600,
+            realm_id=hamlet.realm_id,
+            user_profile_id=hamlet.id,
+        )
+        client = allocate_client_descriptor(queue_data)
+        handler_id = 1234
+        client.current_handler_id = handler_id
+        set_descriptor_by_handler_id(handler_id, client)
+
+        notices = [dict(event=dict(type="test", data=i), users=[hamlet.id]) for i in range(3)] + [
+            dict(event=dict(type="test", data=3), users=[self.example_user("othello").id])
+        ]
+        with mock.patch("zerver.tornado.event_queue.finish_handler") as finish_handler:
+            get_wrapped_process_notification("notify_tornado")(notices)
+
+        finish_handler.assert_called_once()
+        (called_handler_id, queue_id, contents, event_types) = finish_handler.call_args.args
+        self.assertEqual(called_handler_id, handler_id)
+        self.assertEqual(queue_id, client.event_queue.id)
+        self.assertEqual(event_types, ["test", "test", "test"])
+        self.assertEqual(
+            orjson.loads(orjson.dumps(contents)),
+            [dict(type="test", data=i, id=i) for i in range(3)],
+        )
+        self.assertIsNone(client.current_handler_id)
+
+    def test_batched_notices_retried_individually(self) -> None:
+        notices: list[dict[str, Any]] = [
+            dict(event=dict(type="test", data=i), users=[]) for i in range(3)
+        ]
+        processed: list[Mapping[str, Any]] = []
+
+        def process_notification(notice: Mapping[str, Any]) -> None:
+            if notice["event"]["data"] == 1:
+                raise AssertionError("failed")
+            processed.append(notice)
+
+        with (
+            mock.patch("zerver.tornado.event_queue.process_notification", process_notification),
+            mock.patch("zerver.tornado.event_queue.retry_event") as retry_event,
+        ):
+            get_wrapped_process_notification("notify_tornado")(
+                [dict(notices=notices[:2]), notices[2]]
+            )
+
+        self.assertEqual(processed, [notices[0], notices[2]])
+        retry_event.assert_called_once()
+        self.assertEqual(retry_event.call_args.args[:2], ("notify_tornado", notices[1]))
+
 
 class SchemaMigrationsTests(ZulipTestCase):
     def test_reformat_legacy_send_message_event(self) -> None:
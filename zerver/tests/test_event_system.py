@@ -1167,7 +1167,7 @@ class ReloadWebClientsTest(ZulipTestCase):
         mark_clients_to_reload([client.event_queue.id])
         send_web_reload_client_events()
         self.assert_length(client.event_queue.queue, 1)
-        reload_event = client.event_queue.queue[0]
+        reload_event = client.event_queue.queue[0].to_dict()
 
         check_web_reload_client_event("web_reload_client_event", reload_event)
         self.assertEqual(
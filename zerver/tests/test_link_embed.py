@@ -22,6 +22,7 @@ from zerver.lib.url_preview.parsers import GenericParser, OpenGraphParser
 from zerver.lib.url_preview.preview import get_link_embed_data
 from zerver.lib.url_preview.types import UrlEmbedData, UrlOEmbedData
 from zerver.models import Message, Realm, UserProfile
+from zerver.worker.deferred_message_work import DeferredMessageWorker
 from zerver.worker.embed_links import FetchLinksEmbedData
 
 
@@ -374,6 +375,30 @@ class PreviewTestCase(ZulipTestCase):
         assert msg.rendered_content is not None
         self.assertIn(embedded_link, msg.rendered_content)
 
+    @override_settings(INLINE_URL_EMBED_PREVIEW=True, DEFER_MESSAGE_SEND_WORK=True)
+    def test_deferred_embed_links(self) -> None:
+        url = "http://test.org/"
+        with mock_queue_publish("zerver.actions.message_send.queue_event_on_commit") as patched:
+            msg_id = self.send_personal_message(
+                self.example_user("hamlet"),
+                self.example_user("cordelia"),
+                content=url,
+            )
+        # The links are only queued by the deferred_message_work worker.
+        patched.assert_called_once()
+        queue, event, _ = patched.call_args.args
+        self.assertEqual(queue, "deferred_message_work")
+
+        with mock_queue_publish(
+            "zerver.worker.deferred_message_work.queue_json_publish"
+        ) as patched:
+            DeferredMessageWorker().consume(event)
+        patched.assert_called_once()
+        queue, embed_event, _ = patched.call_args.args
+        self.assertEqual(queue, "embed_links")
+        self.assertEqual(embed_event["message_id"], msg_id)
+        self.assertEqual(embed_event["urls"], [url])
+
     @responses.activate
     @override_settings(INLINE_URL_EMBED_PREVIEW=True)
     def _send_message_with_test_org_url(
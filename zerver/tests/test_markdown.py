@@ -40,13 +40,20 @@ from zerver.lib.markdown import (
     image_preview_enabled,
     markdown_convert,
     maybe_update_markdown_engines,
+    md_engines,
     possible_linked_stream_names,
     render_message_markdown,
+    required_linkifier_literal,
     topic_links,
     url_embed_preview_enabled,
     url_to_a,
 )
 from zerver.lib.markdown.fenced_code import FencedBlockPreprocessor
+from zerver.lib.markdown.render_pool import (
+    collect_batch,
+    prewarm_markdown_engines,
+    render_messages_in_parallel,
+)
 from zerver.lib.mdiff import diff_strings
 from zerver.lib.mention import (
     FullNameInfo,
@@ -62,6 +69,7 @@ from zerver.lib.mention import (
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.tex import render_tex
+from zerver.lib.timeout import unsafe_timeout
 from zerver.models import Message, NamedUserGroup, RealmEmoji, RealmFilter, UserMessage, UserProfile
 from zerver.models.clients import get_client
 from zerver.models.groups import SystemGroups
@@ -1718,6 +1726,47 @@ class MarkdownLinkifierTest(ZulipTestCase):
         converted_boring_topic = topic_links(realm.id, boring_msg.topic_name())
         self.assertEqual(converted_boring_topic, [])
 
+    def test_required_linkifier_literal(self) -> None:
+        for pattern, literal in [
+            (r"#(?P<id>[0-9]{2,8})", "#"),
+            (r"JIRA-(?P<id>\d+)", "JIRA-"),
+            (r"(?P<org>[a-z]+)/(?P<repo>[a-z]+)#(?P<id>[0-9]+)", "/"),
+            (r"RT\.(?P<id>\d+)", "RT."),
+            (r"zulip-?(?P<id>\d+)", "zulip"),
+            (r"ab{0,3}cd", "cd"),
+            (r"x{2}yz", "yz"),
+            (r"[]a]bc", "bc"),
+            (r"\p{Greek}+ticket", "ticket"),
+            (r"issue\s+#(?P<id>\d+)", "issue"),
+            (r"(?i)ticket(?P<id>\d+)", ""),
+            (r"(?P<id>\d+)|bug(?P<bug>\d+)", ""),
+        ]:
+            self.assertEqual(required_linkifier_literal(pattern), literal, pattern)
+
+    def test_linkifiers_single_scan(self) -> None:
+        realm = get_realm("zulip")
+        RealmFilter.objects.filter(realm=realm).delete()
+        for order, pattern, url_template in [
+            (1, r"ZUL-(?P<id>\d+)", "https://a.example.com/{id}"),
+            (2, r"(?P<project>[A-Z]+)-(?P<id>\d+)", "https://b.example.com/{project}/{id}"),
+            (3, r"(?P<id>[0-9]{5})", "https://c.example.com/{id}"),
+        ]:
+            RealmFilter(realm=realm, pattern=pattern, url_template=url_template, order=order).save()
+        flush_per_request_caches()
+
+        # ZUL-12 matches the first two linkifiers; the first one wins.
+        # The third linkifier has no required literal, so is always tried.
+        converted = markdown_convert("ZUL-12 and ABC-34 and 12345 here", message_realm=realm)
+        self.assertEqual(
+            converted.rendered_content,
+            '<p><a href="https://a.example.com/12">ZUL-12</a> and '
+            '<a href="https://b.example.com/ABC/34">ABC-34</a> and '
+            '<a href="https://c.example.com/12345">12345</a> here</p>',
+        )
+
+        converted = markdown_convert("nothing to see", message_realm=realm)
+        self.assertEqual(converted.rendered_content, "<p>nothing to see</p>")
+
     def test_is_status_message(self) -> None:
         user_profile = self.example_user("othello")
         msg = Message(
@@ -3358,3 +3407,129 @@ class MarkdownErrorTests(ZulipTestCase):
 
         result = processor.run(markdown_input)
         self.assertEqual(result, expected)
+
+
+class MarkdownRenderPoolTest(ZulipTestCase):
+    def test_render_messages_in_process(self) -> None:
+        hamlet = self.example_user("hamlet")
+        message_ids = [
+            self.send_stream_message(hamlet, "Denmark", content=f"message **{i}**")
+            for i in range(3)
+        ]
+        rendered = list(
+            render_messages_in_parallel(
+                [(message_id, "*original*") for message_id in message_ids],
+                processes=1,
+                realm_ids=[hamlet.realm_id],
+                batch_size=2,
+            )
+        )
+        self.assertEqual(
+            rendered, [(message_id, "<p><em>original</em></p>") for message_id in message_ids]
+        )
+
+    def test_prewarm_markdown_engines(self) -> None:
+        realm = get_realm("zulip")
+        with mock.patch.dict(md_engines, clear=True):
+            prewarm_markdown_engines([realm.id])
+            self.assertEqual(list(md_engines), [(realm.id, False)])
+
+    def test_failed_batch_rendered_in_process(self) -> None:
+        hamlet = self.example_user("hamlet")
+        message_id = self.send_stream_message(hamlet, "Denmark", content="test")
+        result = mock.Mock()
+        result.get.side_effect = TimeoutError
+        with self.assertLogs("zerver.lib.markdown.render_pool", level="WARNING") as m:
+            rendered = list(collect_batch([(message_id, "**bold**")], result, timeout=1))
+        self.assertEqual(rendered, [(message_id, "<p><strong>bold</strong></p>")])
+        result.get.assert_called_once_with(1)
+        self.assertIn("in a worker failed; rendering them in-process", m.output[0])
+
+
+@override_settings(MARKDOWN_RENDER_CACHE=True)
+class MarkdownRenderCacheTest(ZulipTestCase):
+    def render(self, content: str) -> tuple[MessageRenderingResult, Message]:
+        othello = self.example_user("othello")
+        msg = Message(sender=othello, sending_client=get_client("test"), realm=othello.realm)
+        return (
+            render_message_markdown(
+                msg,
+                content,
+                realm_alert_words_automaton=get_alert_word_automaton(othello.realm),
+            ),
+            msg,
+        )
+
+    def test_render_cache(self) -> None:
+        content = "See https://zulip.com/ and **this**"
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            first, first_msg = self.render(content)
+            second, second_msg = self.render(content)
+        m.assert_called_once()
+        self.assertEqual(first, second)
+        self.assertTrue(first_msg.has_link)
+        self.assertTrue(second_msg.has_link)
+
+        # Changing the realm's linkifiers changes the key.
+        RealmFilter.objects.create(
+            realm=get_realm("zulip"), pattern=r"this", url_template="https://example.com/this"
+        )
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            third, third_msg = self.render(content)
+        m.assert_called_once()
+        self.assertIn("https://example.com/this", third.rendered_content)
+
+    def test_render_cache_skips_mentions(self) -> None:
+        content = "Hello @**King Hamlet**"
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            self.render(content)
+            rendering_result, msg = self.render(content)
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(rendering_result.mentions_user_ids, {self.example_user("hamlet").id})
+
+    def test_render_cache_skips_channel_links(self) -> None:
+        # Links to channels which don't exist yet aren't cached either,
+        # since they render as plain text until the channel is created.
+        content = "See #**new channel**"
+        first, first_msg = self.render(content)
+        self.assertNotIn('class="stream"', first.rendered_content)
+
+        self.make_stream("new channel", get_realm("zulip"))
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            second, second_msg = self.render(content)
+        m.assert_called_once()
+        self.assertIn('class="stream"', second.rendered_content)
+
+    def test_render_cache_alert_words(self) -> None:
+        othello = self.example_user("othello")
+        content = "We have an ALERTWORD day today!"
+        first, first_msg = self.render(content)
+        self.assertEqual(first.user_ids_with_alert_words, set())
+
+        do_add_alert_words(othello, ["alertword"])
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            second, second_msg = self.render(content)
+        m.assert_not_called()
+        self.assertEqual(second.rendered_content, first.rendered_content)
+        self.assertEqual(second.user_ids_with_alert_words, {othello.id})
+
+        # Alert words in code blocks don't count, whether or not the
+        # rendering was cached.
+        content = "```\nalertword\n```"
+        first, first_msg = self.render(content)
+        second, second_msg = self.render(content)
+        self.assertEqual(first.user_ids_with_alert_words, set())
+        self.assertEqual(second.user_ids_with_alert_words, set())
+
+    def test_render_cache_default_code_block_language(self) -> None:
+        content = "```\nprint('Hello World')\n```"
+        first, first_msg = self.render(content)
+        self.assertNotIn("data-code-language", first.rendered_content)
+
+        do_set_realm_property(
+            get_realm("zulip"), "default_code_block_language", "python", acting_user=None
+        )
+        with mock.patch("zerver.lib.markdown.unsafe_timeout", wraps=unsafe_timeout) as m:
+            second, second_msg = self.render(content)
+        m.assert_called_once()
+        self.assertIn('data-code-language="Python"', second.rendered_content)
@@ -1,16 +1,26 @@
+import zlib
 from typing import Any
 from unittest import mock
 
+import orjson
 from django.utils.timezone import now as timezone_now
 
-from zerver.lib.cache import cache_delete, to_dict_cache_key_id
+from zerver.lib.cache import cache_delete, message_dict_generation_key, to_dict_cache_key_id
 from zerver.lib.display_recipient import get_display_recipient
 from zerver.lib.markdown import version as markdown_version
 from zerver.lib.message import messages_for_ids
-from zerver.lib.message_cache import MessageDict, sew_messages_and_reactions
+from zerver.lib.message_cache import (
+    MessageDict,
+    MessageDictLocalCache,
+    extract_message_dict,
+    message_dict_local_cache,
+    sew_messages_and_reactions,
+    stringify_message_dict,
+)
+from zerver.lib.message_cache_codec import CODECS
 from zerver.lib.per_request_cache import flush_per_request_caches
 from zerver.lib.test_classes import ZulipTestCase
-from zerver.lib.test_helpers import make_client
+from zerver.lib.test_helpers import cache_tries_captured, make_client
 from zerver.lib.topic import TOPIC_LINKS
 from zerver.lib.types import DisplayRecipientT, UserDisplayRecipient
 from zerver.models import Message, Reaction, Realm, RealmFilter, Recipient, Stream, UserProfile
@@ -471,6 +481,90 @@ class MessageHydrationTest(ZulipTestCase):
             inaccessible_sender_msg["avatar_url"].endswith("images/unknown-user-avatar.png")
         )
 
+    def test_message_dict_local_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        self.login_user(hamlet)
+        message_id = self.send_stream_message(hamlet, "Denmark", content="before edit")
+        message_dict_local_cache.clear()
+
+        def fetch_content() -> str:
+            (message,) = messages_for_ids(
+                message_ids=[message_id],
+                user_message_flags={message_id: []},
+                search_fields={},
+                apply_markdown=True,
+                client_gravatar=True,
+                allow_edit_history=False,
+                user_profile=hamlet,
+                realm=hamlet.realm,
+            )
+            return message["content"]
+
+        self.assertEqual(fetch_content(), "<p>before edit</p>")
+        self.assertIn(message_id, message_dict_local_cache.entries)
+
+        # The second fetch only needs the generation from memcached.
+        with cache_tries_captured() as cache_tries:
+            self.assertEqual(fetch_content(), "<p>before edit</p>")
+        fetched_keys = [keys for method, keys, cache_name in cache_tries if method == "getmany"]
+        self.assertIn([message_dict_generation_key(message_id)], fetched_keys)
+        self.assertFalse(any(to_dict_cache_key_id(message_id) in keys for keys in fetched_keys))
+
+        # Editing the message replaces its generation, so the copy in
+        # memory (as another process would have) is no longer used.
+        result = self.client_patch(f"/json/messages/{message_id}", {"content": "after edit"})
+        self.assert_json_success(result)
+        self.assertEqual(fetch_content(), "<p>after edit</p>")
+
+        with self.settings(MESSAGE_DICT_LOCAL_CACHE_BYTES=0):
+            message_dict_local_cache.clear()
+            self.assertEqual(fetch_content(), "<p>after edit</p>")
+            self.assertEqual(message_dict_local_cache.entries, {})
+
+    def test_message_dict_codecs(self) -> None:
+        hamlet = self.example_user("hamlet")
+        message_id = self.send_stream_message(hamlet, "Denmark", content="hello @**King Hamlet**")
+        message = Message.objects.get(id=message_id)
+        (message_dict,) = MessageDict.messages_to_encoded_cache_helper([message])
+
+        blobs = {}
+        for codec in CODECS:
+            with self.settings(MESSAGE_DICT_CACHE_CODEC=codec.name):
+                blobs[codec.name] = stringify_message_dict(message_dict)
+            self.assertTrue(blobs[codec.name].startswith(codec.tag))
+        # Entries written with any codec can be read, whichever we're
+        # writing with.
+        for blob in blobs.values():
+            self.assertEqual(extract_message_dict(blob), message_dict)
+        self.assertEqual(blobs["zlib"], zlib.compress(orjson.dumps(message_dict)))
+        self.assertLess(len(blobs["zlib_dictionary_v1"]), len(blobs["zlib"]) * 0.75)
+
+        with self.assertRaises(KeyError):
+            extract_message_dict(b"\xff" + blobs["zlib_dictionary_v1"][1:])
+
+    def test_message_dict_local_cache_size(self) -> None:
+        local_cache = MessageDictLocalCache()
+        message_dict = {"id": 1, "content": "x" * 100}
+        size = len(orjson.dumps(message_dict))
+
+        with self.settings(MESSAGE_DICT_LOCAL_CACHE_BYTES=2 * size):
+            local_cache.set(1, "a", message_dict)
+            local_cache.set(2, "a", message_dict)
+            self.assertEqual(local_cache.total_bytes, 2 * size)
+            # Using message 1 makes message 2 the least recently used.
+            self.assertEqual(local_cache.get(1, "a"), message_dict)
+            local_cache.set(3, "a", message_dict)
+            self.assertEqual(list(local_cache.entries), [1, 3])
+            self.assertEqual(local_cache.total_bytes, 2 * size)
+
+            # Entries from an older generation are dropped.
+            self.assertIsNone(local_cache.get(1, "b"))
+            self.assertEqual(list(local_cache.entries), [3])
+
+            local_cache.set(4, "a", {"id": 4, "content": "x" * 1000})
+            self.assertEqual(list(local_cache.entries), [3])
+            self.assertEqual(local_cache.total_bytes, size)
+
     def test_display_recipient_up_to_date(self) -> None:
         """
         This is a test for a bug where due to caching of message_dicts,
@@ -975,6 +975,31 @@ class NarrowLibraryTest(ZulipTestCase):
             )
         )
 
+    def test_build_narrow_predicate_shared(self) -> None:
+        narrow_predicate = build_narrow_predicate(
+            [
+                NarrowTerm(operator="channel", operand="devel"),
+                NarrowTerm(operator="topic", operand="python"),
+            ]
+        )
+        # Identical narrows share a single compiled predicate.
+        self.assertIs(
+            narrow_predicate,
+            build_narrow_predicate(
+                [
+                    NarrowTerm(operator="channel", operand="devel"),
+                    NarrowTerm(operator="topic", operand="python"),
+                ]
+            ),
+        )
+        self.assertIsNot(
+            narrow_predicate,
+            build_narrow_predicate([NarrowTerm(operator="channel", operand="devel")]),
+        )
+
+        narrow_predicate = build_narrow_predicate([])
+        self.assertTrue(narrow_predicate(message={"type": "private"}, flags=[]))
+
     def test_build_narrow_predicate_invalid(self) -> None:
         with self.assertRaises(JsonableError):
             build_narrow_predicate([NarrowTerm(operator="invalid_operator", operand="operand")])
@@ -4266,28 +4291,83 @@ class GetOldMessagesTest(ZulipTestCase):
         request = HostRequestMock(query_params, user_profile)
 
         with queries_captured() as all_queries:
-            get_messages_backend(
+            payload = get_messages_backend(
                 request,
                 user_profile,
                 num_before=10,
                 num_after=10,
             )
 
-        # Verify the query for old messages looks correct.
-        queries = [q for q in all_queries if "/* get_messages */" in q.sql]
+        # Verify the query for old messages looks correct; the first
+        # unread message is found in the same query.
+        queries = [q for q in all_queries if "first_unread" in q.sql]
         self.assert_length(queries, 1)
         sql = queries[0].sql
+        self.assertIn("/* get_messages */", sql)
+        self.assertIn("WITH first_unread AS", sql)
         self.assertNotIn(f"AND message_id = {LARGER_THAN_MAX_MESSAGE_ID}", sql)
         self.assertIn("ORDER BY message_id ASC", sql)
 
-        cond = (
-            f"WHERE user_profile_id = {user_profile.id} AND message_id >= {first_unread_message_id}"
-        )
+        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id >= (SELECT first_unread.anchor"
         self.assertIn(cond, sql)
-        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id <= {first_unread_message_id - 1}"
+        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id <= (SELECT first_unread.anchor"
         self.assertIn(cond, sql)
         self.assertIn("UNION", sql)
 
+        result = orjson.loads(payload.content)
+        self.assertEqual(result["anchor"], first_unread_message_id)
+        self.assertEqual(result["found_anchor"], True)
+        expected_ids = list(
+            UserMessage.objects.filter(user_profile=user_profile)
+            .order_by("message_id")
+            .values_list("message_id", flat=True)
+        )
+        index = expected_ids.index(first_unread_message_id)
+        self.assertEqual(
+            [message["id"] for message in result["messages"]],
+            expected_ids[max(index - 10, 0) : index + 11],
+        )
+
+    def test_get_messages_with_prepared_statements(self) -> None:
+        self.login("hamlet")
+        self.send_stream_message(self.example_user("othello"), "Verona", "unread")
+        params: dict[str, str | int] = dict(
+            anchor="first_unread",
+            num_before=10,
+            num_after=10,
+            narrow=orjson.dumps([dict(operator="channel", operand="Verona")]).decode(),
+        )
+        expected = self.get_and_check_messages(params)
+
+        with self.settings(PREPARE_MESSAGE_FETCH_QUERIES=True):
+            # The statements may already have been prepared on this
+            # database connection, by an earlier test.
+            self.assertEqual(self.get_and_check_messages(params), expected)
+            with queries_captured() as queries:
+                self.assertEqual(self.get_and_check_messages(params), expected)
+
+        # The first unread message, and the messages around it, are
+        # fetched with a single prepared statement.
+        self.assertFalse(any(query.sql.startswith("PREPARE") for query in queries))
+        executed = [query.sql for query in queries if query.sql.startswith("EXECUTE zulip_")]
+        self.assert_length(executed, 1)
+
+    def test_get_messages_with_prepared_statements_large_anchor(self) -> None:
+        self.login("hamlet")
+        params: dict[str, str | int] = dict(
+            anchor=5000000000,
+            num_before=10,
+            num_after=10,
+            narrow=orjson.dumps([dict(operator="channel", operand="Verona")]).decode(),
+        )
+        expected = self.get_and_check_messages(params)
+        self.assertNotEqual(expected["messages"], [])
+
+        # The anchor is larger than fits in the message ID column, and
+        # must still be a valid parameter of the prepared statement.
+        with self.settings(PREPARE_MESSAGE_FETCH_QUERIES=True):
+            self.assertEqual(self.get_and_check_messages(params), expected)
+
     def test_visible_messages_use_first_unread_anchor_with_some_unread_messages(self) -> None:
         user_profile = self.example_user("hamlet")
 
@@ -4317,7 +4397,7 @@ class GetOldMessagesTest(ZulipTestCase):
 
         first_visible_message_id = first_unread_message_id + 2
         with first_visible_id_as(first_visible_message_id), queries_captured() as all_queries:
-            get_messages_backend(
+            payload = get_messages_backend(
                 request,
                 user_profile,
                 num_before=10,
@@ -4329,11 +4409,16 @@ class GetOldMessagesTest(ZulipTestCase):
         sql = queries[0].sql
         self.assertNotIn(f"AND message_id = {LARGER_THAN_MAX_MESSAGE_ID}", sql)
         self.assertIn("ORDER BY message_id ASC", sql)
-        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id <= {first_unread_message_id - 1}"
+        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id <= (SELECT first_unread.anchor"
         self.assertIn(cond, sql)
-        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id >= {first_visible_message_id}"
+        cond = f"WHERE user_profile_id = {user_profile.id} AND message_id >= greatest((SELECT first_unread.anchor"
         self.assertIn(cond, sql)
 
+        result = orjson.loads(payload.content)
+        self.assertEqual(result["anchor"], first_unread_message_id)
+        self.assertEqual(result["history_limited"], True)
+        self.assertEqual(result["messages"][0]["id"], first_visible_message_id)
+
     def test_use_first_unread_anchor_with_no_unread_messages(self) -> None:
         user_profile = self.example_user("hamlet")
 
@@ -4346,42 +4431,52 @@ class GetOldMessagesTest(ZulipTestCase):
         request = HostRequestMock(query_params, user_profile)
 
         with queries_captured() as all_queries:
-            get_messages_backend(
+            payload = get_messages_backend(
                 request,
                 user_profile,
                 num_before=10,
                 num_after=10,
             )
 
-        queries = [q for q in all_queries if "/* get_messages */" in q.sql]
+        queries = [q for q in all_queries if "first_unread" in q.sql]
         self.assert_length(queries, 1)
+        self.assertIn("/* get_messages */", queries[0].sql)
 
-        sql = queries[0].sql
-
-        self.assertNotIn("AND message_id <=", sql)
-        self.assertNotIn("AND message_id >=", sql)
+        # With no unread messages, we get the newest messages.
+        latest_ids = list(
+            UserMessage.objects.filter(user_profile=user_profile)
+            .order_by("-message_id")
+            .values_list("message_id", flat=True)[:10]
+        )
+        result = orjson.loads(payload.content)
+        self.assertEqual(result["anchor"], LARGER_THAN_MAX_MESSAGE_ID)
+        self.assertEqual(result["found_anchor"], False)
+        self.assertEqual(result["found_newest"], True)
+        self.assertEqual([message["id"] for message in result["messages"]], latest_ids[::-1])
 
         request = HostRequestMock(query_params, user_profile)
         first_visible_message_id = 5
         with first_visible_id_as(first_visible_message_id):
-            with queries_captured() as all_queries:
-                get_messages_backend(
-                    request,
-                    user_profile,
-                    num_before=10,
-                    num_after=10,
-                )
-            queries = [q for q in all_queries if "/* get_messages */" in q.sql]
-            sql = queries[0].sql
-            self.assertNotIn("AND message_id <=", sql)
-            self.assertNotIn("AND message_id >=", sql)
+            payload = get_messages_backend(
+                request,
+                user_profile,
+                num_before=10,
+                num_after=10,
+            )
+        result = orjson.loads(payload.content)
+        self.assertEqual(result["anchor"], LARGER_THAN_MAX_MESSAGE_ID)
+        self.assertEqual(result["found_newest"], True)
+        self.assertEqual(
+            [message["id"] for message in result["messages"]],
+            [message_id for message_id in latest_ids[::-1] if message_id >= 5],
+        )
 
     def test_use_first_unread_anchor_with_muted_topics(self) -> None:
         """
         Test that our logic related to `use_first_unread_anchor`
-        invokes the `message_id = LARGER_THAN_MAX_MESSAGE_ID` hack for
-        the `/* get_messages */` query when relevant muting
-        is in effect.
+        excludes muted topics when finding the anchor, and invokes the
+        `message_id = anchor` hack for the `/* get_messages */` query
+        when relevant muting is in effect.
 
         This is a very arcane test on arcane, but very heavily
         field-tested, logic in get_messages_backend().  If
@@ -4409,7 +4504,7 @@ class GetOldMessagesTest(ZulipTestCase):
         request = HostRequestMock(query_params, user_profile)
 
         with queries_captured() as all_queries:
-            get_messages_backend(
+            payload = get_messages_backend(
                 request,
                 user_profile,
                 num_before=0,
@@ -4417,9 +4512,10 @@ class GetOldMessagesTest(ZulipTestCase):
             )
 
         # Do some tests on the main query, to verify the muting logic
-        # runs on this code path.
-        queries = [q for q in all_queries if q.sql.startswith("SELECT message_id, flags")]
+        # runs on this code path; the anchor is found in the same query.
+        queries = [q for q in all_queries if "/* get_messages */" in q.sql]
         self.assert_length(queries, 1)
+        self.assertIn("WITH first_unread AS", queries[0].sql)
 
         channel = get_stream("Scotland", realm)
         assert channel.recipient is not None
@@ -4428,10 +4524,12 @@ class GetOldMessagesTest(ZulipTestCase):
         self.assertIn(cond, queries[0].sql)
 
         # Next, verify the use_first_unread_anchor setting invokes
-        # the `message_id = LARGER_THAN_MAX_MESSAGE_ID` hack.
-        queries = [q for q in all_queries if "/* get_messages */" in q.sql]
-        self.assert_length(queries, 1)
-        self.assertIn(f"AND zerver_message.id = {LARGER_THAN_MAX_MESSAGE_ID}", queries[0].sql)
+        # the `message_id = anchor` hack, which, with no unread
+        # messages, finds nothing.
+        self.assertIn("AND zerver_message.id = (SELECT first_unread.anchor", queries[0].sql)
+        result = orjson.loads(payload.content)
+        self.assertEqual(result["anchor"], LARGER_THAN_MAX_MESSAGE_ID)
+        self.assertEqual(result["messages"], [])
 
     def test_exclude_muting_conditions(self) -> None:
         realm = get_realm("zulip")
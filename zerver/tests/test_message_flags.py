@@ -1229,8 +1229,27 @@ class GetUnreadMsgsTest(ZulipTestCase):
 
         with mock.patch("zerver.lib.message.MAX_UNREAD_MESSAGES", 5):
             result = get_unread_data()
-            self.assertEqual(result["count"], 3)
+            # The two oldest unread messages, the direct messages, are
+            # missing, but still counted.
+            self.assertEqual(result["count"], 5)
             self.assertTrue(result["old_unreads_missing"])
+            self.assertEqual(result["pms"], [])
+
+        with mock.patch("zerver.lib.message.MAX_UNREAD_MESSAGES", 2):
+            result = get_unread_data()
+            # The older unread messages include ones in a muted topic
+            # and in a muted channel, which aren't counted.
+            self.assertEqual(result["count"], 5)
+            self.assertTrue(result["old_unreads_missing"])
+            self.assertEqual(
+                [stream["unread_message_ids"] for stream in result["streams"]],
+                [[unmuted_topic_muted_stream_message_id]],
+            )
+
+        with mock.patch("zerver.lib.message.MAX_UNREAD_MESSAGES", 7):
+            result = get_unread_data()
+            self.assertEqual(result["count"], 5)
+            self.assertFalse(result["old_unreads_missing"])
 
         result = get_unread_data()
 
@@ -1942,6 +1961,7 @@ class MarkUnreadTest(ZulipTestCase):
             muted_stream_ids=set(),
             unmuted_stream_msgs=set(),
             old_unreads_missing=False,
+            old_unreads_count=0,
         )
 
         message_details = format_unread_message_details(user.id, raw_unread_data)
@@ -1964,6 +1984,7 @@ class MarkUnreadTest(ZulipTestCase):
             muted_stream_ids=set(),
             unmuted_stream_msgs=set(),
             old_unreads_missing=False,
+            old_unreads_count=0,
         )
 
         # message to self
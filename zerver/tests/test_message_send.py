@@ -1644,12 +1644,13 @@ class StreamMessagesTest(ZulipTestCase):
             setting_value=UserProfile.AUTOMATICALLY_CHANGE_VISIBILITY_POLICY_ON_INITIATION,
             acting_user=None,
         )
+        # From here on, the stream's delivery profile is cached.
         # There will be an increase in the query count of 5 while sending
         # the first message to a topic.
         # 5 queries: 1 to check if it is the first message in the topic +
         # 1 to check if the topic is already followed + 3 to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(18):
+        with self.assert_database_query_count(17):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1669,7 +1670,7 @@ class StreamMessagesTest(ZulipTestCase):
         # a message to a topic with visibility policy other than FOLLOWED.
         # 1 to check if the topic is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(17):
+        with self.assert_database_query_count(16):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1680,7 +1681,7 @@ class StreamMessagesTest(ZulipTestCase):
         # If the topic is already FOLLOWED, there will be an increase in the query
         # count of 1 to check if the topic is already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(14):
+        with self.assert_database_query_count(13):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1705,7 +1706,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic
         # is already followed + 3 queries to follow the topic.
         flush_per_request_caches()
-        with self.assert_database_query_count(22):
+        with self.assert_database_query_count(21):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1718,7 +1719,7 @@ class StreamMessagesTest(ZulipTestCase):
         # 1 to get the user_id of the mentioned user + 1 to check if the topic is
         # already followed.
         flush_per_request_caches()
-        with self.assert_database_query_count(19):
+        with self.assert_database_query_count(18):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -1728,7 +1729,7 @@ class StreamMessagesTest(ZulipTestCase):
             )
 
         flush_per_request_caches()
-        with self.assert_database_query_count(16):
+        with self.assert_database_query_count(15):
             check_send_stream_message(
                 sender=sender,
                 client=sending_client,
@@ -2346,6 +2347,110 @@ class StreamMessagesTest(ZulipTestCase):
         """
         self.assert_stream_message("Scotland")
 
+    def test_message_to_stream_unnest_insert(self) -> None:
+        """
+        Large channels have their UserMessage rows inserted from arrays.
+        """
+        with mock.patch("zerver.lib.user_message.BULK_INSERT_UMS_UNNEST_THRESHOLD", 0):
+            self.assert_stream_message("Scotland")
+
+        # Each row gets its own flags.
+        sender = self.example_user("hamlet")
+        with mock.patch("zerver.lib.user_message.BULK_INSERT_UMS_UNNEST_THRESHOLD", 0):
+            message_id = self.send_stream_message(
+                sender, "Denmark", content="@**Othello, the Moor of Venice**"
+            )
+        self.assertEqual(
+            UserMessage.objects.get(user_profile=sender, message_id=message_id).flags_list(),
+            ["read"],
+        )
+        self.assertEqual(
+            UserMessage.objects.get(
+                user_profile=self.example_user("othello"), message_id=message_id
+            ).flags_list(),
+            ["mentioned"],
+        )
+
+    def test_send_messages_batches_tornado_notices(self) -> None:
+        """
+        A batch of messages is delivered to each Tornado port with a
+        single notice.
+        """
+        realm = get_realm("zulip")
+        sender = get_system_bot(settings.NOTIFICATION_BOT, realm.id)
+        send_requests = [
+            internal_prep_stream_message_by_name(
+                realm=realm,
+                sender=sender,
+                stream_name="Denmark",
+                topic_name="batch",
+                content=f"message {i}",
+            )
+            for i in range(3)
+        ]
+        with (
+            mock.patch("zerver.tornado.django_api.queue_json_publish") as m,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            sent_message_results = do_send_messages(
+                [send_request for send_request in send_requests if send_request is not None]
+            )
+
+        batch_notices = [call.args[1] for call in m.call_args_list if "notices" in call.args[1]]
+        self.assert_length(batch_notices, 1)
+        self.assertEqual(
+            [notice["event"]["message"] for notice in batch_notices[0]["notices"]],
+            [result.message_id for result in sent_message_results],
+        )
+
+    def test_send_messages_batch_event_order(self) -> None:
+        """
+        Events queued on commit while sending a batch of messages, like
+        the sender automatically following a topic, are sent before the
+        batch's message events, which are sent together.
+        """
+        realm = get_realm("zulip")
+        hamlet = self.example_user("hamlet")
+        do_change_user_setting(
+            hamlet,
+            "automatically_follow_topics_policy",
+            UserProfile.AUTOMATICALLY_CHANGE_VISIBILITY_POLICY_ON_SEND,
+            acting_user=None,
+        )
+        send_requests = [
+            internal_prep_stream_message_by_name(
+                realm=realm,
+                sender=hamlet,
+                stream_name="Denmark",
+                topic_name=topic_name,
+                content="message",
+            )
+            for topic_name in ["first topic", "second topic"]
+        ]
+        notices: list[dict[str, Any]] = []
+        with (
+            mock.patch("zerver.tornado.event_queue.process_notification", notices.append),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            sent_message_results = do_send_messages(
+                [send_request for send_request in send_requests if send_request is not None]
+            )
+
+        events = [notice["event"] for notice in notices]
+        self.assertEqual(
+            [
+                event["topic_name"] if event["type"] == "user_topic" else event["message"]
+                for event in events
+                if event["type"] in ["message", "user_topic"]
+            ],
+            [
+                "first topic",
+                "second topic",
+                sent_message_results[0].message_id,
+                sent_message_results[1].message_id,
+            ],
+        )
+
     def test_non_ascii_stream_message(self) -> None:
         """
         Sending a stream message containing non-ASCII characters in the stream
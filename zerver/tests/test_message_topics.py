@@ -2,8 +2,10 @@ from unittest import mock
 
 from django.utils.timezone import now as timezone_now
 
+from zerver.actions.message_delete import do_delete_messages
 from zerver.actions.streams import do_change_stream_permission
 from zerver.lib.test_classes import ZulipTestCase
+from zerver.lib.topic import participants_for_topic
 from zerver.models import Message, UserMessage
 from zerver.models.clients import get_client
 from zerver.models.realms import get_realm
@@ -333,3 +335,59 @@ class TopicDeleteTest(ZulipTestCase):
             )
             result_dict = self.assert_json_success(result)
             self.assertFalse(result_dict["complete"])
+
+
+class TopicParticipantsTest(ZulipTestCase):
+    def test_participants_for_topic_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        iago = self.example_user("iago")
+        realm = hamlet.realm
+        stream_name = "Denmark"
+        for user in [hamlet, cordelia, othello]:
+            self.subscribe(user, stream_name)
+        recipient_id = get_stream(stream_name, realm).recipient_id
+        assert recipient_id is not None
+
+        def participants(topic_name: str = "topic") -> set[int]:
+            return participants_for_topic(realm.id, recipient_id, topic_name)
+
+        self.send_stream_message(hamlet, stream_name, topic_name="topic")
+        cordelia_message_id = self.send_stream_message(cordelia, stream_name, topic_name="topic")
+        self.assertEqual(participants(), {hamlet.id, cordelia.id})
+
+        # Topic names are case-insensitive, and repeated lookups, or
+        # messages from existing participants, don't need the database.
+        self.send_stream_message(hamlet, stream_name, topic_name="Topic")
+        with self.assert_database_query_count(0):
+            self.assertEqual(participants("TOPIC"), {hamlet.id, cordelia.id})
+
+        othello_message_id = self.send_stream_message(othello, stream_name, topic_name="topic")
+        self.assertEqual(participants(), {hamlet.id, cordelia.id, othello.id})
+
+        reaction_info = {"emoji_name": "smile"}
+        result = self.api_post(
+            iago, f"/api/v1/messages/{cordelia_message_id}/reactions", reaction_info
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id, cordelia.id, othello.id, iago.id})
+
+        result = self.api_delete(
+            iago, f"/api/v1/messages/{cordelia_message_id}/reactions", reaction_info
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id, cordelia.id, othello.id})
+
+        do_delete_messages(realm, [Message.objects.get(id=othello_message_id)], acting_user=None)
+        self.assertEqual(participants(), {hamlet.id, cordelia.id})
+
+        self.assertEqual(participants("new topic"), set())
+        result = self.api_patch(
+            iago,
+            f"/api/v1/messages/{cordelia_message_id}",
+            {"topic": "new topic", "propagate_mode": "change_one"},
+        )
+        self.assert_json_success(result)
+        self.assertEqual(participants(), {hamlet.id})
+        self.assertEqual(participants("new topic"), {cordelia.id})
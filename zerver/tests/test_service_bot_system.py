@@ -16,9 +16,10 @@ from zerver.lib.bot_storage import StateError
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import mock_queue_publish
 from zerver.lib.validator import check_string
-from zerver.models import Recipient, UserProfile
+from zerver.models import Message, Recipient, UserProfile
 from zerver.models.realms import get_realm
 from zerver.models.scheduled_jobs import NotificationTriggers
+from zerver.worker.deferred_message_work import DeferredMessageWorker
 
 BOT_TYPE_TO_QUEUE_NAME = {
     UserProfile.OUTGOING_WEBHOOK_BOT: "outgoing_webhooks",
@@ -509,6 +510,56 @@ class TestServiceBotEventTriggers(ZulipTestCase):
         self.send_stream_message(self.user_profile, "Denmark", content)
         self.assertTrue(mock_queue_event_on_commit.called)
 
+    @override_settings(DEFER_MESSAGE_SEND_WORK=True)
+    def test_deferred_trigger_on_stream_mention_from_user(self) -> None:
+        content = "@**FooBot** foo bar!!!"
+        with mock_queue_publish("zerver.actions.message_send.queue_event_on_commit") as m:
+            message_id = self.send_stream_message(self.user_profile, "Denmark", content)
+
+        # The bot is only triggered by the deferred_message_work worker.
+        m.assert_called_once()
+        queue_name, event, _ = m.call_args.args
+        self.assertEqual(queue_name, "deferred_message_work")
+        self.assertEqual([item["message_id"] for item in event["messages"]], [message_id])
+
+        with mock_queue_publish("zerver.worker.deferred_message_work.queue_json_publish") as m:
+            DeferredMessageWorker().consume(event)
+
+        m.assert_called_once()
+        queue_name, trigger_event, _ = m.call_args.args
+        self.assertEqual(queue_name, "outgoing_webhooks")
+        self.assertEqual(trigger_event["message"]["id"], message_id)
+        self.assertEqual(trigger_event["message"]["content"], content)
+        self.assertEqual(trigger_event["message"]["display_recipient"], "Denmark")
+        self.assertEqual(trigger_event["trigger"], "mention")
+        self.assertEqual(trigger_event["user_profile_id"], self.bot_profile.id)
+
+        # Messages deleted before the worker gets to them don't
+        # trigger anything.
+        Message.objects.filter(id=message_id).delete()
+        with (
+            mock_queue_publish("zerver.worker.deferred_message_work.queue_json_publish") as m,
+            self.assertLogs("zerver.worker.deferred_message_work", "INFO") as info_logs,
+        ):
+            DeferredMessageWorker().consume(event)
+        m.assert_not_called()
+        self.assertEqual(
+            info_logs.output,
+            [f"INFO:zerver.worker.deferred_message_work:Message {message_id} no longer exists"],
+        )
+
+    @override_settings(DEFER_MESSAGE_SEND_WORK=True)
+    def test_deferred_no_trigger_on_stream_mention_from_bot(self) -> None:
+        with mock_queue_publish("zerver.actions.message_send.queue_event_on_commit") as m:
+            self.send_stream_message(self.second_bot_profile, "Denmark", "@**FooBot** foo bar!!!")
+        m.assert_called_once()
+        queue_name, event, _ = m.call_args.args
+        self.assertEqual(queue_name, "deferred_message_work")
+
+        with mock_queue_publish("zerver.worker.deferred_message_work.queue_json_publish") as m:
+            DeferredMessageWorker().consume(event)
+        m.assert_not_called()
+
     @patch_queue_publish("zerver.actions.message_send.queue_event_on_commit")
     def test_no_trigger_on_stream_message_without_mention(
         self, mock_queue_event_on_commit: mock.Mock
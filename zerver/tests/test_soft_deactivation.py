@@ -4,6 +4,7 @@ from unittest import mock
 from django.utils.timezone import now as timezone_now
 
 from zerver.actions.alert_words import do_add_alert_words
+from zerver.actions.message_send import get_recipient_info
 from zerver.lib.mention import stream_wildcards
 from zerver.lib.soft_deactivation import (
     add_missing_messages,
@@ -16,7 +17,7 @@ from zerver.lib.soft_deactivation import (
     get_users_for_soft_deactivation,
     reactivate_user_if_soft_deactivated,
 )
-from zerver.lib.stream_subscription import get_subscriptions_for_send_message
+from zerver.lib.stream_topic import StreamTopicTarget
 from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.test_helpers import get_subscription, get_user_messages, make_client
 from zerver.models import (
@@ -578,7 +579,10 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         self.subscribe(cordelia, stream_name)
         self.subscribe(sender, stream_name)
 
-        stream_id = get_stream(stream_name, cordelia.realm).id
+        stream = get_stream(stream_name, cordelia.realm)
+        stream_id = stream.id
+        recipient = stream.recipient
+        assert recipient is not None
 
         def send_stream_message(content: str) -> None:
             self.send_stream_message(sender, stream_name, content, topic_name)
@@ -614,34 +618,34 @@ class SoftDeactivationMessageTest(ZulipTestCase):
             expected_count: int,
             *,
             possible_stream_wildcard_mention: bool = False,
-            topic_participant_user_ids: AbstractSet[int] = set(),
-            possibly_mentioned_user_ids: AbstractSet[int] = set(),
+            possible_topic_wildcard_mention: bool = False,
+            possibly_mentioned_user_ids: AbstractSet[int] = frozenset(),
         ) -> None:
-            self.assertEqual(
-                len(
-                    get_subscriptions_for_send_message(
-                        realm_id=realm_id,
-                        stream_id=stream_id,
-                        topic_name=topic_name,
-                        possible_stream_wildcard_mention=possible_stream_wildcard_mention,
-                        topic_participant_user_ids=topic_participant_user_ids,
-                        possibly_mentioned_user_ids=possibly_mentioned_user_ids,
-                    )
-                ),
-                expected_count,
+            # The recipients who might need a UserMessage row or a
+            # notification; get_recipient_info leaves out the other
+            # long_term_idle subscribers in get_stream_delivery_profile.
+            info = get_recipient_info(
+                realm_id=realm_id,
+                recipient=recipient,
+                sender_id=sender.id,
+                stream_topic=StreamTopicTarget(stream_id=stream_id, topic_name=topic_name),
+                possibly_mentioned_user_ids=possibly_mentioned_user_ids,
+                possible_topic_wildcard_mention=possible_topic_wildcard_mention,
+                possible_stream_wildcard_mention=possible_stream_wildcard_mention,
             )
+            self.assert_length(info.active_user_ids, expected_count)
 
         def assert_stream_message_sent_to_idle_user(
             content: str,
             *,
             possible_stream_wildcard_mention: bool = False,
-            topic_participant_user_ids: AbstractSet[int] = set(),
-            possibly_mentioned_user_ids: AbstractSet[int] = set(),
+            possible_topic_wildcard_mention: bool = False,
+            possibly_mentioned_user_ids: AbstractSet[int] = frozenset(),
         ) -> None:
             assert_num_possible_users(
                 expected_count=3,
                 possible_stream_wildcard_mention=possible_stream_wildcard_mention,
-                topic_participant_user_ids=topic_participant_user_ids,
+                possible_topic_wildcard_mention=possible_topic_wildcard_mention,
                 possibly_mentioned_user_ids=possibly_mentioned_user_ids,
             )
             general_user_msg_count = len(get_user_messages(cordelia))
@@ -655,7 +659,7 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         def assert_stream_message_not_sent_to_idle_user(
             content: str,
             *,
-            possibly_mentioned_user_ids: AbstractSet[int] = set(),
+            possibly_mentioned_user_ids: AbstractSet[int] = frozenset(),
             false_alarm_row: bool = False,
         ) -> None:
             if false_alarm_row:
@@ -761,11 +765,10 @@ class SoftDeactivationMessageTest(ZulipTestCase):
         # there is a topic wildcard mention i.e. @topic
         do_soft_activate_users([long_term_idle_user])
         self.send_stream_message(long_term_idle_user, stream_name, "Hi", topic_name)
-        topic_participant_user_ids = {long_term_idle_user.id}
 
         do_soft_deactivate_users([long_term_idle_user])
         assert_stream_message_sent_to_idle_user(
-            "Test @**topic** mention", topic_participant_user_ids=topic_participant_user_ids
+            "Test @**topic** mention", possible_topic_wildcard_mention=True
         )
 
         # Test UserMessage row is created while user is deactivated if there
@@ -3,6 +3,7 @@ from typing import Any
 
 import orjson
 import time_machine
+from django.test import override_settings
 from django.utils.timezone import now as timezone_now
 
 from zerver.actions.reactions import check_add_reaction, do_add_reaction
@@ -10,11 +11,12 @@ from zerver.actions.user_settings import do_change_user_setting
 from zerver.actions.user_topics import do_set_user_topic_visibility_policy
 from zerver.lib.stream_topic import StreamTopicTarget
 from zerver.lib.test_classes import ZulipTestCase
-from zerver.lib.test_helpers import get_subscription
+from zerver.lib.test_helpers import get_subscription, mock_queue_publish
 from zerver.lib.user_topics import get_topic_mutes, topic_has_visibility_policy
 from zerver.models import Message, Reaction, UserProfile, UserTopic
 from zerver.models.constants import MAX_TOPIC_NAME_LENGTH
 from zerver.models.streams import get_stream
+from zerver.worker.deferred_message_work import DeferredMessageWorker
 
 
 class MutedTopicsTestsDeprecated(ZulipTestCase):
@@ -866,6 +868,67 @@ class AutomaticallyFollowTopicsTests(ZulipTestCase):
         )
         self.assertEqual(user_ids, {hamlet.id})
 
+    @override_settings(DEFER_MESSAGE_SEND_WORK=True)
+    def test_automatically_follow_topic_on_mention_deferred(self) -> None:
+        hamlet = self.example_user("hamlet")
+        aaron = self.example_user("aaron")
+        stream = get_stream("Verona", hamlet.realm)
+        topic_name = "teST topic"
+
+        do_change_user_setting(
+            hamlet,
+            "automatically_follow_topics_where_mentioned",
+            True,
+            acting_user=None,
+        )
+
+        content = "mentioning... @**" + hamlet.full_name + "**"
+        with mock_queue_publish("zerver.actions.message_send.queue_event_on_commit") as m:
+            message_id = self.send_stream_message(aaron, stream.name, content, topic_name)
+
+        # Hamlet only follows the topic once the deferred_message_work
+        # worker processes the event.
+        stream_topic_target = StreamTopicTarget(
+            stream_id=stream.id,
+            topic_name=topic_name,
+        )
+        user_ids = stream_topic_target.user_ids_with_visibility_policy(
+            UserTopic.VisibilityPolicy.FOLLOWED
+        )
+        self.assertEqual(user_ids, set())
+
+        m.assert_called_once()
+        queue_name, event, _ = m.call_args.args
+        self.assertEqual(queue_name, "deferred_message_work")
+        self.assertEqual(
+            event["messages"],
+            [
+                dict(
+                    message_id=message_id,
+                    follow_topic=dict(
+                        stream_id=stream.id,
+                        topic_name=topic_name,
+                        user_ids=[hamlet.id],
+                    ),
+                )
+            ],
+        )
+
+        DeferredMessageWorker().consume(event)
+        user_ids = stream_topic_target.user_ids_with_visibility_policy(
+            UserTopic.VisibilityPolicy.FOLLOWED
+        )
+        self.assertEqual(user_ids, {hamlet.id})
+
+        # Channels which were deleted in the meantime are skipped.
+        event["messages"][0]["follow_topic"]["stream_id"] = 99999
+        with self.assertLogs("zerver.worker.deferred_message_work", "INFO") as info_logs:
+            DeferredMessageWorker().consume(event)
+        self.assertEqual(
+            info_logs.output,
+            ["INFO:zerver.worker.deferred_message_work:Stream 99999 no longer exists"],
+        )
+
     def test_automatically_follow_topic_on_participation_send_message(self) -> None:
         hamlet = self.example_user("hamlet")
         aaron = self.example_user("aaron")
@@ -2578,6 +2578,61 @@ class RecipientInfoTest(ZulipTestCase):
         self.assertEqual(info.followed_topic_push_user_ids, set())
         self.assertEqual(info.stream_wildcard_mention_in_followed_topic_user_ids, set())
 
+    def test_stream_recipient_info_cache(self) -> None:
+        hamlet = self.example_user("hamlet")
+        cordelia = self.example_user("cordelia")
+        othello = self.example_user("othello")
+        realm = hamlet.realm
+
+        stream_name = "Test stream"
+        for user in [hamlet, cordelia]:
+            self.subscribe(user, stream_name)
+
+        stream = get_stream(stream_name, realm)
+        recipient = stream.recipient
+        assert recipient is not None
+        stream_topic = StreamTopicTarget(stream_id=stream.id, topic_name="test topic")
+
+        def recipient_user_ids(possibly_mentioned_user_ids: Iterable[int] = ()) -> set[int]:
+            info = get_recipient_info(
+                realm_id=realm.id,
+                recipient=recipient,
+                sender_id=hamlet.id,
+                stream_topic=stream_topic,
+                possibly_mentioned_user_ids=set(possibly_mentioned_user_ids),
+                possible_topic_wildcard_mention=False,
+                possible_stream_wildcard_mention=False,
+            )
+            return info.active_user_ids
+
+        self.assertEqual(recipient_user_ids(), {hamlet.id, cordelia.id})
+
+        # The stream's subscribers are now cached; only the topic's
+        # visibility policies and the users themselves are queried.
+        with self.assert_database_query_count(2):
+            self.assertEqual(recipient_user_ids(), {hamlet.id, cordelia.id})
+
+        self.subscribe(othello, stream_name)
+        self.assertEqual(recipient_user_ids(), {hamlet.id, cordelia.id, othello.id})
+
+        self.unsubscribe(cordelia, stream_name)
+        self.assertEqual(recipient_user_ids(), {hamlet.id, othello.id})
+
+        # Long-term idle users are only included if they might need
+        # a UserMessage row or notification.
+        othello.long_term_idle = True
+        othello.save(update_fields=["long_term_idle"])
+        self.assertEqual(recipient_user_ids(), {hamlet.id})
+        self.assertEqual(recipient_user_ids({othello.id}), {hamlet.id, othello.id})
+
+        sub = get_subscription(stream_name, othello)
+        sub.email_notifications = True
+        sub.save()
+        self.assertEqual(recipient_user_ids(), {hamlet.id, othello.id})
+
+        do_deactivate_user(othello, acting_user=None)
+        self.assertEqual(recipient_user_ids(), {hamlet.id})
+
     def test_get_recipient_info_invalid_recipient_type(self) -> None:
         hamlet = self.example_user("hamlet")
         realm = hamlet.realm
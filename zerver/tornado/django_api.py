@@ -146,6 +146,13 @@ def get_user_events(
 
 
 def send_notification_http(port: int, data: Mapping[str, Any]) -> None:
+    if "notices" in data:
+        # A batch from send_events_rollback_unsafe; the RabbitMQ
+        # consumer in Tornado unpacks these itself.
+        for notice in data["notices"]:
+            send_notification_http(port, notice)
+        return
+
     if not settings.USING_TORNADO or settings.RUNNING_INSIDE_TORNADO:
         # To allow the backend test suite to not require a separate
         # Tornado process, we simply call the process_notification
@@ -191,19 +198,47 @@ def send_event_rollback_unsafe(
 ) -> None:
     """`users` is a list of user IDs, or in some special cases like message
     send/update or embeds, dictionaries containing extra data."""
+    for port, port_users in get_port_user_map(realm, users).items():
+        queue_json_publish(
+            notify_tornado_queue_name(port),
+            dict(event=event, users=port_users),
+            partial(send_notification_http, port),
+        )
+
+
+def get_port_user_map(
+    realm: Realm, users: Iterable[int] | Iterable[Mapping[str, Any]]
+) -> dict[int, list[Any]]:
     realm_ports = get_realm_tornado_ports(realm)
     if len(realm_ports) == 1:
-        port_user_map = {realm_ports[0]: list(users)}
-    else:
-        port_user_map = defaultdict(list)
-        for user in users:
-            user_id = user if isinstance(user, int) else user["id"]
-            port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
+        return {realm_ports[0]: list(users)}
+
+    port_user_map: dict[int, list[Any]] = defaultdict(list)
+    for user in users:
+        user_id = user if isinstance(user, int) else user["id"]
+        port_user_map[get_user_id_tornado_port(realm_ports, user_id)].append(user)
+    return port_user_map
 
-    for port, port_users in port_user_map.items():
+
+def send_events_rollback_unsafe(
+    events: Iterable[tuple[Realm, Mapping[str, Any], Iterable[int] | Iterable[Mapping[str, Any]]]],
+) -> None:
+    """Variant of `send_event_rollback_unsafe` for sending many events,
+    which publishes a single notice per Tornado port for all of them,
+    rather than one per event.  Takes (realm, event, users) triples.
+
+    Tornado from before Zulip 10.0 can't read these batched notices;
+    scripts/restart-server restarts Tornado before Django, so that
+    Tornado is always at least as new as the Django sending to it."""
+    port_notices: dict[int, list[dict[str, Any]]] = defaultdict(list)
+    for realm, event, users in events:
+        for port, port_users in get_port_user_map(realm, users).items():
+            port_notices[port].append(dict(event=event, users=port_users))
+
+    for port, notices in port_notices.items():
         queue_json_publish(
             notify_tornado_queue_name(port),
-            dict(event=event, users=port_users),
+            notices[0] if len(notices) == 1 else dict(notices=notices),
             partial(send_notification_http, port),
         )
 
@@ -1,21 +1,31 @@
 # See https://zulip.readthedocs.io/en/latest/subsystems/events-system.html for
 # high-level documentation on how this system works.
 import copy
+import heapq
 import logging
 import os
 import random
 import time
 import traceback
 import uuid
-from collections import deque
-from collections.abc import Callable, Collection, Iterable, Mapping, MutableMapping, Sequence
+from collections import OrderedDict, deque
+from collections.abc import (
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Sequence,
+)
 from collections.abc import Set as AbstractSet
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 from functools import cache
 from typing import Any, Literal, TypedDict, cast
 
 import orjson
 import tornado.ioloop
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils.translation import gettext as _
 from tornado import autoreload
@@ -25,21 +35,29 @@ from version import API_FEATURE_LEVEL, ZULIP_MERGE_BASE, ZULIP_VERSION
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message_cache import MessageDict
 from zerver.lib.narrow_helpers import narrow_dataclasses_from_tuples
-from zerver.lib.narrow_predicate import build_narrow_predicate
+from zerver.lib.narrow_predicate import build_narrow_predicate, channel_operators
 from zerver.lib.notification_data import UserMessageNotificationsData
+from zerver.lib.partial import partial
 from zerver.lib.queue import queue_json_publish, retry_event
+from zerver.lib.topic import get_topic_from_message_info
 from zerver.middleware import async_request_timer_restart
 from zerver.models import CustomProfileField
 from zerver.tornado.descriptors import clear_descriptor_by_handler_id, set_descriptor_by_handler_id
+from zerver.tornado.django_api import send_notification_http
 from zerver.tornado.exceptions import BadEventQueueIdError
 from zerver.tornado.handlers import finish_handler, get_handler_by_id, handler_stats_string
+from zerver.tornado.sharding import (
+    get_realm_ids_tornado_ports,
+    get_user_id_tornado_port,
+    notify_tornado_queue_name,
+)
 
 # The idle timeout used to be a week, but we found that in that
 # situation, queues from dead browser sessions would grow quite large
 # due to the accumulation of message data in those queues.
 DEFAULT_EVENT_QUEUE_TIMEOUT_SECS = 60 * 10
-# We garbage-collect every minute; this is totally fine given that the
-# GC scan takes ~2ms with 1000 event queues.
+# We garbage-collect every minute; this is cheap, since we only look
+# at queues whose expiry deadline has passed (see gc_heap).
 EVENT_QUEUE_GC_FREQ_MSECS = 1000 * 60 * 1
 
 # Capped limit for how long a client can request an event queue
@@ -112,6 +130,8 @@ class ClientDescriptor:
         self.user_list_incomplete = user_list_incomplete
         self.include_deactivated_groups = include_deactivated_groups
         self.archived_channels = archived_channels
+        # Whether this queue has an entry in gc_heap.
+        self.gc_scheduled = False
 
         # Default for lifespan_secs is DEFAULT_EVENT_QUEUE_TIMEOUT_SECS;
         # but users can set it as high as MAX_QUEUE_TIMEOUT_SECS.
@@ -194,16 +214,24 @@ class ClientDescriptor:
                 async_request_timer_restart(handler._request)
 
         self.event_queue.push(event)
-        self.finish_current_handler()
+        record_event_queue_change(self.event_queue.id, "push", event)
+        if clients_to_finish is not None:
+            # We're processing a batch of notices; the handler will
+            # be finished, with all of its new events, at the end.
+            clients_to_finish[self.event_queue.id] = self
+        else:
+            self.finish_current_handler()
 
     def finish_current_handler(self) -> bool:
         if self.current_handler_id is None:
             return False
         try:
+            events = self.event_queue.resolved_events()
             finish_handler(
                 self.current_handler_id,
                 self.event_queue.id,
-                self.event_queue.contents(),
+                [event.to_json_fragment() for event in events],
+                [event.type for event in events],
             )
         except Exception:
             logging.exception(
@@ -266,6 +294,7 @@ class ClientDescriptor:
         self.current_client_name = client_name
         set_descriptor_by_handler_id(handler_id, self)
         self.last_connection_time = time.time()
+        record_event_queue_change(self.event_queue.id, "connect", self.last_connection_time)
 
         def timeout_callback() -> None:
             self._timeout_handle = None
@@ -294,6 +323,8 @@ class ClientDescriptor:
             ioloop = tornado.ioloop.IOLoop.current()
             ioloop.remove_timeout(self._timeout_handle)
             self._timeout_handle = None
+        # Now that the queue is idle, it can expire.
+        schedule_gc(self)
 
     def cleanup(self) -> None:
         # Before we can GC the event queue, we need to disconnect the
@@ -315,12 +346,111 @@ def compute_full_event_type(event: Mapping[str, Any]) -> str:
     return event["type"]
 
 
+def get_coalescing_key(event: Mapping[str, Any]) -> str | None:
+    """Returns the key of the virtual event that this event supersedes,
+    if any; see EventQueue.push."""
+    if event["type"] == "presence":
+        return "presence/{}".format(event["user_id"])
+    if event["type"] == "typing":
+        if event["message_type"] == "stream":
+            conversation = "stream/{}/{}".format(event["stream_id"], event["topic"])
+        else:
+            conversation = "direct/" + ",".join(
+                str(user_id)
+                for user_id in sorted(recipient["user_id"] for recipient in event["recipients"])
+            )
+        return "typing/{}/{}".format(event["sender"]["user_id"], conversation)
+    return None
+
+
+class QueuedEvent:
+    """A single entry in an EventQueue.
+
+    The event payload is shared, by reference, between every queue
+    the event was pushed to (and, for message events, between every
+    client with the same formatting options), so it must never be
+    mutated after being pushed.  Only the per-queue event ID is stored
+    alongside it; the two are combined into the dictionary that we
+    send to clients when the queue's contents are fetched.
+    """
+
+    __slots__ = ("id", "payload")
+
+    def __init__(self, id: int, payload: Mapping[str, Any]) -> None:
+        self.id = id
+        self.payload = payload
+
+    @property
+    def type(self) -> str:
+        return self.payload["type"]
+
+    def to_dict(self, include_internal_data: bool = True) -> dict[str, Any]:
+        event = dict(self.payload)
+        event["id"] = self.id
+        if not include_internal_data and event["type"] == "message":
+            # The internal_data data structures are not intended to
+            # be exposed to API clients.
+            event.pop("internal_data", None)
+        return event
+
+    def to_json_fragment(self) -> orjson.Fragment:
+        """Returns the event as sent to clients, as pre-serialized JSON.
+
+        The serialization of the shared payload is cached, so that an
+        event delivered to many clients is only encoded once, and the
+        per-queue event ID is spliced into it.
+        """
+        payload = self.payload
+        if payload["type"] == "message":
+            # Message events are specific to a user, but the message
+            # dictionary itself is shared between all recipients with
+            # the same formatting options.
+            event = {key: value for key, value in payload.items() if key != "internal_data"}
+            event["message"] = orjson.Fragment(serialize_event_payload(payload["message"]))
+            event["id"] = self.id
+            return orjson.Fragment(orjson.dumps(event, option=orjson.OPT_PASSTHROUGH_DATETIME))
+        if "id" in payload:
+            # Events restored from disk, and virtual events, carry
+            # their own ID, which we must not duplicate.
+            return orjson.Fragment(
+                orjson.dumps(self.to_dict(), option=orjson.OPT_PASSTHROUGH_DATETIME)
+            )
+        serialized = serialize_event_payload(payload)
+        return orjson.Fragment(b'{"id":%d,%b' % (self.id, serialized[1:]))
+
+    @override
+    def __repr__(self) -> str:
+        return f"QueuedEvent<{self.id}, {self.type}>"
+
+
+# Cache of the JSON encoding of recently fetched event payloads, keyed
+# by the id() of the payload.  Each entry keeps a reference to its
+# payload, so that the id() cannot be reused while it is cached;
+# payloads are never mutated after being pushed to a queue.
+SERIALIZED_EVENT_PAYLOAD_CACHE_SIZE = 1000
+serialized_event_payloads: OrderedDict[int, tuple[Mapping[str, Any], bytes]] = OrderedDict()
+
+
+def serialize_event_payload(payload: Mapping[str, Any]) -> bytes:
+    key = id(payload)
+    cached = serialized_event_payloads.get(key)
+    if cached is not None:
+        serialized_event_payloads.move_to_end(key)
+        return cached[1]
+
+    serialized = orjson.dumps(payload, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    serialized_event_payloads[key] = (payload, serialized)
+    if len(serialized_event_payloads) > SERIALIZED_EVENT_PAYLOAD_CACHE_SIZE:
+        serialized_event_payloads.popitem(last=False)
+    return serialized
+
+
 class EventQueue:
     def __init__(self, id: str) -> None:
         # When extending this list of properties, one must be sure to
         # update to_dict and from_dict.
 
-        self.queue: deque[dict[str, Any]] = deque()
+        self.queue: deque[QueuedEvent] = deque()
         self.next_event_id: int = 0
         # will only be None for migration from old versions
         self.newest_pruned_id: int | None = -1
@@ -334,7 +464,7 @@ class EventQueue:
         d = dict(
             id=self.id,
             next_event_id=self.next_event_id,
-            queue=list(self.queue),
+            queue=[event.to_dict() for event in self.queue],
             virtual_events=self.virtual_events,
         )
         if self.newest_pruned_id is not None:
@@ -346,24 +476,29 @@ class EventQueue:
         ret = cls(d["id"])
         ret.next_event_id = d["next_event_id"]
         ret.newest_pruned_id = d.get("newest_pruned_id")
-        ret.queue = deque(d["queue"])
+        ret.queue = deque(QueuedEvent(event["id"], event) for event in d["queue"])
         ret.virtual_events = d.get("virtual_events", {})
         return ret
 
-    def push(self, orig_event: Mapping[str, Any]) -> None:
-        # By default, we make a shallow copy of the event dictionary
-        # to push into the target event queue; this allows the calling
-        # code to send the same "event" object to multiple queues.
-        # This behavior is important because the event_queue system is
-        # about to mutate the event dictionary, minimally to add the
-        # event_id attribute.
-        event = dict(orig_event)
-        event["id"] = self.next_event_id
+    def push(self, event: Mapping[str, Any]) -> None:
+        # The event dictionary is stored by reference, not copied: the
+        # calling code sends the same "event" object to many queues,
+        # and we track the queue-specific event ID separately (see
+        # QueuedEvent), so that we never need to mutate it.
+        event_id = self.next_event_id
         self.next_event_id += 1
+        coalescing_key = get_coalescing_key(event)
+        if coalescing_key is not None:
+            # Presence and typing events carry the complete current
+            # state for their key (a user's presence, or whether a
+            # user is typing in a conversation), so only the latest
+            # undelivered one needs to be kept; it is delivered in the
+            # position of that latest update, like other virtual events.
+            self.virtual_events[coalescing_key] = dict(event, id=event_id)
+            return
+
         full_event_type = compute_full_event_type(event)
-        if full_event_type.startswith("flags/") and not full_event_type.startswith(
-            "flags/remove/read"
-        ):
+        if full_event_type.startswith("flags/"):
             # virtual_events are an optimization that allows certain
             # simple events, such as update_message_flags events that
             # simply contain a list of message IDs to operate on, to
@@ -371,31 +506,53 @@ class EventQueue:
             # flags/add/read, where normal Zulip usage will result in
             # many small flags/add/read events as users scroll.
             #
-            # We need to exclude flags/remove/read, because it has an
-            # extra message_details field that cannot be compressed.
-            #
-            # BUG: This compression algorithm is incorrect in the
-            # presence of mark-as-unread, since it does not respect
-            # the ordering of "mark as read" and "mark as unread"
-            # updates for a given message.
+            # For each flag, we keep at most one "add" and one
+            # "remove" virtual event, and each message is in at most
+            # one of them: the one for the last operation on that
+            # message, which is all that the client needs to end up
+            # in the right state, whatever the order in which the two
+            # are delivered.
+            opposite_event_type = "flags/{}/{}".format(
+                "remove" if event["operation"] == "add" else "add", event["flag"]
+            )
+            opposite_event = self.virtual_events.get(opposite_event_type)
+            if opposite_event is not None:
+                message_ids = set(event["messages"])
+                opposite_event["messages"] = [
+                    message_id
+                    for message_id in opposite_event["messages"]
+                    if message_id not in message_ids
+                ]
+                if "message_details" in opposite_event:
+                    for message_id in message_ids:
+                        opposite_event["message_details"].pop(str(message_id), None)
+                if not opposite_event["messages"]:
+                    del self.virtual_events[opposite_event_type]
+
             if full_event_type not in self.virtual_events:
-                self.virtual_events[full_event_type] = copy.deepcopy(event)
+                virtual_event = copy.deepcopy(dict(event))
+                virtual_event["id"] = event_id
+                self.virtual_events[full_event_type] = virtual_event
                 return
 
             # Update the virtual event with the values from the event
             virtual_event = self.virtual_events[full_event_type]
-            virtual_event["id"] = event["id"]
+            virtual_event["id"] = event_id
             virtual_event["messages"] += event["messages"]
+            if "message_details" in event:
+                # flags/remove/read events carry details about each
+                # message, for the client's unread counts.
+                virtual_event["message_details"].update(copy.deepcopy(event["message_details"]))
             if "timestamp" in event:
                 virtual_event["timestamp"] = event["timestamp"]
 
         else:
-            self.queue.append(event)
+            self.queue.append(QueuedEvent(event_id, event))
 
     # Note that pop ignores virtual events.  This is fine in our
     # current usage since virtual events should always be resolved to
     # a real event before being given to users.
-    def pop(self) -> dict[str, Any]:
+    def pop(self) -> QueuedEvent:
         return self.queue.popleft()
 
     def empty(self) -> bool:
@@ -403,22 +560,30 @@ class EventQueue:
 
     # See the comment on pop; that applies here as well
     def prune(self, through_id: int) -> None:
-        while len(self.queue) != 0 and self.queue[0]["id"] <= through_id:
-            self.newest_pruned_id = self.queue[0]["id"]
+        if len(self.queue) != 0 and self.queue[0].id <= through_id:
+            record_event_queue_change(self.id, "prune", through_id)
+        while len(self.queue) != 0 and self.queue[0].id <= through_id:
+            self.newest_pruned_id = self.queue[0].id
             self.pop()
 
-    def contents(self, include_internal_data: bool = False) -> list[dict[str, Any]]:
-        contents: list[dict[str, Any]] = []
-        virtual_id_map: dict[str, dict[str, Any]] = {}
-        for event_type in self.virtual_events:
-            virtual_id_map[self.virtual_events[event_type]["id"]] = self.virtual_events[event_type]
+    def resolved_events(self) -> list[QueuedEvent]:
+        if self.virtual_events:
+            record_event_queue_change(self.id, "resolve", None)
+        contents: list[QueuedEvent] = []
+        virtual_id_map: dict[int, QueuedEvent] = {}
+        for virtual_event in self.virtual_events.values():
+            if "messages" in virtual_event:
+                # A message may have had the same flag operation
+                # applied to it more than once.
+                virtual_event["messages"] = list(dict.fromkeys(virtual_event["messages"]))
+            virtual_id_map[virtual_event["id"]] = QueuedEvent(virtual_event["id"], virtual_event)
         virtual_ids = sorted(virtual_id_map.keys())
 
         # Merge the virtual events into their final place in the queue
         index = 0
         length = len(virtual_ids)
         for event in self.queue:
-            while index < length and virtual_ids[index] < event["id"]:
+            while index < length and virtual_ids[index] < event.id:
                 contents.append(virtual_id_map[virtual_ids[index]])
                 index += 1
             contents.append(event)
@@ -428,21 +593,12 @@ class EventQueue:
 
         self.virtual_events = {}
         self.queue = deque(contents)
+        return contents
 
-        if include_internal_data:
-            return contents
-        return prune_internal_data(contents)
-
-
-def prune_internal_data(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
-    """Prunes the internal_data data structures, which are not intended to
-    be exposed to API clients.
-    """
-    events = copy.deepcopy(events)
-    for event in events:
-        if event["type"] == "message" and "internal_data" in event:
-            del event["internal_data"]
-    return events
+    def contents(self, include_internal_data: bool = False) -> list[dict[str, Any]]:
+        # Each event dictionary is only assembled here, when it is
+        # about to be used.
+        return [event.to_dict(include_internal_data) for event in self.resolved_events()]
 
 
 # Queue-ids which still need to be sent a web_reload_client event.
@@ -456,6 +612,30 @@ clients: dict[str, ClientDescriptor] = {}
 user_clients: dict[int, list[ClientDescriptor]] = {}
 # maps realm id to list of client descriptors with all_public_streams=True
 realm_clients_all_streams: dict[int, list[ClientDescriptor]] = {}
+# maps realm id to an index of the client descriptors whose narrow only
+# matches messages in a specific channel (and possibly topic); these
+# are keyed by the lowercased channel and topic names (or None for
+# the topic), and are not in realm_clients_all_streams.
+realm_clients_by_narrow: dict[int, dict[tuple[str, str | None], list[ClientDescriptor]]] = {}
+# The changes to event queues since they were last written to disk,
+# in order, as (queue id, operation, argument); None if we are not
+# persisting event queues.  See checkpoint_event_queues.
+event_queue_changes: list[tuple[str, str, Any]] | None = None
+
+# A heap of (expiry deadline, queue id) for idle queues, which lets
+# gc_event_queues find expired queues without scanning every queue.
+# Each queue has at most one entry (see ClientDescriptor.gc_scheduled);
+# since a queue's deadline only ever moves later, an entry may come up
+# before the queue has actually expired, in which case the queue is
+# rescheduled, if it is idle, or left to be rescheduled when its
+# handler disconnects.
+gc_heap: list[tuple[float, str]] = []
+
+# While a batch of notices is being processed, maps queue ids to the
+# client descriptors which received events; their long-polling
+# handlers are finished once, after the whole batch.  See
+# finish_handlers_after_batch.
+clients_to_finish: dict[str, ClientDescriptor] | None = None
 
 # list of registered gc hooks.
 # each one will be called with a user profile id, queue, and bool
@@ -466,14 +646,25 @@ gc_hooks: list[Callable[[int, ClientDescriptor, bool], None]] = []
 
 
 def clear_client_event_queues_for_testing() -> None:
+    global event_queue_changes, event_queue_log_bytes
     assert settings.TEST_SUITE
+    event_queue_changes = None
+    event_queue_log_bytes = None
     clients.clear()
+    serialized_event_payloads.clear()
     web_reload_clients.clear()
     user_clients.clear()
     realm_clients_all_streams.clear()
+    realm_clients_by_narrow.clear()
+    gc_heap.clear()
     gc_hooks.clear()
 
 
+def record_event_queue_change(queue_id: str, operation: str, argument: Any) -> None:
+    if event_queue_changes is not None:
+        event_queue_changes.append((queue_id, operation, argument))
+
+
 def add_client_gc_hook(hook: Callable[[int, ClientDescriptor, bool], None]) -> None:
     gc_hooks.append(hook)
 
@@ -501,10 +692,57 @@ def get_client_descriptors_for_realm_all_streams(realm_id: int) -> list[ClientDe
     return realm_clients_all_streams.get(realm_id, [])
 
 
+def get_client_descriptors_for_stream_narrows(
+    realm_id: int, stream_name: str, topic_name: str
+) -> list[ClientDescriptor]:
+    """Returns the client descriptors whose narrow is limited to the
+    given channel, either with no topic or with the given topic."""
+    narrow_index = realm_clients_by_narrow.get(realm_id)
+    if narrow_index is None:
+        return []
+    stream_key = stream_name.lower()
+    return narrow_index.get((stream_key, None), []) + narrow_index.get(
+        (stream_key, topic_name.lower()), []
+    )
+
+
+def get_narrow_index_key(narrow: Collection[Sequence[str]]) -> tuple[str, str | None] | None:
+    """Clients whose narrow has a channel term only accept messages
+    sent to that channel, and, with a topic term, that topic; we use
+    those to index the client, matching the case-insensitive
+    comparisons of build_narrow_predicate."""
+    stream_key = None
+    topic_key = None
+    for operator, operand in narrow:
+        if operator in channel_operators:
+            stream_key = operand.lower()
+        elif operator == "topic":
+            topic_key = operand.lower()
+    if stream_key is None:
+        return None
+    return (stream_key, topic_key)
+
+
+def schedule_gc(client: ClientDescriptor) -> None:
+    if client.gc_scheduled:
+        return
+    client.gc_scheduled = True
+    heapq.heappush(
+        gc_heap, (client.last_connection_time + client.queue_timeout, client.event_queue.id)
+    )
+
+
 def add_to_client_dicts(client: ClientDescriptor) -> None:
+    schedule_gc(client)
     user_clients.setdefault(client.user_profile_id, []).append(client)
     if client.all_public_streams or client.narrow != []:
-        realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
+        narrow_key = get_narrow_index_key(client.narrow)
+        if narrow_key is not None:
+            realm_clients_by_narrow.setdefault(client.realm_id, {}).setdefault(
+                narrow_key, []
+            ).append(client)
+        else:
+            realm_clients_all_streams.setdefault(client.realm_id, []).append(client)
 
 
 def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> ClientDescriptor:
@@ -513,6 +751,7 @@ def allocate_client_descriptor(new_queue_data: MutableMapping[str, Any]) -> Clie
     client = ClientDescriptor.from_dict(new_queue_data)
     clients[queue_id] = client
     add_to_client_dicts(client)
+    record_event_queue_change(queue_id, "client", orjson.dumps(client.to_dict()))
     return client
 
 
@@ -537,9 +776,24 @@ def do_gc_event_queues(
     for realm_id in affected_realms:
         filter_client_dict(realm_clients_all_streams, realm_id)
 
+    for id in to_remove:
+        client = clients[id]
+        narrow_key = get_narrow_index_key(client.narrow)
+        narrow_index = realm_clients_by_narrow.get(client.realm_id)
+        if narrow_key is None or narrow_index is None:
+            continue
+        new_client_list = [c for c in narrow_index.get(narrow_key, []) if c is not client]
+        if new_client_list:
+            narrow_index[narrow_key] = new_client_list
+        else:
+            narrow_index.pop(narrow_key, None)
+            if not narrow_index:
+                del realm_clients_by_narrow[client.realm_id]
+
     for id in to_remove:
         if id in web_reload_clients:
             del web_reload_clients[id]
+        record_event_queue_change(id, "deleted", None)
         for cb in gc_hooks:
             cb(
                 clients[id].user_profile_id,
@@ -556,11 +810,19 @@ def gc_event_queues(port: int) -> None:
     to_remove: set[str] = set()
     affected_users: set[int] = set()
     affected_realms: set[int] = set()
-    for id, client in clients.items():
+    while gc_heap and gc_heap[0][0] <= start:
+        _, id = heapq.heappop(gc_heap)
+        client = clients.get(id)
+        if client is None:
+            # Already cleaned up.
+            continue
+        client.gc_scheduled = False
         if client.expired(start):
             to_remove.add(id)
             affected_users.add(client.user_profile_id)
             affected_realms.add(client.realm_id)
+        elif client.current_handler_id is None:
+            schedule_gc(client)
 
     # We don't need to call e.g. finish_current_handler on the clients
     # being removed because they are guaranteed to be idle (because
@@ -570,12 +832,13 @@ def gc_event_queues(port: int) -> None:
     if settings.PRODUCTION:
         logging.info(
             "Tornado %d removed %d expired event queues owned by %d users in %.3fs."
-            "  Now %d active queues, %s",
+            "  Now %d active queues (%d scheduled for expiry), %s",
             port,
             len(to_remove),
             len(affected_users),
             time.time() - start,
             len(clients),
+            len(gc_heap),
             handler_stats_string(),
         )
 
@@ -591,41 +854,215 @@ def persistent_queue_filename(port: int, last: bool = False) -> str:
     return settings.JSON_PERSISTENT_QUEUE_FILENAME_PATTERN % ("." + str(port),)
 
 
-def dump_event_queues(port: int) -> None:
-    start = time.perf_counter()
-
-    with open(persistent_queue_filename(port), "wb") as stored_queues:
-        stored_queues.write(
-            orjson.dumps([(qid, client.to_dict()) for (qid, client) in clients.items()])
+# Event queues are persisted as an append-only log of line-delimited
+# JSON records of the changes to them, so that a checkpoint, or
+# restarting Tornado, only needs to write out what happened since the
+# last checkpoint, rather than every queue; loading replays the log.
+# Each line is one of:
+#
+#   {"queue_id": ..., "client": {...}}   the full state of a new queue
+#   {"payload": n, "event": {...}}       an event, pushed by the records below
+#   {"queue_id": ..., "push": n}         EventQueue.push of payload n
+#   {"queue_id": ..., "prune": id}       EventQueue.prune through an event ID
+#   {"queue_id": ..., "resolve": true}   EventQueue.resolved_events
+#   {"queue_id": ..., "connect": time}   ClientDescriptor.connect_handler
+#   {"queue_id": ..., "deleted": true}   a garbage-collected queue
+#   {"shutdown": true}                   the final record after a clean shutdown
+#
+# Each event payload is written once per checkpoint, however many
+# queues it was pushed to.  A log which does not end with the shutdown
+# record (e.g. because Tornado crashed) is discarded on load, since
+# events may have been lost since the last checkpoint.  Once the log
+# has grown to more than twice its size when last compacted, it is
+# compacted by rewriting it with the full state of each queue; this
+# keeps the time spent compacting proportional to the time spent
+# appending.
+EVENT_QUEUE_CHECKPOINT_FREQ_MSECS = 1000 * 60 * 1
+EVENT_QUEUE_LOG_COMPACTION_SLACK_BYTES = 64 * 1024 * 1024
+SHUTDOWN_RECORD = orjson.dumps({"shutdown": True}, option=orjson.OPT_APPEND_NEWLINE)
+
+# The size of the log on disk, and its size when last compacted; None
+# if the log on disk does not match the in-memory state, and must be
+# rewritten in full.
+event_queue_log_bytes: int | None = None
+event_queue_log_compacted_bytes = 0
+
+
+def event_queue_change_records(changes: Iterable[tuple[str, str, Any]]) -> Iterator[bytes]:
+    payload_numbers: dict[int, int] = {}
+    for queue_id, operation, argument in changes:
+        if operation == "push":
+            # Event payloads are never mutated once pushed, and are
+            # kept alive by event_queue_changes, so their id() is a
+            # key for the payload.
+            payload_number = payload_numbers.get(id(argument))
+            if payload_number is None:
+                payload_number = payload_numbers[id(argument)] = len(payload_numbers)
+                yield orjson.dumps(
+                    {"payload": payload_number, "event": argument},
+                    option=orjson.OPT_APPEND_NEWLINE,
+                )
+            argument = payload_number
+        elif operation == "client":
+            argument = orjson.Fragment(argument)
+        elif argument is None:
+            argument = True
+        yield orjson.dumps(
+            {"queue_id": queue_id, operation: argument}, option=orjson.OPT_APPEND_NEWLINE
         )
 
-    if len(clients) > 0 or settings.PRODUCTION:
+
+def compact_event_queue_log(port: int, shutdown: bool) -> int:
+    global event_queue_log_bytes, event_queue_log_compacted_bytes
+    filename = persistent_queue_filename(port)
+    log_bytes = 0
+    with open(filename + ".tmp", "wb") as stored_queues:
+        for qid, client in clients.items():
+            log_bytes += stored_queues.write(
+                orjson.dumps(
+                    {"queue_id": qid, "client": client.to_dict()},
+                    option=orjson.OPT_APPEND_NEWLINE,
+                )
+            )
+        if shutdown:
+            stored_queues.write(SHUTDOWN_RECORD)
+
+    # Keep the previous log around for debugging.
+    with suppress(FileNotFoundError):
+        os.replace(filename, persistent_queue_filename(port, last=True))
+    os.replace(filename + ".tmp", filename)
+    event_queue_log_bytes = event_queue_log_compacted_bytes = log_bytes
+    return len(clients)
+
+
+def append_event_queue_log(port: int, shutdown: bool, changes: list[tuple[str, str, Any]]) -> int:
+    global event_queue_log_bytes
+    assert event_queue_log_bytes is not None
+    with open(persistent_queue_filename(port), "ab") as stored_queues:
+        for record in event_queue_change_records(changes):
+            event_queue_log_bytes += stored_queues.write(record)
+        if shutdown:
+            stored_queues.write(SHUTDOWN_RECORD)
+    return len(changes)
+
+
+def checkpoint_event_queues(port: int, shutdown: bool = False) -> None:
+    global event_queue_changes
+    if event_queue_changes is None:
+        # The queues weren't loaded, so we would overwrite the log.
+        return
+    start = time.perf_counter()
+    changes = event_queue_changes
+    event_queue_changes = []
+    if (
+        event_queue_log_bytes is None
+        or event_queue_log_bytes
+        > 2 * event_queue_log_compacted_bytes + EVENT_QUEUE_LOG_COMPACTION_SLACK_BYTES
+    ):
+        written = compact_event_queue_log(port, shutdown)
+        description = "event queues"
+    else:
+        written = append_event_queue_log(port, shutdown, changes)
+        description = "changes to event queues"
+
+    if written > 0 and (shutdown or settings.PRODUCTION):
         logging.info(
-            "Tornado %d dumped %d event queues in %.3fs",
+            "Tornado %d wrote %d %s in %.3fs",
             port,
-            len(clients),
+            written,
+            description,
             time.perf_counter() - start,
         )
 
 
+def dump_event_queues(port: int) -> None:
+    checkpoint_event_queues(port, shutdown=True)
+
+
+def replay_event_queue_record(
+    queues: dict[str, ClientDescriptor],
+    payloads: Mapping[int, dict[str, Any]],
+    record: dict[str, Any],
+) -> None:
+    queue_id = record["queue_id"]
+    if "client" in record:
+        queues[queue_id] = ClientDescriptor.from_dict(record["client"])
+        return
+    if "deleted" in record:
+        queues.pop(queue_id, None)
+        return
+
+    client = queues[queue_id]
+    if "push" in record:
+        client.event_queue.push(payloads[record["push"]])
+    elif "prune" in record:
+        client.event_queue.prune(record["prune"])
+    elif "resolve" in record:
+        client.event_queue.resolved_events()
+    else:
+        client.last_connection_time = record["connect"]
+
+
+def read_event_queue_log(port: int) -> dict[str, ClientDescriptor] | None:
+    global event_queue_log_bytes, event_queue_log_compacted_bytes
+    filename = persistent_queue_filename(port)
+    with open(filename, "rb") as stored_queues:
+        if stored_queues.read(1) == b"[":
+            # TODO/compatibility: Queues dumped by older versions of
+            # Zulip, as a single JSON list of (queue_id, client) pairs.
+            # We move it out of the way, so that it is not loaded
+            # again if we crash before writing our own log.
+            stored_queues.seek(0)
+            legacy_data = orjson.loads(stored_queues.read())
+            os.replace(filename, persistent_queue_filename(port, last=True))
+            return {qid: ClientDescriptor.from_dict(client) for qid, client in legacy_data}
+        stored_queues.seek(0)
+
+        queues: dict[str, ClientDescriptor] = {}
+        payloads: dict[int, dict[str, Any]] = {}
+        offset = 0
+        shutdown_offset = None
+        for line in stored_queues:
+            record = orjson.loads(line)
+            if "shutdown" in record:
+                shutdown_offset = offset
+            elif "payload" in record:
+                payloads[record["payload"]] = record["event"]
+                shutdown_offset = None
+            else:
+                replay_event_queue_record(queues, payloads, record)
+                shutdown_offset = None
+            offset += len(line)
+
+    if shutdown_offset is None:
+        logging.warning("Tornado %d discarding event queues after unclean shutdown", port)
+        return None
+
+    # Remove the shutdown record, so that if we do not shut down
+    # cleanly, we do not load the same queues again; we continue
+    # appending to this log from here.
+    os.truncate(filename, shutdown_offset)
+    event_queue_log_bytes = event_queue_log_compacted_bytes = shutdown_offset
+    return queues
+
+
 def load_event_queues(port: int) -> None:
-    global clients
+    global clients, event_queue_changes, event_queue_log_bytes
     start = time.perf_counter()
+    # Replaying the log must not record the changes again.
+    event_queue_changes = None
+    event_queue_log_bytes = None
 
     try:
-        with open(persistent_queue_filename(port), "rb") as stored_queues:
-            data = orjson.loads(stored_queues.read())
+        loaded_clients = read_event_queue_log(port)
     except FileNotFoundError:
         pass
-    except orjson.JSONDecodeError:
+    except Exception:
         logging.exception("Tornado %d could not deserialize event queues", port, stack_info=True)
+        event_queue_log_bytes = None
     else:
-        try:
-            clients = {qid: ClientDescriptor.from_dict(client) for (qid, client) in data}
-        except Exception:
-            logging.exception(
-                "Tornado %d could not deserialize event queues", port, stack_info=True
-            )
+        if loaded_clients is not None:
+            clients = loaded_clients
 
     mark_clients_to_reload(clients.keys())
 
@@ -634,6 +1071,7 @@ def load_event_queues(port: int) -> None:
 
         add_to_client_dicts(client)
 
+    event_queue_changes = []
     if len(clients) > 0 or settings.PRODUCTION:
         logging.info(
             "Tornado %d loaded %d event queues in %.3fs",
@@ -643,14 +1081,75 @@ def load_event_queues(port: int) -> None:
         )
 
 
-def send_restart_events() -> None:
-    event: dict[str, Any] = dict(
+def migrate_event_queues(port: int, realm_ports: Mapping[int, list[int]]) -> None:
+    """Hands off the loaded event queues of users which the sharding
+    configuration now assigns to a different Tornado port (see
+    get_user_id_tornado_port) to that port, via its notify_tornado
+    queue, so that they survive a change to the sharding layout.
+
+    Events sent to a migrated user before their new port has processed
+    the handoff are not delivered to the migrated queue; since this only
+    happens when restarting with a new sharding layout, where every
+    client is about to be reloaded anyway, that is acceptable.
+    """
+    migrations: list[tuple[int, dict[str, Any]]] = []
+    to_remove: set[str] = set()
+    affected_users: set[int] = set()
+    affected_realms: set[int] = set()
+    for id, client in clients.items():
+        if client.realm_id not in realm_ports:
+            # The realm was deleted; the queue will be garbage-collected.
+            continue
+        new_port = get_user_id_tornado_port(realm_ports[client.realm_id], client.user_profile_id)
+        if new_port == port:
+            continue
+        migrations.append((new_port, client.to_dict()))
+        to_remove.add(id)
+        affected_users.add(client.user_profile_id)
+        affected_realms.add(client.realm_id)
+
+    # This runs before any GC hooks are registered, so the migrated
+    # queues' users don't get missed-message notifications here.
+    do_gc_event_queues(to_remove, affected_users, affected_realms)
+
+    for new_port, client_dict in migrations:
+        queue_json_publish(
+            notify_tornado_queue_name(new_port),
+            dict(
+                event=dict(type="migrate_event_queue", client=client_dict),
+                users=[client_dict["user_profile_id"]],
+            ),
+            partial(send_notification_http, new_port),
+        )
+    if migrations:
+        logging.info("Tornado %d migrated %d event queues to other ports", port, len(migrations))
+
+
+def adopt_migrated_event_queue(client_dict: Mapping[str, Any]) -> None:
+    client = ClientDescriptor.from_dict(client_dict)
+    if client.event_queue.id in clients:
+        return
+    clients[client.event_queue.id] = client
+    add_to_client_dicts(client)
+    record_event_queue_change(client.event_queue.id, "client", orjson.dumps(client.to_dict()))
+    mark_clients_to_reload([client.event_queue.id])
+    event = create_restart_event()
+    if client.accepts_event(event):
+        client.add_event(event)
+
+
+def create_restart_event() -> dict[str, Any]:
+    return dict(
         type="restart",
         zulip_version=ZULIP_VERSION,
         zulip_merge_base=ZULIP_MERGE_BASE,
         zulip_feature_level=API_FEATURE_LEVEL,
         server_generation=settings.SERVER_GENERATION,
     )
+
+
+def send_restart_events() -> None:
+    event = create_restart_event()
     for client in clients.values():
         if client.accepts_event(event):
             client.add_event(event)
@@ -690,10 +1189,19 @@ async def setup_event_queue(
 ) -> None:
     if not settings.TEST_SUITE:
         load_event_queues(port)
+        if settings.TORNADO_PROCESSES > 1:
+            realm_ports = await sync_to_async(get_realm_ids_tornado_ports, thread_sensitive=True)(
+                {client.realm_id for client in clients.values()}
+            )
+            migrate_event_queues(port, realm_ports)
         autoreload.add_reload_hook(lambda: dump_event_queues(port))
 
-    with suppress(OSError):
-        os.rename(persistent_queue_filename(port), persistent_queue_filename(port, last=True))
+        # Periodically write changed queues to the log, so that the
+        # final dump on shutdown only has a little left to write.
+        checkpoint = tornado.ioloop.PeriodicCallback(
+            lambda: checkpoint_event_queues(port), EVENT_QUEUE_CHECKPOINT_FREQ_MSECS
+        )
+        checkpoint.start()
 
     # Set up event queue garbage collection
     pc = tornado.ioloop.PeriodicCallback(lambda: gc_event_queues(port), EVENT_QUEUE_GC_FREQ_MSECS)
@@ -750,17 +1258,16 @@ def fetch_events(
             was_connected = client.finish_current_handler()
 
         if not client.event_queue.empty() or dont_block:
+            events = client.event_queue.resolved_events()
             response: dict[str, Any] = dict(
-                events=client.event_queue.contents(),
+                events=[event.to_json_fragment() for event in events],
             )
             if orig_queue_id is None:
                 response["queue_id"] = queue_id
-            if len(response["events"]) == 1:
-                extra_log_data = "[{}/{}/{}]".format(
-                    queue_id, len(response["events"]), response["events"][0]["type"]
-                )
+            if len(events) == 1:
+                extra_log_data = "[{}/{}/{}]".format(queue_id, len(events), events[0].type)
             else:
-                extra_log_data = "[{}/{}]".format(queue_id, len(response["events"]))
+                extra_log_data = "[{}/{}]".format(queue_id, len(events))
             if was_connected:
                 extra_log_data += " [was connected]"
             return dict(type="response", response=response, extra_log_data=extra_log_data)
@@ -1010,10 +1517,16 @@ def get_client_info_for_message_event(
         return (sender_queue_id is not None) and client.event_queue.id == sender_queue_id
 
     # If we're on a public stream, look for clients (typically belonging to
-    # bots) that are registered to get events for ALL streams.
+    # bots) that are registered to get events for ALL streams, or for
+    # a narrow including this stream.
     if "stream_name" in event_template and not event_template.get("invite_only"):
         realm_id = event_template["realm_id"]
-        for client in get_client_descriptors_for_realm_all_streams(realm_id):
+        narrowed_clients = get_client_descriptors_for_stream_narrows(
+            realm_id,
+            event_template["stream_name"],
+            get_topic_from_message_info(event_template["message_dict"]),
+        )
+        for client in get_client_descriptors_for_realm_all_streams(realm_id) + narrowed_clients:
             send_to_clients[client.event_queue.id] = dict(
                 client=client,
                 flags=[],
@@ -1190,6 +1703,9 @@ def process_message_event(
             )
         )
 
+    user_events: dict[
+        tuple[int, bool, bool, bool, bool, bool, tuple[str, ...]], dict[str, Any]
+    ] = {}
     for client_data in send_to_clients.values():
         client = client_data["client"]
         flags = client_data["flags"]
@@ -1203,23 +1719,40 @@ def process_message_event(
             continue
 
         can_access_sender = client.user_profile_id not in user_ids_without_access_to_sender
-        message_dict = get_client_payload(
-            client.apply_markdown, client.client_gravatar, can_access_sender
+        # Make sure Zephyr mirroring bots know whether stream is invite-only
+        invite_only_stream = "mirror" in client.client_type_name and bool(
+            event_template.get("invite_only")
         )
 
-        # Make sure Zephyr mirroring bots know whether stream is invite-only
-        if "mirror" in client.client_type_name and event_template.get("invite_only"):
-            message_dict = message_dict.copy()
-            message_dict["invite_only_stream"] = True
+        # Event queues store events by reference, so all of a user's
+        # clients with the same formatting options share one event.
+        user_event_key = (
+            client.user_profile_id,
+            client.apply_markdown,
+            client.client_gravatar,
+            can_access_sender,
+            invite_only_stream,
+            is_sender,
+            tuple(flags),
+        )
+        user_event = user_events.get(user_event_key)
+        if user_event is None:
+            message_dict = get_client_payload(
+                client.apply_markdown, client.client_gravatar, can_access_sender
+            )
+            if invite_only_stream:
+                message_dict = message_dict.copy()
+                message_dict["invite_only_stream"] = True
 
-        user_event: dict[str, Any] = dict(type="message", message=message_dict, flags=flags)
-        if extra_data is not None:
-            user_event.update(extra_data)
+            user_event = dict(type="message", message=message_dict, flags=flags)
+            if extra_data is not None:
+                user_event.update(extra_data)
 
-        if is_sender:
-            local_message_id = event_template.get("local_id", None)
-            if local_message_id is not None:
-                user_event["local_message_id"] = local_message_id
+            if is_sender:
+                local_message_id = event_template.get("local_id", None)
+                if local_message_id is not None:
+                    user_event["local_message_id"] = local_message_id
+            user_events[user_event_key] = user_event
 
         if not client.accepts_event(user_event):
             continue
@@ -1617,6 +2150,10 @@ def process_notification(notice: Mapping[str, Any]) -> None:
         # event sent for updating name separately for clients with different
         # capabilities.
         process_user_group_name_update_event(event, cast(list[int], users))
+    elif event["type"] == "migrate_event_queue":
+        # migrate_event_queues sends these when the sharding layout
+        # has moved a user's event queues to this port.
+        adopt_migrated_event_queue(event["client"])
     elif event["type"] == "cleanup_queue":
         # cleanup_event_queue may generate this event to forward cleanup
         # requests to the right shard.
@@ -1639,6 +2176,30 @@ def process_notification(notice: Mapping[str, Any]) -> None:
     )
 
 
+@contextmanager
+def finish_handlers_after_batch() -> Iterator[None]:
+    """Defers finishing the long-polling handlers of clients which
+    receive events until the end of the block, so that a client which
+    receives several events from a batch of notices gets all of them
+    in a single response, rather than having to reconnect between
+    each of them.
+    """
+    global clients_to_finish
+    if clients_to_finish is not None:
+        # Already inside a batch.
+        yield
+        return
+
+    clients_to_finish = {}
+    try:
+        yield
+    finally:
+        batch_clients = clients_to_finish
+        clients_to_finish = None
+        for client in batch_clients.values():
+            client.finish_current_handler()
+
+
 def get_wrapped_process_notification(queue_name: str) -> Callable[[list[dict[str, Any]]], None]:
     def failure_processor(notice: dict[str, Any]) -> None:
         logging.error(
@@ -1648,10 +2209,14 @@ def get_wrapped_process_notification(queue_name: str) -> Callable[[list[dict[str
         )
 
     def wrapped_process_notification(notices: list[dict[str, Any]]) -> None:
-        for notice in notices:
-            try:
-                process_notification(notice)
-            except Exception:
-                retry_event(queue_name, notice, failure_processor)
+        with finish_handlers_after_batch():
+            for batch in notices:
+                # send_events_rollback_unsafe may combine several
+                # notices into one; they're retried individually.
+                for notice in batch.get("notices", [batch]):
+                    try:
+                        process_notification(notice)
+                    except Exception:
+                        retry_event(queue_name, notice, failure_processor)
 
     return wrapped_process_notification
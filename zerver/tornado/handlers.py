@@ -1,9 +1,10 @@
 import logging
-from collections.abc import Collection
+from collections.abc import Collection, Sequence
 from contextlib import suppress
 from typing import Any, Optional
 from urllib.parse import unquote
 
+import orjson
 import tornado.web
 from asgiref.sync import sync_to_async
 from django import http
@@ -46,7 +47,18 @@ def handler_stats_string() -> str:
     return f"{len(handlers)} handlers, latest ID {current_handler_id}"
 
 
-def finish_handler(handler_id: int, event_queue_id: str, contents: list[dict[str, Any]]) -> None:
+def finish_handler(
+    handler_id: int,
+    event_queue_id: str,
+    contents: list[orjson.Fragment],
+    event_types: Sequence[str],
+) -> None:
+    """Completes a long-polling get_events request with the given events.
+
+    The events are passed pre-serialized (see
+    QueuedEvent.to_json_fragment), so that they are spliced directly
+    into the response; event_types is only used for logging.
+    """
     try:
         # We do the import during runtime to avoid cyclic dependency
         # with zerver.lib.request
@@ -71,7 +83,7 @@ def finish_handler(handler_id: int, event_queue_id: str, contents: list[dict[str
         if len(contents) != 1:
             log_data["extra"] = f"[{event_queue_id}/1]"
         else:
-            log_data["extra"] = "[{}/1/{}]".format(event_queue_id, contents[0]["type"])
+            log_data["extra"] = "[{}/1/{}]".format(event_queue_id, event_types[0])
 
         tornado.ioloop.IOLoop.current().add_callback(
             handler.zulip_finish,
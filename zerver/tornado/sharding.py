@@ -1,6 +1,7 @@
 import json
 import os
 import re
+from collections.abc import Iterable
 from re import Pattern
 
 from django.conf import settings
@@ -34,8 +35,31 @@ def get_realm_tornado_ports(realm: Realm) -> list[int]:
     return [settings.TORNADO_PORTS[0]]
 
 
+def get_realm_ids_tornado_ports(realm_ids: Iterable[int]) -> dict[int, list[int]]:
+    return {
+        realm.id: get_realm_tornado_ports(realm) for realm in Realm.objects.filter(id__in=realm_ids)
+    }
+
+
+def tornado_port_weight(port: int, user_id: int) -> int:
+    # A cheap 64-bit mix (the splitmix64 finalizer) of the port and
+    # user ID; this only needs to be stable and well-distributed.
+    x = (user_id * 0x9E3779B97F4A7C15 + port) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+
 def get_user_id_tornado_port(realm_ports: list[int], user_id: int) -> int:
-    return realm_ports[user_id % len(realm_ports)]
+    # We use rendezvous hashing to split a realm's users between its
+    # ports: each user goes to the port with the highest weight for
+    # them.  Unlike taking the user ID modulo the number of ports,
+    # adding a port to a realm only moves the users which it takes
+    # over, and removing one only moves the users which it had;
+    # load_event_queues migrates those users' event queues.
+    if len(realm_ports) == 1:
+        return realm_ports[0]
+    return max(realm_ports, key=lambda port: tornado_port_weight(port, user_id))
 
 
 def get_user_tornado_port(user: UserProfile) -> int:
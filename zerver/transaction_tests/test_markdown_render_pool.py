@@ -0,0 +1,43 @@
+from unittest import mock
+
+import bmemcached
+
+from zerver.lib.markdown.render_pool import render_messages_in_parallel
+from zerver.lib.test_classes import ZulipTransactionTestCase
+from zerver.models import Message
+from zerver.models.realms import get_realm
+
+
+class MarkdownRenderPoolTest(ZulipTransactionTestCase):
+    def test_render_messages_in_parallel(self) -> None:
+        # The forked workers open their own database connections, so
+        # only see committed rows; we render the test database's
+        # existing messages, without changing them.
+        realm = get_realm("zulip")
+        message_ids = list(
+            Message.objects.filter(realm=realm).order_by("id").values_list("id", flat=True)[:7]
+        )
+        self.assert_length(message_ids, 7)
+
+        # The test suite uses a local memory cache rather than memcached.
+        with mock.patch("zerver.lib.markdown.render_pool.cache") as mock_cache:
+            mock_cache._cache = mock.Mock(spec=bmemcached.Client)
+            rendered = list(
+                render_messages_in_parallel(
+                    [(message_id, f"**{i}**") for i, message_id in enumerate(message_ids)],
+                    processes=2,
+                    realm_ids=[realm.id],
+                    batch_size=1,
+                )
+            )
+        mock_cache._cache.disconnect_all.assert_called_once()
+
+        # With one message per batch, more batches were rendered than
+        # are outstanding at a time; each is still in the original order.
+        self.assertEqual(
+            rendered,
+            [
+                (message_id, f"<p><strong>{i}</strong></p>")
+                for i, message_id in enumerate(message_ids)
+            ],
+        )
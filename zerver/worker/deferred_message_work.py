@@ -0,0 +1,78 @@
+# Documented in https://zulip.readthedocs.io/en/latest/subsystems/queuing.html
+import logging
+from collections.abc import Mapping
+from typing import Any
+
+from typing_extensions import override
+
+from zerver.actions.message_send import follow_topic_for_mentioned_users, get_service_bot_events
+from zerver.lib.message_cache import MessageDict
+from zerver.lib.queue import queue_json_publish
+from zerver.models import Message, Stream
+from zerver.worker.base import QueueProcessingWorker, assign_queue
+
+logger = logging.getLogger(__name__)
+
+
+@assign_queue("deferred_message_work")
+class DeferredMessageWorker(QueueProcessingWorker):
+    """With settings.DEFER_MESSAGE_SEND_WORK, do_send_messages leaves
+    the work which doesn't affect how a message is delivered to this
+    queue, to reduce the latency of sending messages.  Unlike the
+    deferred_work queue, events here should be processed promptly,
+    since they trigger bots and link previews.
+    """
+
+    @override
+    def consume(self, event: Mapping[str, Any]) -> None:
+        for deferred_work in event["messages"]:
+            if "follow_topic" in deferred_work:
+                follow_topic = deferred_work["follow_topic"]
+                try:
+                    stream = Stream.objects.get(id=follow_topic["stream_id"])
+                except Stream.DoesNotExist:
+                    logger.info("Stream %s no longer exists", follow_topic["stream_id"])
+                else:
+                    follow_topic_for_mentioned_users(
+                        stream, follow_topic["topic_name"], set(follow_topic["user_ids"])
+                    )
+
+            if "embed_links" in deferred_work:
+                queue_json_publish("embed_links", deferred_work["embed_links"])
+
+            if "service_bots" in deferred_work:
+                self.trigger_service_bots(
+                    deferred_work["message_id"], deferred_work["service_bots"]
+                )
+
+    def trigger_service_bots(self, message_id: int, service_bots: Mapping[str, Any]) -> None:
+        try:
+            message = Message.objects.select_related("sender", "recipient").get(id=message_id)
+        except Message.DoesNotExist:
+            logger.info("Message %s no longer exists", message_id)
+            return
+
+        service_queue_events = get_service_bot_events(
+            sender=message.sender,
+            service_bot_tuples=[
+                (user_id, bot_type) for user_id, bot_type in service_bots["service_bot_tuples"]
+            ],
+            mentioned_user_ids=set(service_bots["mentioned_user_ids"]),
+            active_user_ids=set(service_bots["active_user_ids"]),
+            recipient_type=message.recipient.type,
+        )
+        if not service_queue_events:
+            return
+
+        realm_id = message.realm_id if message.is_stream_message() else None
+        wide_message_dict = MessageDict.wide_dict(message, realm_id)
+        for queue_name, events in service_queue_events.items():
+            for service_event in events:
+                queue_json_publish(
+                    queue_name,
+                    {
+                        "message": wide_message_dict,
+                        "trigger": service_event["trigger"],
+                        "user_profile_id": service_event["user_profile_id"],
+                    },
+                )
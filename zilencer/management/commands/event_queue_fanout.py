@@ -0,0 +1,104 @@
+import random
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.tornado.event_queue import (
+    allocate_client_descriptor,
+    clients,
+    get_client_info_for_message_event,
+)
+
+
+class Command(ZulipBaseCommand):
+    help = """Times finding the event queues which should receive a stream message,
+with many synthetic event queues allocated in this process."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--queues", help="Number of event queues", default=100000, type=int)
+        parser.add_argument("--streams", help="Number of streams", default=1000, type=int)
+        parser.add_argument(
+            "--subscribers", help="Number of users subscribed to the stream", default=1000, type=int
+        )
+        parser.add_argument(
+            "--narrowed",
+            help="Fraction of queues narrowed to a stream (half of those to a topic)",
+            default=0.5,
+            type=float,
+        )
+        parser.add_argument(
+            "--all-public-streams",
+            help="Fraction of queues receiving all public stream messages",
+            default=0.01,
+            type=float,
+        )
+        parser.add_argument("--reps", help="Number of messages to deliver", default=100, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        rng = random.Random(0)
+        realm_id = 1
+        for user_id in range(options["queues"]):
+            narrow: list[list[str]] = []
+            all_public_streams = False
+            kind = rng.random()
+            if kind < options["narrowed"]:
+                narrow = [["channel", f"stream {rng.randrange(options['streams'])}"]]
+                if kind < options["narrowed"] / 2:
+                    narrow.append(["topic", f"topic {rng.randrange(10)}"])
+            elif kind < options["narrowed"] + options["all_public_streams"]:
+                all_public_streams = True
+            allocate_client_descriptor(
+                dict(
+                    all_public_streams=all_public_streams,
+                    apply_markdown=True,
+                    client_gravatar=True,
+                    client_type_name="benchmark",
+                    event_types=["message"],
+                    last_connection_time=0,
+                    queue_timeout=0,
+                    realm_id=realm_id,
+                    user_profile_id=user_id,
+                    narrow=narrow,
+                )
+            )
+
+        message_dict = dict(
+            type="stream",
+            display_recipient="stream 0",
+            subject="topic 0",
+            sender_email="sender@example.com",
+        )
+        event_template = dict(
+            type="message",
+            realm_id=realm_id,
+            stream_name="stream 0",
+            message_dict=message_dict,
+        )
+        users = [
+            dict(id=user_id, flags=[])
+            for user_id in rng.sample(range(options["queues"]), options["subscribers"])
+        ]
+
+        considered = 0
+        accepted = 0
+
+        def deliver() -> None:
+            nonlocal considered, accepted
+            send_to_clients = get_client_info_for_message_event(event_template, users)
+            considered = len(send_to_clients)
+            accepted = sum(
+                client_info["client"].narrow_predicate(message=message_dict, flags=[])
+                for client_info in send_to_clients.values()
+            )
+
+        duration = timeit(deliver, number=options["reps"])
+        print(f"{len(clients)} queues; each message considered {considered}, accepted {accepted}")
+        print(
+            f"{options['reps']} messages in {duration:.3f}s = "
+            f"{1000 * duration / options['reps']:.3f}ms/message"
+        )
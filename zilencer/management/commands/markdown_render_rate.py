@@ -0,0 +1,290 @@
+import random
+import statistics
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from time import perf_counter
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandError, CommandParser
+from django.test import override_settings
+from typing_extensions import override
+
+from zerver.lib.alert_words import get_alert_word_automaton
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.markdown import ZulipMarkdown, markdown_convert, md_engines
+from zerver.lib.markdown import version as markdown_version
+from zerver.models import NamedUserGroup, Realm, Stream, UserProfile
+
+# (stage, name, priority) for each Markdown processor we time.
+ProcessorKey = tuple[str, str, float]
+
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "a", "lazy", "dog", "while", "we", "ship"]
+
+
+def build_corpus(realm: Realm) -> dict[str, list[str]]:
+    """Generates, deterministically, a few kinds of message content
+    which stress different parts of the Markdown processor; the
+    mentions refer to the realm's actual users, groups, and channels."""
+    rng = random.Random(0)
+
+    def sentence(length: int = 12) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+    user_names = list(
+        UserProfile.objects.filter(realm=realm, is_active=True, is_bot=False)
+        .order_by("id")
+        .values_list("full_name", flat=True)[:50]
+    ) or ["Nobody"]
+    group_names = list(
+        NamedUserGroup.objects.filter(realm=realm, is_system_group=False, deactivated=False)
+        .order_by("id")
+        .values_list("name", flat=True)[:10]
+    ) or ["nobody"]
+    stream_names = list(
+        Stream.objects.filter(realm=realm, deactivated=False)
+        .order_by("id")
+        .values_list("name", flat=True)[:20]
+    ) or ["nowhere"]
+
+    corpus: dict[str, list[str]] = defaultdict(list)
+    for i in range(20):
+        corpus["plain"].append(
+            f"{sentence()} **{sentence(3)}** and *{sentence(2)}* with `code {i}`.\n\n{sentence()}"
+        )
+        corpus["code"].append(
+            "```python\n"
+            + "\n".join(
+                f"def function_{j}(x: int) -> int:\n    return x * {j}  # {j}" for j in range(20)
+            )
+            + "\n```\n"
+            + sentence()
+            + "\n```js\n"
+            + "\n".join(f"const value{j} = [{j}, '{j}'].map((x) => x + {j});" for j in range(20))
+            + "\n```"
+        )
+        corpus["links"].append(
+            " ".join(
+                f"{sentence(4)} https://example.com/{i}/{j}?q={j} [link {j}](https://zulip.example.org/{j}) zulip.com/{j}"
+                for j in range(10)
+            )
+        )
+        corpus["mentions"].append(
+            " ".join(
+                f"@**{rng.choice(user_names)}** @_**{rng.choice(user_names)}** "
+                f"@*{rng.choice(group_names)}* #**{rng.choice(stream_names)}** "
+                f"#**{rng.choice(stream_names)}>{sentence(2)}** {sentence(4)}"
+                for _ in range(5)
+            )
+        )
+        corpus["emoji"].append(
+            " ".join(
+                f":{rng.choice(['smile', '+1', 'tada', 'heart', 'octopus', 'rocket', 'thinking'])}: 🎉 :) {rng.choice(WORDS)}"
+                for _ in range(30)
+            )
+        )
+        corpus["table"].append(
+            "| "
+            + " | ".join(f"Column {j}" for j in range(6))
+            + " |\n|"
+            + "---|" * 6
+            + "\n"
+            + "\n".join(
+                "| " + " | ".join(f"**{row}** `{j}` {rng.choice(WORDS)}" for j in range(6)) + " |"
+                for row in range(100)
+            )
+        )
+        corpus["nesting"].append(
+            "\n".join("> " * depth + sentence(4) for depth in range(1, 30))
+            + "\n\n"
+            + "\n".join("  " * depth + f"* {sentence(3)}" for depth in range(30))
+            + "\n\n"
+            + "*" * 200
+            + "_a" * 200
+        )
+    return corpus
+
+
+class TimedRegex:
+    """Wraps a compiled regex which a Markdown inline pattern uses, to
+    count the time spent searching with it."""
+
+    def __init__(self, regex: Any, add_time: Callable[[float], None]) -> None:
+        self.regex = regex
+        self.add_time = add_time
+
+    def match(self, *args: Any) -> Any:
+        start = perf_counter()
+        try:
+            return self.regex.match(*args)
+        finally:
+            self.add_time(perf_counter() - start)
+
+    def finditer(self, *args: Any) -> Iterator[Any]:
+        matches = self.regex.finditer(*args)
+        while True:
+            start = perf_counter()
+            match = next(matches, None)
+            self.add_time(perf_counter() - start)
+            if match is None:
+                return
+            yield match
+
+
+def instrument_md_engine(md_engine: ZulipMarkdown, timings: dict[ProcessorKey, float]) -> None:
+    def add_time_to(key: ProcessorKey) -> Callable[[float], None]:
+        def add_time(duration: float) -> None:
+            timings[key] += duration
+
+        return add_time
+
+    def timed(function: Callable[..., Any], key: ProcessorKey) -> Callable[..., Any]:
+        add_time = add_time_to(key)
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_time(perf_counter() - start)
+
+        return wrapper
+
+    for stage, registry in [
+        ("preprocessor", md_engine.preprocessors),
+        ("blockprocessor", md_engine.parser.blockprocessors),
+        ("inlinepattern", md_engine.inlinePatterns),
+        ("treeprocessor", md_engine.treeprocessors),
+        ("postprocessor", md_engine.postprocessors),
+    ]:
+        # Registry doesn't otherwise expose the priorities.
+        for name, priority in registry._priority:
+            processor = registry[name]
+            key = (stage, name, priority)
+            timings[key] = 0.0
+            if stage == "inlinepattern":
+                # The inline treeprocessor searches with the pattern's
+                # regex, then calls handleMatch on each match.
+                regex = TimedRegex(processor.getCompiledRegExp(), add_time_to(key))
+                processor.getCompiledRegExp = lambda regex=regex: regex  # type: ignore[method-assign]
+                processor.handleMatch = timed(processor.handleMatch, key)  # type: ignore[method-assign]
+            else:
+                processor.run = timed(processor.run, key)  # type: ignore[method-assign]
+
+
+class Command(ZulipBaseCommand):
+    help = """Times rendering a generated corpus of message content, of a few kinds
+which stress different parts of the Markdown processor, through markdown_convert.
+
+Reports the p50 and p99 rendering time and peak memory for each kind of
+content, and the time spent in each Markdown processor.  With
+--baseline, fails if any kind of content renders more slowly, or uses
+more memory, than in the baseline (as written by --save-baseline on
+the same machine) by more than --max-slowdown."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--reps", help="Renderings of each message", default=5, type=int)
+        parser.add_argument("--baseline", help="Path of a baseline to compare against")
+        parser.add_argument("--save-baseline", help="Path to write the results to, as a baseline")
+        parser.add_argument(
+            "--max-slowdown",
+            help="Allowed fractional increase over the baseline",
+            default=0.25,
+            type=float,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        automaton = get_alert_word_automaton(realm)
+        corpus = build_corpus(realm)
+
+        def render(content: str) -> None:
+            markdown_convert(content, realm_alert_words_automaton=automaton, message_realm=realm)
+
+        results: dict[str, dict[str, float]] = {}
+        timings: dict[ProcessorKey, float] = {}
+        # Repeated renderings should do the work each time.
+        with override_settings(MARKDOWN_RENDER_CACHE=False):
+            # Build the Markdown engine, and warm the caches.
+            for messages in corpus.values():
+                for content in messages:
+                    render(content)
+
+            for category, messages in corpus.items():
+                durations = []
+                for content in messages:
+                    for _ in range(options["reps"]):
+                        start = perf_counter()
+                        render(content)
+                        durations.append(perf_counter() - start)
+
+                tracemalloc.start()
+                peak_memory = 0
+                for content in messages:
+                    tracemalloc.reset_peak()
+                    current, _ = tracemalloc.get_traced_memory()
+                    render(content)
+                    peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1] - current)
+                tracemalloc.stop()
+
+                results[category] = {
+                    "p50_ms": 1000 * statistics.median(durations),
+                    "p99_ms": 1000 * statistics.quantiles(durations, n=100)[98],
+                    "peak_memory_kib": peak_memory / 1024,
+                }
+
+            # Instrumenting adds overhead, so we time the processors
+            # in a separate pass.
+            instrument_md_engine(md_engines[(realm.id, False)], timings)
+            start = perf_counter()
+            for messages in corpus.values():
+                for content in messages:
+                    render(content)
+            total_time = perf_counter() - start
+
+        print(f"{'Content':<10} {'p50 ms':>10} {'p99 ms':>10} {'peak KiB':>10}")
+        for category, result in results.items():
+            print(
+                f"{category:<10} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f} "
+                f"{result['peak_memory_kib']:>10.1f}"
+            )
+        print()
+        print("Time in each processor; the inline treeprocessor's includes the inline patterns'.")
+        print(f"{'Stage':<15} {'Processor':<30} {'Priority':>8} {'ms':>10} {'%':>6}")
+        for (stage, name, priority), duration in sorted(
+            timings.items(), key=lambda item: item[1], reverse=True
+        ):
+            print(
+                f"{stage:<15} {name:<30} {priority:>8} {1000 * duration:>10.2f} "
+                f"{100 * duration / total_time:>6.1f}"
+            )
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "wb") as f:
+                f.write(
+                    orjson.dumps(
+                        {"markdown_version": markdown_version, "results": results},
+                        option=orjson.OPT_INDENT_2,
+                    )
+                )
+
+        if options["baseline"]:
+            with open(options["baseline"], "rb") as f:
+                baseline = orjson.loads(f.read())["results"]
+            # The p99 times are too noisy to compare.
+            regressions = [
+                f"{category} {measure}: {results[category][measure]:.3f}, baseline {value:.3f}"
+                for category, baseline_result in baseline.items()
+                if category in results
+                for measure, value in baseline_result.items()
+                if measure in ("p50_ms", "peak_memory_kib")
+                and results[category][measure] > value * (1 + options["max_slowdown"])
+            ]
+            if regressions:
+                raise CommandError("Markdown rendering regressed:\n" + "\n".join(regressions))
+            print("\nNo regressions from the baseline.")
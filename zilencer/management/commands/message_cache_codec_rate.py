@@ -0,0 +1,103 @@
+from time import perf_counter
+from typing import Any
+
+import orjson
+from django.core.management.base import CommandError, CommandParser
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.message_cache import MessageDict
+from zerver.lib.message_cache_codec import CODECS, MessageDictCodec, ZlibDictionaryCodec
+from zerver.models import Message
+
+
+def sample_dictionary(samples: list[bytes], size: int) -> bytes:
+    # zlib only uses the last 32KiB of a dictionary; the most recent
+    # messages go last, where they're cheapest to refer to.
+    return b"".join(samples)[-size:]
+
+
+class Command(ZulipBaseCommand):
+    help = """Compares the codecs for compressing message_dict cache entries, on
+a realm's recent messages.
+
+For each codec, reports the compression and decompression throughput
+(in MB of JSON per second), the bytes stored in memcached, and the
+fraction of those saved relative to the original zlib encoding.  As an
+upper bound on what a dictionary trained on the realm's own messages
+would save, also compares a dictionary of the older half of the
+sample, on the newer half."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        self.add_realm_args(parser, required=True)
+        parser.add_argument("--messages", help="Messages to sample", default=2000, type=int)
+        parser.add_argument("--reps", help="Passes over the sample", default=5, type=int)
+        parser.add_argument(
+            "--dictionary-size",
+            help="Size of the dictionary built from the sample",
+            default=32 * 1024,
+            type=int,
+        )
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        realm = self.get_realm(options)
+        assert realm is not None
+        message_ids = list(
+            Message.objects.filter(realm_id=realm.id)
+            .order_by("-id")
+            .values_list("id", flat=True)[: options["messages"]]
+        )
+        if len(message_ids) < 2:
+            raise CommandError("The realm needs at least 2 messages to sample.")
+        message_dicts = sorted(MessageDict.ids_to_dict(message_ids), key=lambda row: row["id"])
+        samples = [orjson.dumps(message_dict) for message_dict in message_dicts]
+
+        # Every codec is measured on the newer half of the sample, so
+        # that the sample dictionary isn't built from the same messages.
+        training, test = samples[: len(samples) // 2], samples[len(samples) // 2 :]
+        codecs: list[MessageDictCodec] = [
+            *CODECS,
+            # The tag is never read; it's only counted in the size.
+            ZlibDictionaryCodec(
+                "zlib_realm_sample",
+                b"\xff",
+                sample_dictionary(training, options["dictionary_size"]),
+            ),
+        ]
+        json_bytes = sum(len(sample) for sample in test)
+        print(f"{len(test)} messages, {json_bytes} bytes of JSON\n")
+        print(
+            f"{'Codec':<20} {'compress MB/s':>14} {'decompress MB/s':>16} "
+            f"{'bytes':>10} {'mean':>7} {'saved':>7}"
+        )
+        zlib_bytes = None
+        for codec in codecs:
+            compressed = [codec.tag + codec.compress(sample) for sample in test]
+            for sample, blob in zip(test, compressed, strict=True):
+                assert codec.decompress(blob[len(codec.tag) :]) == sample
+
+            start = perf_counter()
+            for _ in range(options["reps"]):
+                for sample in test:
+                    codec.compress(sample)
+            compress_time = perf_counter() - start
+
+            payloads = [blob[len(codec.tag) :] for blob in compressed]
+            start = perf_counter()
+            for _ in range(options["reps"]):
+                for payload in payloads:
+                    codec.decompress(payload)
+            decompress_time = perf_counter() - start
+
+            stored_bytes = sum(len(blob) for blob in compressed)
+            if zlib_bytes is None:
+                zlib_bytes = stored_bytes
+            print(
+                f"{codec.name:<20} "
+                f"{options['reps'] * json_bytes / compress_time / 1e6:>14.1f} "
+                f"{options['reps'] * json_bytes / decompress_time / 1e6:>16.1f} "
+                f"{stored_bytes:>10} {stored_bytes / len(test):>7.1f} "
+                f"{100 * (1 - stored_bytes / zlib_bytes):>6.1f}%"
+            )
@@ -3,12 +3,13 @@ from collections.abc import Iterator
 from typing import Any
 
 import orjson
+from django.conf import settings
 from django.core.management.base import CommandParser
 from django.db.models import QuerySet
 from typing_extensions import override
 
 from zerver.lib.management import ZulipBaseCommand
-from zerver.lib.markdown import render_message_markdown
+from zerver.lib.markdown.render_pool import render_messages_in_parallel
 from zerver.models import Message
 
 
@@ -32,6 +33,11 @@ class Command(ZulipBaseCommand):
         parser.add_argument("destination", help="Destination file path")
         parser.add_argument("--amount", default=100000, help="Number of messages to render")
         parser.add_argument("--latest_id", default=0, help="Last message id to render")
+        parser.add_argument(
+            "--processes",
+            default=settings.DEFAULT_DATA_EXPORT_IMPORT_PARALLELISM,
+            help="Number of processes to render messages with",
+        )
 
     @override
     def handle(self, *args: Any, **options: Any) -> None:
@@ -42,8 +48,9 @@ class Command(ZulipBaseCommand):
         if not os.path.exists(dest_dir):
             os.makedirs(dest_dir)
 
-        with open(options["destination"], "wb") as result:
-            messages = Message.objects.filter(id__gt=latest - amount, id__lte=latest).order_by("id")
+        messages = Message.objects.filter(id__gt=latest - amount, id__lte=latest).order_by("id")
+
+        def original_contents() -> Iterator[tuple[int, str]]:
             for message in queryset_iterator(messages):
                 content = message.content
                 # In order to ensure that the output of this tool is
@@ -58,11 +65,18 @@ class Command(ZulipBaseCommand):
                         if "prev_content" in entry:
                             content = entry["prev_content"]
                             break
+                yield message.id, content
+
+        realm_ids = list(messages.order_by().values_list("realm_id", flat=True).distinct())
+        with open(options["destination"], "wb") as result:
+            for message_id, rendered_content in render_messages_in_parallel(
+                original_contents(), processes=int(options["processes"]), realm_ids=realm_ids
+            ):
                 result.write(
                     orjson.dumps(
                         {
-                            "id": message.id,
-                            "content": render_message_markdown(message, content),
+                            "id": message_id,
+                            "content": rendered_content,
                         },
                         option=orjson.OPT_APPEND_NEWLINE,
                     )
@@ -0,0 +1,67 @@
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import CommandParser
+from django.db import transaction
+from typing_extensions import override
+
+from zerver.lib.management import ZulipBaseCommand
+from zerver.lib.user_message import UserMessageLite, bulk_insert_um_arrays, bulk_insert_um_values
+from zerver.models import Message, UserMessage
+
+
+class Command(ZulipBaseCommand):
+    help = """Times the strategies bulk_insert_ums uses to insert the UserMessage rows
+for a message with many recipients.
+
+The rows reference nonexistent users and messages; this works since
+foreign key constraints are only checked on commit, and every insert
+is rolled back."""
+
+    @override
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--recipients",
+            help="Numbers of recipients to time",
+            default=[1000, 10000, 50000],
+            nargs="+",
+            type=int,
+        )
+        parser.add_argument("--reps", help="Messages to insert per timing", default=5, type=int)
+
+    @override
+    def handle(self, *args: Any, **options: Any) -> None:
+        first_message_id = (
+            Message.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        ) + 1
+        flags = int(UserMessage.flags.read)
+
+        def insert_values(message_id: int, recipients: int) -> None:
+            bulk_insert_um_values(
+                [UserMessageLite(user_id, message_id, flags) for user_id in range(recipients)]
+            )
+
+        def insert_arrays(message_id: int, recipients: int) -> None:
+            ums = [UserMessageLite(user_id, message_id, flags) for user_id in range(recipients)]
+            bulk_insert_um_arrays(
+                [um.user_profile_id for um in ums],
+                [um.message_id for um in ums],
+                [um.flags for um in ums],
+            )
+
+        for recipients in options["recipients"]:
+            for name, insert in [("VALUES", insert_values), ("UNNEST", insert_arrays)]:
+                with transaction.atomic(durable=True):
+                    message_ids = iter(range(first_message_id, first_message_id + options["reps"]))
+                    duration = timeit(
+                        lambda insert=insert, message_ids=message_ids, recipients=recipients: (
+                            insert(next(message_ids), recipients)
+                        ),
+                        number=options["reps"],
+                    )
+                    # Don't leave the rows behind, or check their foreign keys.
+                    transaction.set_rollback(True)
+                print(
+                    f"{recipients} recipients, {name}: "
+                    f"{1000 * duration / options['reps']:.1f}ms/message"
+                )
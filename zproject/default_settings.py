@@ -208,6 +208,35 @@ REMOTE_POSTGRES_SSLMODE = ""
 
 TORNADO_PORTS: list[int] = []
 USING_TORNADO = True
+# Maximum number of notify_tornado events which Tornado processes as
+# a single batch; waiting get_events requests are only finished once
+# per batch.  Must not exceed the TornadoQueueClient prefetch count.
+TORNADO_NOTIFICATION_BATCH_SIZE = 100
+# Whether sending a message leaves the work which doesn't affect its
+# delivery (triggering outgoing webhook and embedded bots, fetching
+# link previews, and following topics for mentioned users) to the
+# deferred_message_work queue worker, rather than doing it before
+# responding.
+DEFER_MESSAGE_SEND_WORK = False
+# Whether the rendered HTML for message content which doesn't mention
+# users, groups, or channels is cached, keyed by the content and the
+# realm's Markdown configuration.
+MARKDOWN_RENDER_CACHE = True
+# Total size, in bytes, of the message dicts which each process keeps
+# in memory, in front of memcached, for serving messages; 0 disables
+# this cache.
+MESSAGE_DICT_LOCAL_CACHE_BYTES = 16 * 1024 * 1024
+# How message dicts are compressed in memcached; see CODECS in
+# zerver/lib/message_cache_codec.py.  Entries written with any codec
+# can be read, but "zlib" is the only one older Zulip versions can.
+MESSAGE_DICT_CACHE_CODEC = "zlib_dictionary_v1"
+# Whether the queries for fetching messages are run as server-side
+# prepared statements, so that PostgreSQL needn't plan them each time.
+# Prepared statements last for the database session, so this can't be
+# used with a connection pooler in transaction mode (e.g. PgBouncer's
+# pool_mode = transaction).  PostgreSQL may also switch to a generic
+# plan for a statement, which can be slower for unusual narrows.
+PREPARE_MESSAGE_FETCH_QUERIES = False
 
 # ToS/Privacy templates
 POLICIES_DIRECTORY: str = "zerver/policies_absent"
@@ -148,6 +148,9 @@ S3_AVATAR_BUCKET = "test-avatar-bucket"
 S3_EXPORT_BUCKET = "test-export-bucket"
 
 INLINE_URL_EMBED_PREVIEW = False
+# Many tests render the same content several times with different
+# mocks of the rendering dependencies.
+MARKDOWN_RENDER_CACHE = False
 
 HOME_NOT_LOGGED_IN = "/login/"
 LOGIN_URL = "/accounts/login/"